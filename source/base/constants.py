@@ -61,6 +61,8 @@ Scenario_Folder = extend(Data_Folder, 'scenarios')
 Core_Scenario_Folder = extend(Scenario_Folder, 'core')
 Scenario_Ruleset_Folder = extend(Scenario_Folder, 'rules')
 Scenario_Ruleset_Standard_File = extend(Scenario_Ruleset_Folder, 'standard.rules')
+# index of the headers of all core scenarios (created by the server, therefore may not exist)
+Core_Scenario_Index_File = os.path.join(Core_Scenario_Folder, 'scenarios.index')
 # Saved_Scenario_Folder = extend(Scenario_Folder, 'saved')
 
 # music related folders
@@ -119,6 +121,19 @@ O.BG_MUTE.default = False
 # predefined channel names for network communication
 CH_SCENARIO_PREVIEW = 'general.scenario.preview'
 CH_CORE_SCENARIO_TITLES = 'general.core.scenarios.titles'
+# replies to requests all go to this channel
+CH_RPC_REPLY = 'rpc.reply'
+# requests the requester is not interested in anymore
+CH_RPC_CANCEL = 'rpc.cancel'
+# heartbeat requests (answered automatically)
+CH_PING = 'rpc.ping'
+
+# typical letters (for the preset compression dictionary, must be the same on both sides), most common last
+Network_Typical_Letters = [
+    {'channel': CH_CORE_SCENARIO_TITLES, 'content': {'request-id': 1}},
+    {'channel': CH_SCENARIO_PREVIEW, 'content': {'scenario': 'scenario', 'request-id': 1}},
+    {'channel': CH_RPC_REPLY, 'content': {'request-id': 1, 'result': {'scenarios': [['Europe 1814', 'scenario']]}}}
+]
 
 
 class TileDirections(u.AutoNumberedEnum):
@@ -14,15 +14,134 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+from collections import deque
+import time
+
 from PySide import QtCore
 
 from lib.network import Client
+import lib.protocol as protocol
+from base import constants as c
 
 """
     Using Signals of Qt, we refine on the network Client class in lib/network.py. Channels are introduced which have
     names and a signal to connect/disconnect to.
 """
 
+# must be the same on both sides
+PRESET_DICTIONARY = protocol.create_preset_dictionary(c.Network_Typical_Letters)
+
+
+def broadcast(clients, channel_name, message, compression):
+    """
+        Sends the same letter to many clients (NetworkClient). The letter is encoded and compressed (with the given
+        compression policy, the preset dictionary must be the same as the one of the clients) only once for each codec
+        in use and then the same frame is queued (or streamed if large, see lib.network.Client.send()) for every
+        client.
+    """
+    letter = {
+        'channel': channel_name,
+        'content': message
+    }
+    # frame and uncompressed size by codec
+    frames = {}
+    for client in clients:
+        if not client.negotiated:
+            # not yet known how to encode it, the client holds it back
+            client.send(channel_name, message)
+            continue
+        policy = client.channel_policies.get(channel_name)
+        if client.throttled and policy == 'drop':
+            client.dropped += 1
+            continue
+        if client.codec not in frames:
+            raw_bytes = compression.raw_bytes
+            frame = protocol.encode_frame(letter, client.codec, compression=compression)
+            frames[client.codec] = (frame, compression.raw_bytes - raw_bytes)
+        frame, raw_size = frames[client.codec]
+        immediate = channel_name in client.immediate_channels
+        large = len(frame) > client.stream_threshold or raw_size > client.decoder.max_frame_size
+        if large and not immediate:
+            client.send_stream(frame, channel_name)
+        else:
+            client.write_frame(frame, immediate, channel_name, policy)
+
+
+class Dispatcher(QtCore.QObject):
+    """
+        Schedules the delivery of received letters (of any number of NetworkClients) to their channels by priority
+        class of the channel (HIGH, NORMAL (default) or LOW). Letters are queued per class and delivered in the next
+        event loop iterations, the higher classes first (in order of arrival within a class). Per iteration at most
+        time_budget (seconds) is spent, the rest waits for the next iteration so that other events are not blocked.
+
+        Requests cancelled while queued are not delivered. Queue depths, number of dispatched letters and wait times
+        are recorded per class.
+    """
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+    def __init__(self, time_budget=0.01):
+        super().__init__()
+        self.time_budget = time_budget
+        # replies, cancels and heartbeats are small and latency critical
+        self.priorities = {c.CH_RPC_REPLY: Dispatcher.HIGH, c.CH_RPC_CANCEL: Dispatcher.HIGH,
+                           c.CH_PING: Dispatcher.HIGH}
+        self.queues = (deque(), deque(), deque())
+        self.timings = [{'count': 0, 'wait_time': 0, 'max_wait_time': 0} for _ in self.queues]
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.dispatch)
+
+    def set_priority(self, channel_name, priority):
+        self.priorities[channel_name] = priority
+
+    def schedule(self, client, channel_name, content):
+        """
+            Queues a received letter for delivery (client.deliver()).
+        """
+        priority = self.priorities.get(channel_name, Dispatcher.NORMAL)
+        self.queues[priority].append((time.perf_counter(), client, channel_name, content))
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def discard(self, client):
+        """
+            Drops all queued letters of a client (for example when it disconnected).
+        """
+        for queue in self.queues:
+            letters = [letter for letter in queue if letter[1] is not client]
+            queue.clear()
+            queue.extend(letters)
+
+    def dispatch(self):
+        """
+            Delivers queued letters, highest priority class first, until the queues are empty or the time budget is
+            used up.
+        """
+        start = time.perf_counter()
+        for queue, timing in zip(self.queues, self.timings):
+            while queue:
+                now = time.perf_counter()
+                if now - start > self.time_budget:
+                    # continue in the next iteration
+                    self.timer.start()
+                    return
+                queued, client, channel_name, content = queue.popleft()
+                wait_time = now - queued
+                timing['count'] += 1
+                timing['wait_time'] += wait_time
+                timing['max_wait_time'] = max(timing['max_wait_time'], wait_time)
+                client.deliver(channel_name, content)
+
+    def stats(self):
+        """
+            Per priority class: queue depth, number of dispatched letters, total and maximal wait time (seconds).
+        """
+        return [dict(timing, depth=len(queue)) for queue, timing in zip(self.queues, self.timings)]
+
 
 class NetworkClient(Client):
     """
@@ -33,15 +152,47 @@ class NetworkClient(Client):
 
         This is kind of a service-subscription pattern and allows for reducing complexity and decoupling of the message
         transport and message processing.
+
+        On top there are requests (remote procedure calls): a request gets a unique id (per connection), the receiver
+        answers with reply() and the reply is given to the callback of the request. Any number of requests can be in
+        flight, all replies arrive on the same channel and are matched by the id. Large replies are streamed and their
+        progress is reported by request_progress (request id, bytes received, total bytes).
+
+        Cancelled requests are also cancelled at the receiver: request_cancelled (this client, request id) is emitted
+        there (for stopping the work) and the reply is not sent anymore.
+
+        Received letters are given to the channels right away or, if a dispatcher (see Dispatcher) is set, scheduled
+        by the priority of their channel.
     """
 
+    request_progress = QtCore.Signal(int, int, int)
+    request_cancelled = QtCore.Signal(object, int)
+
     def __init__(self):
         """
             We start with an empty channels list.
         """
-        super().__init__()
+        # with the preset dictionary even small letters compress well
+        super().__init__(compression=protocol.CompressionPolicy(threshold=64, zdict=PRESET_DICTIONARY))
         self.received.connect(self.process)
         self.channels = {}
+        # names of channels whose letters are written right away instead of being batched
+        self.immediate_channels = set()
+        # backpressure policies ('drop' or 'coalesce') by channel name
+        self.channel_policies = {}
+        # requests waiting for a reply by id
+        self.pending_requests = {}
+        self.request_counter = 0
+        # ids of received requests not yet answered
+        self.incoming_requests = set()
+        # if set, received letters are delivered by priority
+        self.dispatcher = None
+        self.connect_to_channel(c.CH_RPC_REPLY, self.received_reply)
+        self.connect_to_channel(c.CH_RPC_CANCEL, self.received_cancel)
+        # heartbeats are answered right away
+        self.connect_to_channel(c.CH_PING, self.received_ping)
+        self.set_immediate_channel(c.CH_PING)
+        self.stream_progress.connect(self.received_stream_progress)
 
     def create_new_channel(self, channel_name):
         """
@@ -86,7 +237,7 @@ class NetworkClient(Client):
             A message was received from the underlying Client framework. It's a dictionary with keys 'channel' and
             'content'.
 
-            Get the corresponding Channel object and emit its received signal.
+            Deliver it to the channel now or schedule it with the dispatcher.
         """
         channel_name = message['channel']
 
@@ -94,15 +245,67 @@ class NetworkClient(Client):
         if channel_name not in self.channels:
             raise RuntimeError('Channel with this name not existing.')
 
+        # remember received requests (until answered or cancelled)
+        content = message['content']
+        if self.is_request(channel_name, content):
+            self.incoming_requests.add(content['request-id'])
+
+        if self.dispatcher is not None:
+            self.dispatcher.schedule(self, channel_name, content)
+        else:
+            self.deliver(channel_name, content)
+
+    def deliver(self, channel_name, content):
+        """
+            Get the corresponding Channel object and emit its received signal (unless the channel was removed or the
+            request was cancelled meanwhile).
+        """
+        if channel_name not in self.channels:
+            return
+        if self.is_request(channel_name, content) and content['request-id'] not in self.incoming_requests:
+            # cancelled while waiting for delivery
+            return
+
         # send to channel and increase counter
         self.channels[channel_name].message_counter += 1
-        self.channels[channel_name].received.emit(self, message['content'])
+        self.channels[channel_name].received.emit(self, content)
 
         # note: channel with name channel_name may now already not be existing anymore (may be removed during processing)
 
-    def send(self, channel_name, message=None):
+    @staticmethod
+    def is_request(channel_name, content):
         """
-            Given a channel name and a message (optional) wraps them in one dict (a letter) and send it.
+            True if a received letter is a request (has a request id). Replies and cancels refer to requests by their
+            id but are no requests themselves.
+        """
+        return (channel_name not in (c.CH_RPC_REPLY, c.CH_RPC_CANCEL) and isinstance(content, dict) and
+                'request-id' in content)
+
+    def set_immediate_channel(self, channel_name, immediate=True):
+        """
+            Letters to an immediate channel (latency critical) are written right away together with everything still
+            queued, instead of being batched until the next event loop iteration.
+        """
+        if immediate:
+            self.immediate_channels.add(channel_name)
+        else:
+            self.immediate_channels.discard(channel_name)
+
+    def set_channel_policy(self, channel_name, policy=None):
+        """
+            While this client is throttled (the other side reads too slowly), letters to channels with policy 'drop'
+            are dropped and of letters to channels with policy 'coalesce' only the latest one is sent afterwards (for
+            example state updates). Letters to all other channels (policy None) are always sent.
+        """
+        if policy is not None:
+            self.channel_policies[channel_name] = policy
+        else:
+            self.channel_policies.pop(channel_name, None)
+
+    def send(self, channel_name, message=None, label=None):
+        """
+            Given a channel name and a message (optional) wraps them in one dict (a letter) and send it. If the letter
+            is streamed, the progress on the other side is reported with the label (default is the channel name).
         """
         # wrap content
         letter = {
@@ -110,7 +313,102 @@ class NetworkClient(Client):
             'content': message
         }
         # send
-        super().send(letter)
+        super().send(letter, channel_name in self.immediate_channels, channel_name if label is None else label,
+                     self.channel_policies.get(channel_name))
+
+    def request(self, channel_name, message, callback, timeout=None, failed=None):
+        """
+            Sends a request (message is a dict) to a channel. When the reply arrives, callback is called with this
+            client and the result (like a channel receiver). If the receiver answers with an error or a timeout (ms) is
+            given and no reply arrived until then, the request is dropped and failed (if given) is called with the
+            request id and the error ('timeout' for timeouts).
+
+            Returns the request id.
+        """
+        self.request_counter += 1
+        request_id = self.request_counter
+        message = dict(message) if message is not None else {}
+        message['request-id'] = request_id
+        self.pending_requests[request_id] = (callback, failed)
+        if timeout is not None:
+            QtCore.QTimer.singleShot(timeout, lambda: self.request_timed_out(request_id))
+        self.send(channel_name, message)
+        return request_id
+
+    def cancel_request(self, request_id):
+        """
+            We are not interested in the reply of a request anymore, tell the receiver so that it can stop working on
+            it. Does nothing if the request is not pending.
+        """
+        if self.pending_requests.pop(request_id, None) is not None:
+            self.send(c.CH_RPC_CANCEL, {'request-id': request_id})
+
+    def received_cancel(self, client, message):
+        """
+            The other side cancelled one of its requests. If not yet answered, it will not be answered anymore.
+        """
+        request_id = message['request-id']
+        if request_id in self.incoming_requests:
+            self.incoming_requests.remove(request_id)
+            self.request_cancelled.emit(self, request_id)
+
+    def request_timed_out(self, request_id):
+        """
+            The timeout of a request is over. If it's still pending, drop it and tell the requester.
+        """
+        if request_id in self.pending_requests:
+            callback, failed = self.pending_requests.pop(request_id)
+            if failed is not None:
+                failed(request_id, 'timeout')
+
+    def received_reply(self, client, message):
+        """
+            A reply to a request arrived, give the result (or the error) to the callback (if still pending).
+        """
+        entry = self.pending_requests.pop(message['request-id'], None)
+        if entry is not None:
+            callback, failed = entry
+            if 'error' not in message:
+                callback(self, message['result'])
+            elif failed is not None:
+                failed(message['request-id'], message['error'])
+
+    def received_ping(self, client, message):
+        """
+            A heartbeat request, just answer it (the round trip time is measured by the other side).
+        """
+        self.reply(message, None)
+
+    def received_stream_progress(self, label, received, size):
+        """
+            Progress of a streamed letter. If it's the reply to one of our pending requests, report the progress of the
+            request.
+        """
+        if label in self.pending_requests:
+            self.request_progress.emit(label, received, size)
+
+    def reply(self, message, result):
+        """
+            Answers a received request message with a result. Messages without request id are answered the old way, by
+            sending the result to the channel given in the message (key = 'reply-to').
+        """
+        if 'request-id' in message:
+            if message['request-id'] not in self.incoming_requests:
+                # cancelled
+                return
+            self.incoming_requests.remove(message['request-id'])
+            # labeled with the request id, for the progress of large replies
+            self.send(c.CH_RPC_REPLY, {'request-id': message['request-id'], 'result': result}, message['request-id'])
+        else:
+            self.send(message['reply-to'], result)
+
+    def reply_error(self, message, error):
+        """
+            Answers a received request message with an error (a string) instead of a result.
+        """
+        if 'request-id' in message and message['request-id'] in self.incoming_requests:
+            self.incoming_requests.remove(message['request-id'])
+            self.send(c.CH_RPC_REPLY, {'request-id': message['request-id'], 'error': error})
 
 
 class Channel(QtCore.QObject):
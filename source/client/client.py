@@ -22,6 +22,7 @@ from PySide import QtGui, QtCore
 
 import lib.graphics as g
 import lib.utils as u
+from lib.geometry import grid_outlines
 from lib.browser import BrowserWidget
 import base.tools as t
 import base.constants as c
@@ -290,8 +291,6 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         If a nation is selected the nation_selected signal is emitted with the nation name.
     """
 
-    CH_PREVIEW = 'SP.scenario-selection.preview'
-
     nation_selected = QtCore.Signal(str)
 
     def __init__(self, scenario_file):
@@ -301,11 +300,9 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         """
         super().__init__()
 
-        # add a channel for us
-        network_client.connect_to_channel(self.CH_PREVIEW, self.received_preview)
-
-        # send a message and ask for preview
-        network_client.send(c.CH_SCENARIO_PREVIEW, {'scenario': scenario_file, 'reply-to': self.CH_PREVIEW})
+        # ask for the preview
+        self.request_id = network_client.request(c.CH_SCENARIO_PREVIEW, {'scenario': scenario_file},
+                                                 self.received_preview)
 
         self.selected_nation = None
 
@@ -313,9 +310,6 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         """
             Populates the widget after the network reply comes from the server with the preview.
         """
-        # immediately close the channel, we do not want to get this message twice
-        network_client.remove_channel(self.CH_PREVIEW)
-
         # fill the widget with useful stuff
         layout = QtGui.QGridLayout(self)
 
@@ -386,6 +380,12 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         self.map_name_item.setZValue(3)
         self.map_name_item.setPos(0, 0)
 
+        # nation outlines (computed by the server, only compute them here if the server did not send them)
+        if 'outlines' in message:
+            outlines = message['outlines']
+        else:
+            outlines = grid_outlines(message['map'], columns, rows, ignore=-1)
+
         # for all nations
         for nation_id, nation in message['nations'].items():
 
@@ -398,13 +398,7 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
             nation_name = nation['name']
 
             # get nation outline
-            path = QtGui.QPainterPath()
-            # TODO traversing everything is quite slow go only once and add to paths
-            for column in range(0, columns):
-                for row in range(0, rows):
-                    if nation_id == message['map'][column + row * columns]:
-                        path.addRect(column, row, 1, 1)
-            path = path.simplified()
+            path = g.create_path_from_polygons(outlines.get(nation_id, []))
 
             item = MiniMapNationItem(path, 1, 2)
             item.clicked.connect(partial(self.map_selected_nation, u.find_in_list(nation_names, nation_name)))
@@ -453,8 +447,8 @@ class SinglePlayerScenarioPreview(QtGui.QWidget):
         """
             Interruption. Clean up network channels and the like.
         """
-        # network channel might still be open
-        network_client.remove_channel(self.CH_PREVIEW, ignore_not_existing=True)
+        # the request might still be pending
+        network_client.cancel_request(self.request_id)
 
 
 class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
@@ -466,8 +460,6 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
 
     title_selected = QtCore.Signal(str)  # make sure to only connect with QtCore.Qt.QueuedConnection to this signal
 
-    CH_TITLES = 'SP.scenario-selection.titles'
-
     def __init__(self):
         """
 
@@ -476,11 +468,8 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
         self.setTitle('Select Scenario')
         QtGui.QVBoxLayout(self)  # just set a standard layout
 
-        # add a channel for us
-        network_client.connect_to_channel(self.CH_TITLES, self.received_titles)
-
-        # send message and ask for scenario titles
-        network_client.send(c.CH_CORE_SCENARIO_TITLES, {'reply-to': self.CH_TITLES})
+        # ask for scenario titles
+        self.request_id = network_client.request(c.CH_CORE_SCENARIO_TITLES, None, self.received_titles)
 
     def received_titles(self, client, message):
         """
@@ -488,9 +477,6 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
             which act as unique identifiers. The list is sorted by title.
         """
 
-        # immediately close the channel, we do not want to get this message twice
-        network_client.remove_channel(self.CH_TITLES)
-
         # unpack message
         scenario_titles, self.scenario_files = zip(*message['scenarios'])
 
@@ -523,8 +509,8 @@ class SinglePlayerScenarioTitleSelection(QtGui.QGroupBox):
         """
             Interruption. Clean up network channels and the like.
         """
-        # network channel might still be open
-        network_client.remove_channel(self.CH_TITLES, ignore_not_existing=True)
+        # the request might still be pending
+        network_client.cancel_request(self.request_id)
 
 
 class OptionsContentWidget(QtGui.QWidget):
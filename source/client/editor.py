@@ -20,6 +20,7 @@ import math
 from PySide import QtGui, QtCore
 
 import lib.graphics as g
+from lib.geometry import grid_runs
 import base.tools as t
 import base.constants as c
 from base.constants import PropertyKeyNames as k
@@ -43,6 +44,19 @@ NEW_SCENARIO_DEFAULT_PROPERTIES = {
 }
 
 
+def nation_color(scenario, nation):
+    """
+        The color of a nation (light gray as long as the nation has no color).
+    """
+    color = QtGui.QColor(QtCore.Qt.lightGray)
+    try:
+        color.setNamedColor(scenario.get_nation_property(nation, 'color'))
+    except RuntimeError:
+        # no color yet
+        pass
+    return color
+
+
 class EditorScenario(Scenario):
     """
         As a small wrapper this is a Scenario with a everything_changed signal that is emitted, if a new scenario is loaded.
@@ -124,14 +138,30 @@ class EditorMiniMap(QtGui.QWidget):
 
         # store scenario
         self.scenario = scenario
-        self.removable_items = []
+
+        # the map is a single pixmap (two pixels per tile) scaled to the scene, below the tracker
+        self.map_item = QtGui.QGraphicsPixmapItem()
+        self.map_item.setZValue(0)
+        self.scene.addItem(self.map_item)
+        # the map images (QImage with a color table) of each mode, rendered when needed and then updated in place
+        self.images = {}
+
+        # many small changes (for example a stroke with the terrain brush) only lead to a single pixmap update
+        self.redraw_timer = QtCore.QTimer()
+        self.redraw_timer.setSingleShot(True)
+        self.redraw_timer.setInterval(100)
+        self.redraw_timer.timeout.connect(self.show_map)
+
+        # the map is only shown once its geometry is known (see redraw_map())
+        self.map_ready = False
 
         # and switch to political mode
+        self.map_mode = 'political'
         action_political.setChecked(True)
 
     def redraw_map(self):
         """
-            The map is not yet drawn or has changed or the mode has changed. Redraw it.
+            The map is not yet drawn or has changed completely. Redraw it.
         """
 
         # adjust view height
@@ -142,88 +172,106 @@ class EditorMiniMap(QtGui.QWidget):
         self.scene.setSceneRect(0, 0, 1, 1)
         self.view.fitInView(self.scene.sceneRect())  # simple and should work
 
-        tile_width = round(1 / (columns + 0.5), 3)
-        tile_height = round(1 / rows, 3)
-
-        # remove everything except tracker from the scene
-        for item in self.removable_items:
-            self.scene.removeItem(item)
-        self.removable_items = []
+        # scale the map pixmap (2 * columns + 1 pixels wide, rows pixels high) to the scene
+        self.map_item.setTransform(QtGui.QTransform.fromScale(1 / (2 * columns + 1), 1 / rows))
+        self.tracker.setPos(0, 0)
 
-        if self.map_mode is 'political':
+        # forget the images of all modes, only the current one is rendered now
+        self.images = {}
+        self.map_ready = True
+        self.show_map()
 
-            # fill the ground layer with a neutral color
-            item = self.scene.addRect(0, 0, 1, 1)
-            item.setBrush(QtCore.Qt.lightGray)
-            item.setPen(g.TRANSPARENT_PEN)
-            item.setZValue(0)
-            self.removable_items.extend([item])
-            self.tracker.setPos(0, 0)
+    def show_map(self):
+        """
+            Shows the image of the current mode (rendered if not yet available).
+        """
+        if not self.map_ready:
+            return
+        if self.map_mode not in self.images:
+            self.images[self.map_mode] = self.render_image(self.map_mode)
+        self.map_item.setPixmap(QtGui.QPixmap.fromImage(self.images[self.map_mode]))
 
-            # draw the nation borders and content (non-smooth)
+    def render_image(self, mode):
+        """
+            Renders the whole map of a mode into an image, directly from the flat terrain or province map with a color
+            lookup table.
+        """
+        columns = self.scenario[k.MAP_COLUMNS]
+        rows = self.scenario[k.MAP_ROWS]
 
-            # for all nations
+        if mode is 'political':
+            # index 0 is the neutral color (no nation), nation i has index i + 1
+            colors = [QtGui.QColor(QtCore.Qt.lightGray)] * (max(self.scenario.all_nations(), default=-1) + 2)
             for nation in self.scenario.all_nations():
-                # get nation color
-                color_string = self.scenario.get_nation_property(nation, 'color')
-                color = QtGui.QColor()
-                color.setNamedColor(color_string)
-                # get all provinces
-                provinces = self.scenario.get_provinces_of_nation(nation)
-                tiles = []
-                # get all tiles
-                for province in provinces:
-                    tiles.extend(self.scenario.get_province_property(province, 'tiles'))
-                # get rectangular path for each tile
-                path = QtGui.QPainterPath()
-                for tile in tiles:
-                    sx, sy = self.scenario.scene_position(*tile)
-                    path.addRect(sx * tile_width, sy * tile_height, tile_width, tile_height)
-                # simply (creates outline)
-                path = path.simplified()
-                # create a brush from the color
-                brush = QtGui.QBrush(color)
-                item = self.scene.addPath(path, brush=brush)  # will use the default pen for outline
-                item.setZValue(1)
-                self.removable_items.extend([item])
-
-        elif self.map_mode is 'geographical':
-
-            # fill the background with sea (blue)
-            item = self.scene.addRect(0, 0, 1, 1)
-            item.setBrush(QtCore.Qt.blue)
-            item.setPen(g.TRANSPARENT_PEN)
-            item.setZValue(0)
-            self.removable_items.extend([item])
-
-            # six terrains left, plains, hills, mountains, tundra, swamp, desert
-
-            # go through each position
-            paths = {}
-            for t in range(1, 7):
-                paths[t] = QtGui.QPainterPath()
-            for column in range(0, columns):
-                for row in range(0, rows):
-                    t = self.scenario.terrain_at(column, row)
-                    if t != 0:
-                        # not for sea
-                        sx, sy = self.scenario.scene_position(column, row)
-                        paths[t].addRect(sx * tile_width, sy * tile_height, tile_width, tile_height)
-            colors = {
-                1: QtCore.Qt.green,
-                2: QtCore.Qt.darkGreen,
-                3: QtCore.Qt.darkGray,
-                4: QtCore.Qt.white,
-                5: QtCore.Qt.darkYellow,
-                6: QtCore.Qt.yellow
-            }
-            for t in paths:
-                path = paths[t]
-                path = path.simplified()
-                brush = QtGui.QBrush(colors[t])
-                item = self.scene.addPath(path, brush=brush, pen=g.TRANSPARENT_PEN)
-                item.setZValue(1)
-                self.removable_items.extend([item])
+                colors[nation + 1] = nation_color(self.scenario, nation)
+            indices = g.lookup_color_indices(self.scenario.province_map(), self.province_color_lookup())
+            return g.create_staggered_grid_image(indices, columns, rows, colors)
+
+        elif mode is 'geographical':
+            # the terrain (sea, plains, hills, mountains, tundra, swamp, desert) is the color index
+            colors = [QtGui.QColor(color) for color in (QtCore.Qt.blue, QtCore.Qt.green, QtCore.Qt.darkGreen,
+                                                        QtCore.Qt.darkGray, QtCore.Qt.white, QtCore.Qt.darkYellow,
+                                                        QtCore.Qt.yellow)]
+            return g.create_staggered_grid_image(self.scenario.terrain_map(), columns, rows, colors)
+
+    def province_color_lookup(self):
+        """
+            Color index (in the political image) of every province, the additional last entry is for no province.
+        """
+        lookup = [0] * (len(self.scenario.all_provinces()) + 1)
+        for nation in self.scenario.all_nations():
+            for province in self.scenario.get_provinces_of_nation(nation):
+                lookup[province] = nation + 1
+        return lookup
+
+    def update_province_pixels(self, province):
+        """
+            Sets the pixels of all tiles of a province in the political image to the color of its nation.
+        """
+        image = self.images['political']
+        nation = self.scenario.get_province_property(province, 'nation')
+        index = nation + 1 if nation is not None else 0
+        for column, row in self.scenario.get_tiles_of_province(province):
+            g.set_staggered_grid_pixel(image, column, row, index)
+
+    def terrain_changed(self, column, row):
+        """
+            The terrain of a tile changed. Update the geographical image (if rendered) and show it soon.
+        """
+        if 'geographical' in self.images:
+            g.set_staggered_grid_pixel(self.images['geographical'], column, row,
+                                       self.scenario.terrain_at(column, row))
+            self.schedule_redraw()
+
+    def province_tile_changed(self, province, column, row):
+        """
+            A tile was added to a province. Update its pixel in the political image (if rendered) and show it soon.
+        """
+        if 'political' in self.images:
+            nation = self.scenario.get_province_property(province, 'nation')
+            g.set_staggered_grid_pixel(self.images['political'], column, row, nation + 1 if nation is not None else 0)
+            self.schedule_redraw()
+
+    def nation_changed(self, nation):
+        """
+            A nation changed (color or provinces). Update the political image (if rendered) and show it soon.
+        """
+        if 'political' in self.images:
+            image = self.images['political']
+            if nation + 1 < image.colorCount():
+                image.setColor(nation + 1, nation_color(self.scenario, nation).rgb())
+                for province in self.scenario.get_provinces_of_nation(nation):
+                    self.update_province_pixels(province)
+            else:
+                # a new nation, not in the color table, render again
+                del self.images['political']
+            self.schedule_redraw()
+
+    def schedule_redraw(self):
+        """
+            Shows the changed image soon (once for all the changes until then).
+        """
+        self.redraw_timer.start()
 
     def toggled_political(self, checked):
         """
@@ -232,7 +280,7 @@ class EditorMiniMap(QtGui.QWidget):
         if checked is True:
             # self.map_mode should be 'geographical'
             self.map_mode = 'political'
-            self.redraw_map()
+            self.show_map()
 
     def toggled_geographical(self, checked):
         """
@@ -241,7 +289,7 @@ class EditorMiniMap(QtGui.QWidget):
         if checked is True:
             # self.map_mode should be 'political'
             self.map_mode = 'geographical'
-            self.redraw_map()
+            self.show_map()
 
     def mousePressEvent(self, event):
         """
@@ -275,13 +323,25 @@ class EditorMiniMap(QtGui.QWidget):
         self.tracker.show()
 
 
-class EditorMainMap(QtGui.QGraphicsView):
+class EditorMainMap(g.ZoomableGraphicsView):
     """
         The big map holding the game map and everything.
+
+        Zoomable with three levels of detail: everything, without names and coordinates (zoomed out) and only terrain
+        with the nations as a coarse raster (far zoomed out). The coarser levels are also rendered with a lower
+        resolution.
     """
 
     tile_at_focus_changed = QtCore.Signal(int, int)
 
+    # size of a chunk in tiles (in both directions)
+    CHUNK_SIZE = 8
+
+    # zooming and levels of detail (resolution of the chunk pixmaps for each level)
+    MinScaling = 0.05
+    DetailThresholds = (0.5, 0.2)
+    DETAIL_RESOLUTIONS = (1, 0.5, 0.125)
+
     def __init__(self, scenario):
         super().__init__()
 
@@ -290,19 +350,26 @@ class EditorMainMap(QtGui.QGraphicsView):
         self.setObjectName('map')
         self.setHorizontalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
         self.setVerticalScrollBarPolicy(QtCore.Qt.ScrollBarAlwaysOff)
-        self.setTransformationAnchor(QtGui.QGraphicsView.NoAnchor)
         self.setResizeAnchor(QtGui.QGraphicsView.NoAnchor)
         self.setMouseTracking(True)
         self.current_column = -1
         self.current_row = -1
         self.TILE_SIZE = 80
         self.scenario = scenario
+        self.cached_chunks = set()
+        # chunks are rendered again with the new level of detail when painted the next time
+        self.level_of_detail_changed.connect(lambda level: self.viewport().update())
 
     def redraw_map(self):
         """
             When a scenario is loaded new we need to draw the whole map new.
+
+            The map is split into chunks of CHUNK_SIZE x CHUNK_SIZE tiles (see lib.graphics.CachedChunkItem). Chunks
+            are only drawn when they become visible and cached as pixmaps, chunks far away from the visible area are
+            evicted again. The scene only holds the chunk items.
         """
         self.scene.clear()
+        self.cached_chunks = set()
 
         columns = self.scenario[k.MAP_COLUMNS]
         rows = self.scenario[k.MAP_ROWS]
@@ -313,144 +380,339 @@ class EditorMainMap(QtGui.QGraphicsView):
 
         # TODO should load only once and cache (universal cache)
         # load all textures
-        brushes = {}
-        brushes[0] = QtGui.QBrush(QtGui.QColor(64, 64, 255))
-        brushes[1] = QtGui.QBrush(QtGui.QColor(64, 255, 64))
-        brushes[2] = QtGui.QBrush(QtGui.QColor(64, 255, 64))
-        brushes[3] = QtGui.QBrush(QtGui.QColor(64, 255, 64))
-        brushes[4] = QtGui.QBrush(QtGui.QColor(222, 222, 222))
-        brushes[5] = QtGui.QBrush(QtGui.QColor(0, 128, 0))
-        brushes[6] = QtGui.QBrush(QtGui.QColor(222, 222, 0))
+        self.brushes = {}
+        self.brushes[0] = QtGui.QBrush(QtGui.QColor(64, 64, 255))
+        self.brushes[1] = QtGui.QBrush(QtGui.QColor(64, 255, 64))
+        self.brushes[2] = QtGui.QBrush(QtGui.QColor(64, 255, 64))
+        self.brushes[3] = QtGui.QBrush(QtGui.QColor(64, 255, 64))
+        self.brushes[4] = QtGui.QBrush(QtGui.QColor(222, 222, 222))
+        self.brushes[5] = QtGui.QBrush(QtGui.QColor(0, 128, 0))
+        self.brushes[6] = QtGui.QBrush(QtGui.QColor(222, 222, 0))
+        self.city_pixmap = QtGui.QPixmap(c.extend(c.Graphics_Map_Folder, 'city.png'))
+
+        # rivers
+        # TODO get rivers via a method (generator)
+        self.river_paths = [self.create_river_path(river) for river in self.scenario._properties['rivers']]
+
+        # nation colors and the nations map for the borders
+        self.nation_colors = {}
+        for nation in self.scenario.all_nations():
+            self.nation_colors[nation] = nation_color(self.scenario, nation)
+        self.nation_map = self.scenario.nation_map()
+        # the coarse nations raster for far zoom levels, rendered when needed
+        self.nation_image = None
+
+        # towns
+        self.update_towns()
+
+        # create the chunks (nothing is drawn yet)
+        chunk_length = self.CHUNK_SIZE * self.TILE_SIZE
+        for chunk_y in range(0, math.ceil(height / chunk_length)):
+            for chunk_x in range(0, math.ceil(width / chunk_length)):
+                x = chunk_x * chunk_length
+                y = chunk_y * chunk_length
+                rect = QtCore.QRectF(x, y, min(chunk_length, width - x), min(chunk_length, height - y))
+                item = g.CachedChunkItem(rect, self.draw_chunk, self.cached_chunks, self.chunk_detail)
+                self.scene.addItem(item)
+
+    def create_river_path(self, river):
+        """
+            A river is drawn as a line through the centers of its tiles.
+        """
+        tiles = river['tiles']
+        path = QtGui.QPainterPath()
+        for tile in tiles:
+            sx, sy = self.scenario.scene_position(tile[0], tile[1])
+            x = (sx + 0.5) * self.TILE_SIZE
+            y = (sy + 0.5) * self.TILE_SIZE
+            if tile == tiles[0]:
+                path.moveTo(x, y)
+            else:
+                path.lineTo(x, y)
+        return path
+
+    def update_towns(self):
+        """
+            Collects the towns (position of the center of the town tile and province name) of all provinces belonging
+            to a nation.
+        """
+        self.towns = []
+        for nation in self.scenario.all_nations():
+            for province in self.scenario.get_provinces_of_nation(nation):
+                try:
+                    column, row = self.scenario.get_province_property(province, 'town_location')
+                except RuntimeError:
+                    # no town yet
+                    continue
+                sx, sy = self.scenario.scene_position(column, row)
+                name = self.scenario.get_province_property(province, 'name')
+                self.towns.append(((sx + 0.5) * self.TILE_SIZE, (sy + 0.5) * self.TILE_SIZE, name))
+
+    def invalidate_rect(self, rect):
+        """
+            Invalidates all chunks intersecting a rectangle (scene coordinates). They are redrawn if visible.
+        """
+        for item in self.scene.items(rect):
+            if isinstance(item, g.CachedChunkItem):
+                item.invalidate()
+
+    def invalidate_tiles(self, tiles, margin=1):
+        """
+            Invalidates all chunks intersecting the bounding rectangle of some tiles plus a margin of tiles (borders
+            are drawn from both sides).
+        """
+        if not tiles:
+            return
+        xs = [self.scenario.scene_position(column, row)[0] for column, row in tiles]
+        ys = [row for column, row in tiles]
+        rect = QtCore.QRectF(min(xs) * self.TILE_SIZE, min(ys) * self.TILE_SIZE,
+                             (max(xs) - min(xs) + 1) * self.TILE_SIZE, (max(ys) - min(ys) + 1) * self.TILE_SIZE)
+        self.invalidate_rect(rect.adjusted(-margin * self.TILE_SIZE, -margin * self.TILE_SIZE, margin * self.TILE_SIZE,
+                                           margin * self.TILE_SIZE))
+
+    def province_region(self, province):
+        """
+            All tiles of a province plus the town location (the name of the town reaches a bit further).
+        """
+        tiles = list(self.scenario.get_tiles_of_province(province))
+        try:
+            column, row = self.scenario.get_province_property(province, 'town_location')
+            tiles.extend([[column - 2, row], [column + 2, row]])
+        except RuntimeError:
+            # no town yet
+            pass
+        return tiles
+
+    def terrain_changed(self, column, row):
+        """
+            The terrain of a single tile changed, only redraw the chunk(s) of this tile.
+        """
+        self.invalidate_tiles([[column, row]], margin=0)
+
+    def province_changed(self, province):
+        """
+            The properties (name, town location) of a province changed. Update the towns and redraw the chunks around
+            the province.
+        """
+        self.update_towns()
+        self.invalidate_tiles(self.province_region(province))
+
+    def province_tile_changed(self, province, column, row):
+        """
+            A tile was added to a province. Update the nations map for this tile and redraw the chunks around it
+            (borders).
+        """
+        nation = self.scenario.get_province_property(province, 'nation')
+        self.nation_map[self.scenario.map_index(column, row)] = nation if nation is not None else -1
+        if self.nation_image is not None:
+            g.set_staggered_grid_pixel(self.nation_image, column, row, nation + 1 if nation is not None else 0)
+        self.invalidate_tiles([[column, row]])
+
+    def nation_changed(self, nation):
+        """
+            The properties or provinces of a nation changed. Update color, nations map and towns and redraw the chunks
+            around all the provinces of the nation.
+        """
+        self.nation_colors[nation] = nation_color(self.scenario, nation)
+        region = []
+        for province in self.scenario.get_provinces_of_nation(nation):
+            for column, row in self.scenario.get_tiles_of_province(province):
+                self.nation_map[self.scenario.map_index(column, row)] = nation
+            region.extend(self.province_region(province))
+        # the color may have changed, render the nations raster again when needed
+        self.nation_image = None
+        self.update_towns()
+        self.invalidate_tiles(region)
+
+    def river_changed(self, river):
+        """
+            A river was added or changed, only redraw the chunks it crosses (before and after).
+        """
+        path = self.create_river_path(self.scenario._properties['rivers'][river])
+        rect = path.boundingRect()
+        if river < len(self.river_paths):
+            rect = rect.united(self.river_paths[river].boundingRect())
+            self.river_paths[river] = path
+        else:
+            self.river_paths.append(path)
+        self.invalidate_rect(rect.adjusted(-5, -5, 5, 5))
+
+    def chunk_detail(self):
+        """
+            Current level of detail and resolution for rendering chunks.
+        """
+        return self.level_of_detail, self.DETAIL_RESOLUTIONS[self.level_of_detail]
+
+    def nations_raster(self):
+        """
+            The nations map as an indexed image (see lib.graphics.create_staggered_grid_image()) in the nation colors,
+            tiles without a nation are transparent. Rendered when needed and then updated in place.
+        """
+        if self.nation_image is None:
+            # index 0 is transparent (no nation), nation i has index i + 1, the last lookup entry is for nation -1
+            size = max(self.scenario.all_nations(), default=-1) + 2
+            lookup = list(range(1, size)) + [0]
+            colors = [QtGui.QColor(QtCore.Qt.transparent)] * size
+            for nation, color in self.nation_colors.items():
+                colors[nation + 1] = color
+            indices = g.lookup_color_indices(self.nation_map, lookup)
+            image = g.create_staggered_grid_image(indices, self.scenario[k.MAP_COLUMNS], self.scenario[k.MAP_ROWS],
+                                                  colors)
+            # the color table of create_staggered_grid_image() is opaque
+            image.setColorTable([color.rgba() for color in colors])
+            self.nation_image = image
+        return self.nation_image
+
+    def tiles_in_rect(self, rect, margin=0):
+        """
+            Yields all tiles (column, row) that intersect a rectangle (scene coordinates), plus a margin of tiles in
+            every direction.
+        """
+        columns = self.scenario[k.MAP_COLUMNS]
+        rows = self.scenario[k.MAP_ROWS]
+        first_row = max(0, math.floor(rect.top() / self.TILE_SIZE) - margin)
+        last_row = min(rows, math.ceil(rect.bottom() / self.TILE_SIZE) + margin)
+        for row in range(first_row, last_row):
+            offset = (row % 2) / 2
+            first_column = max(0, math.floor(rect.left() / self.TILE_SIZE - offset) - margin)
+            last_column = min(columns, math.ceil(rect.right() / self.TILE_SIZE - offset) + margin)
+            for column in range(first_column, last_column):
+                yield column, row
+
+    def draw_chunk(self, painter, rect, level=0):
+        """
+            Draws everything (terrain, rivers, borders, towns and names, coordinates) inside a rectangle of the map
+            (scene coordinates). Everything outside the rectangle is clipped anyway.
+
+            Level of detail 1 leaves out names and coordinates, level 2 also rivers and towns and shows the nations as
+            a coarse raster instead of the borders.
+        """
+        columns = self.scenario[k.MAP_COLUMNS]
+        rows = self.scenario[k.MAP_ROWS]
+        size = self.TILE_SIZE
 
         # fill the ground layer with ocean
-        item = self.scene.addRect(0, 0, width, height, brush=brushes[0], pen=g.TRANSPARENT_PEN)
-        item.setZValue(0)
-
-        # fill plains, hills, mountains, tundra, swamp, desert with texture
-
-        # go through each position
-        paths = {}
-        for t in range(1, 7):
-            paths[t] = QtGui.QPainterPath()
-        for column in range(0, columns):
-            for row in range(0, rows):
-                t = self.scenario.terrain_at(column, row)
-                if t != 0:
-                    # not for sea
-                    sx, sy = self.scenario.scene_position(column, row)
-                    paths[t].addRect(sx * self.TILE_SIZE, sy * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
-        for t in paths:
-            path = paths[t]
-            path = path.simplified()
-            item = self.scene.addPath(path, brush=brushes[t], pen=g.TRANSPARENT_PEN)
-            item.setZValue(1)
+        painter.fillRect(rect, self.brushes[0])
+
+        # fill plains, hills, mountains, tundra, swamp, desert with texture, one rectangle per run of equal terrain in a
+        # row of the part of the terrain map below the rectangle (starting with an even row, so that staggering fits)
+        first_row = max(0, math.floor(rect.top() / size)) // 2 * 2
+        last_row = min(rows, math.ceil(rect.bottom() / size))
+        first_column = max(0, math.floor(rect.left() / size) - 1)
+        last_column = min(columns, math.ceil(rect.right() / size))
+        terrain = self.scenario.terrain_map()
+        part = b''.join(terrain[row * columns + first_column:row * columns + last_column] for row in
+                        range(first_row, last_row))
+        for t, x, y, width in grid_runs(part, last_column - first_column, last_row - first_row, stagger=True,
+                                        ignore=0):
+            painter.fillRect(QtCore.QRectF((first_column + x) * size, (first_row + y) * size, width * size, size),
+                             self.brushes[t])
 
         # fill the half tiles which are not part of the map
-        brush = QtGui.QBrush(QtCore.Qt.darkGray)
-        for row in range(0, rows):
-            if row % 2 == 0:
-                item = self.scene.addRect(columns * self.TILE_SIZE, row * self.TILE_SIZE, self.TILE_SIZE / 2,
-                                          self.TILE_SIZE, pen=g.TRANSPARENT_PEN)
-            else:
-                item = self.scene.addRect(0, row * self.TILE_SIZE, self.TILE_SIZE / 2, self.TILE_SIZE,
-                                          pen=g.TRANSPARENT_PEN)
-            item.setBrush(brush)
-            item.setZValue(1)
+        for row in range(math.floor(rect.top() / size), math.ceil(rect.bottom() / size)):
+            x = columns * size if row % 2 == 0 else 0
+            painter.fillRect(QtCore.QRectF(x, row * size, size / 2, size), QtCore.Qt.darkGray)
 
         # draw rivers
-        river_pen = QtGui.QPen(QtGui.QColor(64, 64, 255))
-        river_pen.setWidth(5)
-        # TODO get rivers via a method (generator)
-        for river in self.scenario._properties['rivers']:
-            tiles = river['tiles']
-            path = QtGui.QPainterPath()
-            for tile in tiles:
-                sx, sy = self.scenario.scene_position(tile[0], tile[1])
-                x = (sx + 0.5) * self.TILE_SIZE
-                y = (sy + 0.5) * self.TILE_SIZE
-                if tile == tiles[0]:
-                    path.moveTo(x, y)
-                else:
-                    path.lineTo(x, y)
-            item = self.scene.addPath(path, pen=river_pen)
-            item.setZValue(2)
+        if level < 2:
+            river_pen = QtGui.QPen(QtGui.QColor(64, 64, 255))
+            river_pen.setWidth(5)
+            painter.setPen(river_pen)
+            for path in self.river_paths:
+                painter.drawPath(path)
+
+        # far zoomed out: the nations raster (a pixel is half a tile wide) instead of borders computed tile by tile
+        if level >= 2:
+            source = QtCore.QRectF(rect.left() / (size / 2), rect.top() / size, rect.width() / (size / 2),
+                                   rect.height() / size)
+            painter.setOpacity(0.5)
+            painter.drawImage(rect, self.nations_raster(), source)
+            painter.setOpacity(1)
+            return
 
-        # draw province and nation borders
-        # TODO the whole border drawing is a crude approximiation, implement it the right way
+        # draw province and nation borders (for every tile the edges to neighbors of another province or nation)
+        province_lines = []
+        nation_lines = {}
+        province_map = self.scenario.province_map()
+        for column, row in self.tiles_in_rect(rect, margin=1):
+            index = self.scenario.map_index(column, row)
+            province = province_map[index]
+            nation = self.nation_map[index]
+            sx, sy = self.scenario.scene_position(column, row)
+            x = sx * size
+            y = sy * size
+            for direction, line in ((c.TileDirections.West, (x, y, x, y + size)),
+                                    (c.TileDirections.NorthWest, (x, y, x + size / 2, y)),
+                                    (c.TileDirections.NorthEast, (x + size / 2, y, x + size, y)),
+                                    (c.TileDirections.East, (x + size, y, x + size, y + size)),
+                                    (c.TileDirections.SouthEast, (x + size / 2, y + size, x + size, y + size)),
+                                    (c.TileDirections.SouthWest, (x, y + size, x + size / 2, y + size))):
+                position = self.scenario.get_neighbor_position(column, row, direction)
+                if position is None:
+                    # outside of the map, only draw if we are a province
+                    neighbor_province = neighbor_nation = -1
+                elif direction in (c.TileDirections.East, c.TileDirections.SouthEast, c.TileDirections.SouthWest):
+                    # the other three directions are drawn by the neighbor
+                    neighbor_index = self.scenario.map_index(*position)
+                    neighbor_province = province_map[neighbor_index]
+                    neighbor_nation = self.nation_map[neighbor_index]
+                else:
+                    continue
+                if province != neighbor_province:
+                    province_lines.append(QtCore.QLineF(*line))
+                if nation != neighbor_nation:
+                    border_nation = nation if nation != -1 else neighbor_nation
+                    nation_lines.setdefault(border_nation, []).append(QtCore.QLineF(*line))
         province_border_pen = QtGui.QPen(QtGui.QColor(QtCore.Qt.black))
         province_border_pen.setWidth(2)
+        painter.setPen(province_border_pen)
+        painter.drawLines(province_lines)
         nation_border_pen = QtGui.QPen()
         nation_border_pen.setWidth(4)
-        for nation in self.scenario.all_nations():
-            # get nation color
-            color = self.scenario.get_nation_property(nation, 'color')
-            nation_color = QtGui.QColor()
-            nation_color.setNamedColor(color)
-            # get all provinces
-            provinces = self.scenario.get_provinces_of_nation(nation)
-            nation_path = QtGui.QPainterPath()
-            # get all tiles
-            for province in provinces:
-                province_path = QtGui.QPainterPath()
-                tiles = self.scenario.get_province_property(province, 'tiles')
-                for column, row in tiles:
-                    sx, sy = self.scenario.scene_position(column, row)
-                    province_path.addRect(sx * self.TILE_SIZE, sy * self.TILE_SIZE, self.TILE_SIZE, self.TILE_SIZE)
-                province_path = province_path.simplified()
-                item = self.scene.addPath(province_path, pen=province_border_pen)
-                item.setZValue(4)
-                nation_path.addPath(province_path)
-            nation_path = nation_path.simplified()
-            nation_border_pen.setColor(nation_color)
-            item = self.scene.addPath(nation_path, pen=nation_border_pen)
-            item.setZValue(5)
-
-        # draw towns and names
-        city_pixmap = QtGui.QPixmap(c.extend(c.Graphics_Map_Folder, 'city.png'))
-        for nation in self.scenario.all_nations():
-            # get all provinces of this nation
-            provinces = self.scenario.get_provinces_of_nation(nation)
-            for province in provinces:
-                column, row = self.scenario.get_province_property(province, 'town_location')
-                sx, sy = self.scenario.scene_position(column, row)
-                # center city image on center of tile
-                x = (sx + 0.5) * self.TILE_SIZE - city_pixmap.width() / 2
-                y = (sy + 0.5) * self.TILE_SIZE - city_pixmap.height() / 2
-                item = self.scene.addPixmap(city_pixmap)
-                item.setOffset(x, y)
-                item.setZValue(6)
-                # display province name below
-                province_name = self.scenario.get_province_property(province, 'name')
-                item = self.scene.addSimpleText(province_name)
-                item.setPen(g.TRANSPARENT_PEN)
-                item.setBrush(QtGui.QBrush(QtCore.Qt.darkRed))
-                x = (sx + 0.5) * self.TILE_SIZE - item.boundingRect().width() / 2
-                y = (sy + 1) * self.TILE_SIZE - item.boundingRect().height()
-                item.setPos(x, y)
-                item.setZValue(6)
-                # display rounded rectangle below province name
-                bx = 8
-                by = 4
-                background = QtCore.QRectF(x - bx, y - by, item.boundingRect().width() + 2 * bx,
-                                           item.boundingRect().height() + 2 * by)
-                path = QtGui.QPainterPath()
-                path.addRoundRect(background, 50, 50)
-                item = self.scene.addPath(path, pen=g.TRANSPARENT_PEN,
-                                          brush=QtGui.QBrush(QtGui.QColor(128, 128, 255, 64)))
-                item.setZValue(5)
-
-        # draw the grid and the coordinates
-        for column in range(0, columns):
-            for row in range(0, rows):
-                sx, sy = self.scenario.scene_position(column, row)
-                # item = self.scene.addRect(sx * self.tile_size, sy * self.tile_size,  self.tile_size,  self.tile_size)
-                # item.setZValue(1000)
-                text = '({},{})'.format(column, row)
-                item = QtGui.QGraphicsSimpleTextItem(text)
-                item.setBrush(QtGui.QBrush(QtCore.Qt.black))
-                item.setPos((sx + 0.5) * self.TILE_SIZE - item.boundingRect().width() / 2, sy * self.TILE_SIZE)
-                item.setZValue(1001)
-                self.scene.addItem(item)
+        for nation, lines in nation_lines.items():
+            nation_border_pen.setColor(self.nation_colors[nation])
+            painter.setPen(nation_border_pen)
+            painter.drawLines(lines)
+
+        # draw towns and names (also of towns slightly outside, their names may reach into the rectangle)
+        metrics = painter.fontMetrics()
+        town_rect = rect.adjusted(-2 * size, -size, 2 * size, size)
+        for x, y, name in self.towns:
+            if not town_rect.contains(x, y):
+                continue
+            # center city image on center of tile
+            painter.drawPixmap(x - self.city_pixmap.width() / 2, y - self.city_pixmap.height() / 2, self.city_pixmap)
+            if level >= 1:
+                continue
+            # display province name below on a rounded rectangle
+            text_rect = QtCore.QRectF(x - metrics.width(name) / 2, y + size / 2 - metrics.height(), metrics.width(name),
+                                      metrics.height())
+            bx = 8
+            by = 4
+            painter.setPen(g.TRANSPARENT_PEN)
+            painter.setBrush(QtGui.QBrush(QtGui.QColor(128, 128, 255, 64)))
+            painter.drawRoundRect(text_rect.adjusted(-bx, -by, bx, by), 50, 50)
+            painter.setPen(QtGui.QPen(QtCore.Qt.darkRed))
+            painter.drawText(text_rect, QtCore.Qt.AlignCenter, name)
+
+        if level >= 1:
+            return
+
+        # draw the coordinates
+        painter.setPen(QtGui.QPen(QtCore.Qt.black))
+        for column, row in self.tiles_in_rect(rect):
+            sx, sy = self.scenario.scene_position(column, row)
+            painter.drawText(QtCore.QRectF(sx * size, sy * size, size, size),
+                             QtCore.Qt.AlignHCenter | QtCore.Qt.AlignTop, '({},{})'.format(column, row))
+
+    def scrollContentsBy(self, dx, dy):
+        """
+            The visible area changed. Evict all cached chunks that are far away (more than a view size).
+        """
+        super().scrollContentsBy(dx, dy)
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+        keep = visible.adjusted(-visible.width(), -visible.height(), visible.width(), visible.height())
+        g.evict_chunks(self.cached_chunks, keep)
 
     def get_bounds(self):
         """
@@ -749,6 +1011,16 @@ class EditorScreen(QtGui.QWidget):
         # whenever the scenario changes completely, update the editor
         self.scenario.everything_changed.connect(self.scenario_change)
 
+        # smaller changes only update the affected parts
+        self.scenario.terrain_changed.connect(self.map.terrain_changed)
+        self.scenario.province_changed.connect(self.map.province_changed)
+        self.scenario.province_tile_changed.connect(self.map.province_tile_changed)
+        self.scenario.nation_changed.connect(self.map.nation_changed)
+        self.scenario.river_changed.connect(self.map.river_changed)
+        self.scenario.terrain_changed.connect(self.mini_map.terrain_changed)
+        self.scenario.province_tile_changed.connect(self.mini_map.province_tile_changed)
+        self.scenario.nation_changed.connect(self.mini_map.nation_changed)
+
     def create_new_scenario(self, properties):
         """
             Create new scenario (from the create new scenario dialog).
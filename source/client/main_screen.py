@@ -17,6 +17,7 @@
 from PySide import QtGui
 
 import base.tools as t
+import lib.graphics as g
 
 """
     The main game screen.
@@ -32,14 +33,39 @@ class MiniMap(QtGui.QWidget):
         super().__init__()
 
 
-class MainMap(QtGui.QGraphicsView):
+class MainMap(g.ZoomableGraphicsView):
     """
-        Main map on the right side.
+        Main map on the right side. Zoomable with levels of detail, detail items (names, towns, ...) are hidden when
+        zoomed out further than their level.
     """
 
+    MinScaling = 0.05
+    DetailThresholds = (0.5, 0.2)
+
     def __init__(self):
         super().__init__()
 
+        self.scene = QtGui.QGraphicsScene()
+        self.setScene(self.scene)
+        # graphics item -> coarsest level of detail the item is still shown at
+        self.detail_items = {}
+        self.level_of_detail_changed.connect(self.show_details)
+
+    def add_detail_item(self, item, level):
+        """
+            Adds an item to the scene which is only visible up to a level of detail (0 means only at full detail).
+        """
+        self.scene.addItem(item)
+        self.detail_items[item] = level
+        item.setVisible(self.level_of_detail <= level)
+
+    def show_details(self, level):
+        """
+            The level of detail changed, show or hide the detail items.
+        """
+        for item, item_level in self.detail_items.items():
+            item.setVisible(level <= item_level)
+
 
 class InfoBox(QtGui.QWidget):
     """
@@ -0,0 +1,304 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+
+import lib.protocol as protocol
+
+# uvloop is optional, it's just a faster event loop
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+"""
+    Network functionality based on asyncio instead of Qt (for example for a headless dedicated server). Speaks the same
+    wire protocol (see lib/protocol.py) and offers the same channel semantics as lib/network.py and base/network.py.
+"""
+
+SCOPE = {
+    'local': '127.0.0.1',
+    'any': '0.0.0.0'
+}
+
+
+def new_event_loop():
+    """
+        A new event loop, from uvloop if available.
+    """
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+class Callbacks():
+    """
+        A list of callbacks with connect/disconnect/emit like a Qt signal (but without Qt).
+    """
+
+    def __init__(self):
+        self.callbacks = []
+
+    def connect(self, callback):
+        self.callbacks.append(callback)
+
+    def disconnect(self, callback):
+        self.callbacks.remove(callback)
+
+    def emit(self, *args):
+        for callback in list(self.callbacks):
+            callback(*args)
+
+
+class AsyncNetworkClient(asyncio.Protocol):
+    """
+        One connection (an asyncio protocol). Decodes frames incrementally, negotiates the codec, compresses according
+        to a compression policy, batches outgoing frames until the next event loop iteration and delivers letters to
+        channels (callbacks get this client and the content, like base.network.NetworkClient).
+
+        If initiate is True, the codecs are offered as soon as the connection is made (the connecting side does this).
+        Until the codec is negotiated, letters sent are held back and received frames other than control frames are
+        refused (the connection is aborted).
+
+        Streamed frames are received (and reassembled) but not sent, all frames are written as a whole.
+    """
+
+    def __init__(self, preferred_codecs=protocol.PREFERRED_CODECS, max_frame_size=protocol.MAX_FRAME_SIZE,
+                 compression=None, flush_size=64 * 1024, initiate=False, max_stream_size=protocol.MAX_STREAM_SIZE):
+        self.transport = None
+        self.decoder = protocol.FrameDecoder(max_frame_size)
+        self.assembler = protocol.StreamAssembler(max_stream_size, max_total_size=max_stream_size)
+        self.compression = compression if compression is not None else protocol.CompressionPolicy()
+        self.preferred_codecs = preferred_codecs
+        self.codec = protocol.YamlCodec
+        self.negotiated = False
+        self.unnegotiated_letters = []
+        self.initiate = initiate
+        self.send_queue = []
+        self.send_queue_size = 0
+        self.flush_size = flush_size
+        self.flush_scheduled = False
+        self.bytes_written = 0
+        self.channels = {}
+        self.immediate_channels = set()
+        self.connected = Callbacks()
+        self.disconnected = Callbacks()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.initiate:
+            self.send_control({'codecs': list(self.preferred_codecs)})
+        self.connected.emit(self)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.disconnected.emit(self)
+
+    def data_received(self, data):
+        """
+            Decodes all complete frames and processes them.
+        """
+        try:
+            frames = self.decoder.feed(data)
+        except RuntimeError:
+            # the stream is corrupt or the other side misbehaves, there is no way to recover
+            self.transport.abort()
+            raise
+        for frame in frames:
+            try:
+                max_size = self.decoder.max_frame_size
+                if protocol.is_chunk_frame(frame):
+                    frame = self.assembler.add(frame)[3]
+                    if frame is None:
+                        # the stream is not yet complete
+                        continue
+                    max_size = self.assembler.max_stream_size
+                value, control = protocol.decode_frame(frame, self.compression,
+                                                       (self.codec.id,) if self.negotiated else (), max_size)
+                if control:
+                    self.process_control(value)
+            except RuntimeError:
+                self.transport.abort()
+                raise
+            if not control:
+                self.process(value)
+
+    def process_control(self, value):
+        """
+            A control message (codec negotiation or stream announcement) was received. Raises a RuntimeError if it is
+            not valid.
+        """
+        if not isinstance(value, dict):
+            raise RuntimeError('Invalid control message {}.'.format(value))
+        if 'codecs' in value and not self.negotiated and isinstance(value['codecs'], list):
+            self.codec = protocol.negotiate_codec(value['codecs'], self.preferred_codecs)
+            self.send_control({'codec': self.codec.name})
+            self.codec_negotiated()
+        elif 'codec' in value and not self.negotiated:
+            if value['codec'] not in self.preferred_codecs:
+                raise RuntimeError('Codec {} was not offered.'.format(value['codec']))
+            self.codec = protocol.CODECS_BY_NAME[value['codec']]
+            self.codec_negotiated()
+        elif 'stream' in value and 'size' in value:
+            self.assembler.start(value['stream'], value['size'])
+        else:
+            raise RuntimeError('Unknown control message {}.'.format(value))
+
+    def codec_negotiated(self):
+        """
+            Sends the letters held back until now.
+        """
+        self.negotiated = True
+        letters = self.unnegotiated_letters
+        self.unnegotiated_letters = []
+        for letter in letters:
+            self.send(*letter)
+
+    def process(self, letter):
+        """
+            A letter (dictionary with keys 'channel' and 'content') was received. Give it to all callbacks of the
+            channel.
+        """
+        channel_name = letter['channel']
+        if channel_name not in self.channels:
+            raise RuntimeError('Channel with this name not existing.')
+        for callback in list(self.channels[channel_name]):
+            callback(self, letter['content'])
+
+    def connect_to_channel(self, channel_name, callback):
+        """
+            Connect a callback to a channel with a specific name (created if not yet existing).
+        """
+        self.channels.setdefault(channel_name, []).append(callback)
+
+    def disconnect_from_channel(self, channel_name, callback):
+        if channel_name not in self.channels:
+            raise RuntimeError('Channel with this name not existing.')
+        self.channels[channel_name].remove(callback)
+
+    def remove_channel(self, channel_name, ignore_not_existing=False):
+        if channel_name in self.channels:
+            del self.channels[channel_name]
+        elif not ignore_not_existing:
+            raise RuntimeError('Channel with this name not existing.')
+
+    def set_immediate_channel(self, channel_name, immediate=True):
+        if immediate:
+            self.immediate_channels.add(channel_name)
+        else:
+            self.immediate_channels.discard(channel_name)
+
+    def send(self, channel_name, message=None):
+        """
+            Given a channel name and a message (optional) wraps them in one dict (a letter) and send it.
+        """
+        if not self.negotiated:
+            self.unnegotiated_letters.append((channel_name, message))
+            return
+        letter = {
+            'channel': channel_name,
+            'content': message
+        }
+        self.write_frame(protocol.encode_frame(letter, self.codec, compression=self.compression),
+                         channel_name in self.immediate_channels)
+
+    def reply(self, message, result, reply_channel):
+        """
+            Answers a received request message with a result (see base.network.NetworkClient.reply).
+        """
+        if 'request-id' in message:
+            self.send(reply_channel, {'request-id': message['request-id'], 'result': result})
+        else:
+            self.send(message['reply-to'], result)
+
+    def reply_error(self, message, error, reply_channel):
+        """
+            Answers a received request message with an error (see base.network.NetworkClient.reply_error).
+        """
+        if 'request-id' in message:
+            self.send(reply_channel, {'request-id': message['request-id'], 'error': error})
+
+    def send_control(self, value):
+        self.write_frame(protocol.encode_frame(value, protocol.YamlCodec, control=True, compression=self.compression),
+                         immediate=True)
+
+    def write_frame(self, frame, immediate=False):
+        """
+            Queues an encoded frame. The queue is flushed if immediate or large enough, otherwise in the next event
+            loop iteration.
+        """
+        data = protocol.length_prefixed(frame)
+        self.send_queue.append(data)
+        self.send_queue_size += len(data)
+        if immediate or self.send_queue_size >= self.flush_size:
+            self.flush()
+        elif not self.flush_scheduled:
+            self.flush_scheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        """
+            Writes all queued frames in a single write to the transport.
+        """
+        self.flush_scheduled = False
+        if not self.send_queue or self.transport is None:
+            return
+        data = b''.join(self.send_queue) if len(self.send_queue) > 1 else self.send_queue[0]
+        self.send_queue = []
+        self.send_queue_size = 0
+        self.transport.write(data)
+        self.bytes_written += len(data)
+
+    def disconnect_from_host(self):
+        self.flush()
+        if self.transport is not None:
+            self.transport.close()
+
+    def stats(self):
+        stats = self.compression.stats()
+        stats['bytes_written'] = self.bytes_written
+        return stats
+
+
+class AsyncServer():
+    """
+        Listens for connections and emits new_client with a new client (created by the client factory) for each.
+    """
+
+    def __init__(self, client_factory=AsyncNetworkClient):
+        self.client_factory = client_factory
+        self.new_client = Callbacks()
+        self.server = None
+
+    async def start(self, port, scope='local'):
+        """
+            Starts listening (in the running event loop).
+        """
+        loop = asyncio.get_event_loop()
+        self.server = await loop.create_server(self.create_client, SCOPE[scope], port)
+
+    def create_client(self):
+        client = self.client_factory()
+        self.new_client.emit(client)
+        return client
+
+    def is_listening(self):
+        return self.server is not None and self.server.is_serving()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
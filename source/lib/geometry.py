@@ -0,0 +1,135 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from itertools import groupby
+
+"""
+    Geometry algorithms on flat (row after row) grids of values, only based on Python (not Qt).
+
+    Grids can be staggered, then every odd row is shifted half a tile to the right (like our game map). Internally
+    all x coordinates are in half tiles, so that staggered and non staggered grids can be handled the same way.
+"""
+
+
+def _expanded_row(values, row, columns, stagger):
+    """
+        Returns a row of a grid expanded to half tiles (every value twice), odd rows of staggered grids are shifted by
+        one half tile. Half tiles outside of the row are None.
+    """
+    offset = row % 2 if stagger else 0
+    start = row * columns
+    expanded = [None] * (2 * columns + 1)
+    expanded[offset:offset + 2 * columns:2] = values[start:start + columns]
+    expanded[offset + 1:offset + 2 * columns:2] = values[start:start + columns]
+    return expanded
+
+
+def _runs(sequence):
+    """
+        Run length encoding of a sequence. Yields (value, start, end) for every run of equal values.
+    """
+    start = 0
+    for value, group in groupby(sequence):
+        end = start + sum(1 for _ in group)
+        yield value, start, end
+        start = end
+
+
+def grid_outlines(values, columns, rows, stagger=False, ignore=None):
+    """
+        Computes the outlines of all regions of equal values in a grid (for example a nations map) in a single pass.
+
+        Returns a dictionary with a list of closed polygons (each a list of (x, y) points in tile units) for every
+        value except the ignored one. Outer borders run clockwise (on screen), holes counter-clockwise, so filling them
+        with the winding fill rule gives the correct regions. Points on straight lines are already removed.
+    """
+    edges = {}
+
+    def add_edge(value, start, end):
+        if value is not None and value != ignore:
+            edges.setdefault(value, {}).setdefault(start, []).append(end)
+
+    # vertical edges, only at the boundaries of runs of equal values in each row
+    for row in range(rows):
+        offset = row % 2 if stagger else 0
+        left = None
+        for value, start, end in _runs(values[row * columns:(row + 1) * columns]):
+            x = offset + 2 * start
+            if value != left:
+                add_edge(left, (x, row), (x, row + 1))  # right border of left region, downwards
+                add_edge(value, (x, row + 1), (x, row))  # left border of right region, upwards
+            left = value
+        x = offset + 2 * columns
+        add_edge(left, (x, row), (x, row + 1))
+
+    # horizontal edges between two rows (and above the first and below the last row), merged along runs
+    above = [None] * (2 * columns + 1)
+    for row in range(rows + 1):
+        below = _expanded_row(values, row, columns, stagger) if row < rows else [None] * (2 * columns + 1)
+        for (a, b), start, end in _runs(zip(above, below)):
+            if a != b:
+                add_edge(a, (end, row), (start, row))  # lower border of region above, to the left
+                add_edge(b, (start, row), (end, row))  # upper border of region below, to the right
+        above = below
+
+    # chain the edges to closed polygons and remove points on straight lines
+    outlines = {}
+    for value, value_edges in edges.items():
+        polygons = []
+        while value_edges:
+            first = next(iter(value_edges))
+            polygon = [first]
+            point = first
+            while True:
+                ends = value_edges[point]
+                next_point = ends.pop()
+                if not ends:
+                    del value_edges[point]
+                if next_point == first:
+                    break
+                polygon.append(next_point)
+                point = next_point
+            polygons.append(_simplified(polygon))
+        outlines[value] = polygons
+    return outlines
+
+
+def _simplified(polygon):
+    """
+        Removes all points of a closed, axis aligned polygon that lie on a straight line between their neighbors and
+        converts the x coordinates from half tiles to tiles.
+    """
+    simplified = []
+    n = len(polygon)
+    for i in range(n):
+        (px, py), (x, y), (nx, ny) = polygon[i - 1], polygon[i], polygon[(i + 1) % n]
+        if (px == x == nx) or (py == y == ny):
+            continue
+        simplified.append((x / 2, y))
+    return simplified
+
+
+def grid_runs(values, columns, rows, stagger=False, ignore=None):
+    """
+        Run length encoding of a grid. Yields (value, x, y, width) in tile units for every horizontal run of equal
+        values in every row (except runs of the ignored value). Runs of odd rows are shifted by half a tile if
+        staggered.
+    """
+    for row in range(rows):
+        offset = 0.5 if stagger and row % 2 == 1 else 0
+        for value, start, end in _runs(values[row * columns:(row + 1) * columns]):
+            if value != ignore:
+                yield value, start + offset, row, end - start
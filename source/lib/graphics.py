@@ -15,9 +15,16 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
 from datetime import datetime
+import math
 
 from PySide import QtCore, QtGui
 
+# NumPy is optional, without it the (slower) pure Python fallbacks are used
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 """
     Graphics (Qt) based objects and algorithms that do not depend specifically on the project but only on Qt.
 
@@ -373,13 +380,153 @@ class ZStackingManager():
             self._floors[z].set_zvalue(z)
 
 
+class CachedChunkItem(QtGui.QGraphicsItem):
+    """
+        A rectangular part (chunk) of a large scene. The content is drawn by a draw function (given a QPainter and the
+        rectangle of the chunk in scene coordinates) only when the chunk is painted the first time (which Qt only does
+        if it is visible) and then cached as a QPixmap until the chunk is invalidated or evicted.
+
+        Cached chunks are registered in a set (if given), so that somebody can evict the ones far away.
+
+        Optionally a detail function returns the current level of detail (given to the draw function) and the
+        resolution (pixmap pixels per scene unit) to draw with. If they change, the chunk is drawn again.
+    """
+
+    def __init__(self, rect, draw, cached_chunks=None, detail=None):
+        """
+            Given the rectangle (QRectF, scene coordinates), the draw function (painter, rect, level of detail) and
+            optionally a set of cached chunks and a detail function.
+        """
+        super().__init__()
+        self.rect = rect
+        self.draw = draw
+        self.cached_chunks = cached_chunks
+        self.detail = detail if detail is not None else lambda: (0, 1)
+        self.pixmap = None
+        self.pixmap_detail = None
+
+    def boundingRect(self):
+        """
+            Just the chunk rectangle.
+        """
+        return self.rect
+
+    def paint(self, painter, option, widget=None):
+        """
+            Draws the content into the pixmap if not yet cached (or cached with another level of detail) and then just
+            paints the pixmap.
+        """
+        detail = self.detail()
+        if self.pixmap is None or detail != self.pixmap_detail:
+            level, resolution = detail
+            self.pixmap = QtGui.QPixmap(math.ceil(self.rect.width() * resolution),
+                                        math.ceil(self.rect.height() * resolution))
+            self.pixmap.fill(QtCore.Qt.transparent)
+            pixmap_painter = QtGui.QPainter(self.pixmap)
+            pixmap_painter.scale(resolution, resolution)
+            pixmap_painter.translate(-self.rect.x(), -self.rect.y())
+            pixmap_painter.setClipRect(self.rect)
+            self.draw(pixmap_painter, self.rect, level)
+            pixmap_painter.end()
+            self.pixmap_detail = detail
+            if self.cached_chunks is not None:
+                self.cached_chunks.add(self)
+        painter.drawPixmap(self.rect, self.pixmap, QtCore.QRectF(self.pixmap.rect()))
+
+    def evict(self):
+        """
+            Frees the cached pixmap, it will be drawn again the next time the chunk is painted.
+        """
+        self.pixmap = None
+        if self.cached_chunks is not None:
+            self.cached_chunks.discard(self)
+
+    def invalidate(self):
+        """
+            The content has changed, evict and schedule a repaint.
+        """
+        self.evict()
+        self.update()
+
+
+def evict_chunks(cached_chunks, keep_rect):
+    """
+        Evicts all cached chunks (see CachedChunkItem) that do not intersect a rectangle (scene coordinates, typically
+        the visible area plus some margin).
+    """
+    for chunk in list(cached_chunks):
+        if not chunk.rect.intersects(keep_rect):
+            chunk.evict()
+
+
+def lookup_color_indices(values, lookup):
+    """
+        Maps a flat grid of integer values (for example a province map) to color indices (bytes, one per value) with a
+        lookup table (list). Negative values index from the end of the lookup table.
+    """
+    if numpy is not None:
+        return numpy.array(lookup, dtype=numpy.uint8)[numpy.asarray(values)].tobytes()
+    return bytes(map(lookup.__getitem__, values))
+
+
+def create_staggered_grid_image(indices, columns, rows, colors, background=0):
+    """
+        Creates an indexed QImage of a staggered grid from a flat grid of color indices (bytes like, one per tile) and a
+        color table (list of QColor). Every tile is two pixels wide and odd rows are shifted by one pixel, so the image
+        is 2 * columns + 1 pixels wide. The half tiles outside of the grid get the background color index.
+
+        Use set_staggered_grid_pixel() for later updates of single tiles.
+    """
+    width = 2 * columns + 1
+    stride = (width + 3) // 4 * 4  # scan lines of a QImage are 32 bit aligned
+    if numpy is not None:
+        grid = numpy.frombuffer(bytes(indices), dtype=numpy.uint8).reshape(rows, columns)
+        pixels = numpy.full((rows, stride), background, dtype=numpy.uint8)
+        pixels[0::2, 0:2 * columns:2] = grid[0::2]
+        pixels[0::2, 1:2 * columns:2] = grid[0::2]
+        pixels[1::2, 1:width:2] = grid[1::2]
+        pixels[1::2, 2:width:2] = grid[1::2]
+        data = pixels.tobytes()
+    else:
+        indices = bytes(indices)
+        pixels = bytearray([background]) * (rows * stride)
+        for row in range(rows):
+            tiles = indices[row * columns:(row + 1) * columns]
+            start = row * stride + row % 2
+            pixels[start:start + 2 * columns:2] = tiles
+            pixels[start + 1:start + 2 * columns:2] = tiles
+        data = bytes(pixels)
+    # copy, so the image does not depend on the lifetime of data
+    image = QtGui.QImage(data, width, rows, stride, QtGui.QImage.Format_Indexed8).copy()
+    image.setColorTable([color.rgb() for color in colors])
+    return image
+
+
+def set_staggered_grid_pixel(image, column, row, index):
+    """
+        Sets the color index of a single tile in an image created by create_staggered_grid_image().
+    """
+    x = 2 * column + row % 2
+    image.setPixel(x, row, index)
+    image.setPixel(x + 1, row, index)
+
+
 class ZoomableGraphicsView(QtGui.QGraphicsView):
     """
         QtGui.QGraphicsView where you can zoom around the current mouse position with the mouse wheel.
+
+        Has levels of detail (0 is the full detail, higher levels are coarser). Whenever the scaling (relative to the
+        standard scale) falls below one of the DetailThresholds (descending) the next coarser level is used. To avoid
+        flickering back and forth, the scaling has to cross a threshold by a relative margin (DetailHysteresis) before
+        the level changes. Connect to level_of_detail_changed to show or hide details.
     """
     ScaleFactor = 1.15
     MinScaling = 0.5
     MaxScaling = 2
+    DetailThresholds = ()
+    DetailHysteresis = 0.1
+
+    level_of_detail_changed = QtCore.Signal(int)
 
     def __init__(self, *args, **kwargs):
         """
@@ -388,6 +535,25 @@ class ZoomableGraphicsView(QtGui.QGraphicsView):
         super().__init__(*args, **kwargs)
         self.setTransformationAnchor(QtGui.QGraphicsView.AnchorUnderMouse)
         self.standard_scale = 1
+        self.level_of_detail = 0
+
+    def update_level_of_detail(self):
+        """
+            Given the current scaling, determine the level of detail (with hysteresis) and emit level_of_detail_changed
+            if it changed.
+        """
+        scaling = self.transform().m11() / self.standard_scale
+        thresholds = self.DetailThresholds
+        level = self.level_of_detail
+        # coarser
+        while level < len(thresholds) and scaling < thresholds[level] * (1 - self.DetailHysteresis):
+            level += 1
+        # finer
+        while level > 0 and scaling > thresholds[level - 1] * (1 + self.DetailHysteresis):
+            level -= 1
+        if level != self.level_of_detail:
+            self.level_of_detail = level
+            self.level_of_detail_changed.emit(level)
 
     def wheelEvent(self, event):
         """
@@ -396,16 +562,17 @@ class ZoomableGraphicsView(QtGui.QGraphicsView):
         current_scale = self.transform().m11()  # horizontal scaling factor = vertical scaling factor
         if event.delta() > 0:
             # we are zooming in
-            f = ZoomableGraphicsView.ScaleFactor
-            if current_scale * f > ZoomableGraphicsView.MaxScaling * self.standard_scale:
+            f = self.ScaleFactor
+            if current_scale * f > self.MaxScaling * self.standard_scale:
                 return
         else:
             # we are zooming out
-            f = 1 / ZoomableGraphicsView.ScaleFactor
-            if current_scale * f < ZoomableGraphicsView.MinScaling * self.standard_scale:
+            f = 1 / self.ScaleFactor
+            if current_scale * f < self.MinScaling * self.standard_scale:
                 return
         # scale
         self.scale(f, f)
+        self.update_level_of_detail()
 
         super().wheelEvent(event)
 
@@ -577,6 +744,19 @@ class ClockLabel(QtGui.QLabel):
 TRANSPARENT_PEN = QtGui.QPen(QtCore.Qt.transparent)
 
 
+def create_path_from_polygons(polygons, scale_x=1, scale_y=1):
+    """
+        Given a list of closed polygons (each a list of (x, y) points, for example from lib.geometry.grid_outlines)
+        creates a QPainterPath with winding fill rule (so holes are respected). Coordinates are scaled if wished.
+    """
+    path = QtGui.QPainterPath()
+    path.setFillRule(QtCore.Qt.WindingFill)
+    for polygon in polygons:
+        path.addPolygon(QtGui.QPolygonF([QtCore.QPointF(x * scale_x, y * scale_y) for x, y in polygon]))
+        path.closeSubpath()
+    return path
+
+
 def create_action(icon, text, parent, trigger_connection=None, toggle_connection=None, checkable=False):
     """
         Shortcut for creation of an action and wiring.
@@ -14,14 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import zlib
-
-import yaml
 from PySide import QtCore, QtNetwork
 
+import lib.protocol as protocol
+
 """
-    Basic general network functionality (client and server) wrapping around QtNetwork.QTcpSocket. Messages are sent using
-    yaml (for serialization) and zlib (for compression).
+    Basic general network functionality (client and server) wrapping around QtNetwork.QTcpSocket. Messages are sent as
+    frames of the wire protocol (see lib/protocol.py), the codec for serialization is negotiated after connecting and
+    each connection has its own compression policy (with statistics).
 """
 
 SCOPE = {
@@ -34,20 +34,81 @@ class Client(QtCore.QObject):
     """
         Wrapper around QtNetwork.QTcpSocket (set it from outside via set_socket(..)).
 
-        Additionally sends and reads messages via serialization (yaml), compression (zlib) and wrapping (QByteArray).
+        Additionally sends and reads messages via serialization (negotiated codec), compression (zlib) and wrapping
+        (QByteArray).
+
+        The connecting side offers its preferred codecs as soon as it is connected, the other side chooses one. Until
+        then only control frames are exchanged, messages sent before are held back and other received frames are
+        refused (the connection is aborted).
+
+        Outgoing frames are queued and written together in a single socket write once per event loop iteration (or as
+        soon as flush_size bytes are queued). Frames sent with immediate=True (and control frames) flush the queue
+        right away.
+
+        Frames larger than stream_threshold are streamed: split into chunks of chunk_size which are only written when
+        the socket has written the previous ones, so that other messages in between are not held up. The receiver
+        emits stream_progress (label given when sending, bytes received, total bytes) for every chunk. At most
+        protocol.MAX_STREAMS streams with together at most max_stream_size bytes are incomplete at the same time
+        (further ones wait), more are refused when receiving.
+
+        Backpressure: when more than high_watermark bytes wait in the socket to be written (a slow receiver), the
+        client is throttled (throttle_changed(True)) until they are down to low_watermark (throttle_changed(False)).
+        Meanwhile frames sent with policy 'drop' are dropped and of frames sent with policy 'coalesce' only the latest
+        one per label is kept and written afterwards. If more than max_buffered bytes pile up anyway, the receiver
+        cannot keep up and the connection is aborted.
     """
     connected = QtCore.Signal()
     disconnected = QtCore.Signal()
     error = QtCore.Signal(QtNetwork.QAbstractSocket.SocketError)
     received = QtCore.Signal(object)
+    stream_progress = QtCore.Signal(object, int, int)
+    throttle_changed = QtCore.Signal(bool)
 
-    def __init__(self):
+    def __init__(self, preferred_codecs=protocol.PREFERRED_CODECS, max_frame_size=protocol.MAX_FRAME_SIZE,
+                 compression=None, flush_size=64 * 1024, stream_threshold=2 ** 20, chunk_size=protocol.CHUNK_SIZE,
+                 max_stream_size=protocol.MAX_STREAM_SIZE, high_watermark=2 ** 20, low_watermark=256 * 1024,
+                 max_buffered=32 * 2 ** 20):
         """
-            Initially we do not have any socket and no bytes are written.
+            Initially we do not have any socket and no bytes are written. Optionally a compression policy
+            (protocol.CompressionPolicy), otherwise a default one is used.
         """
         super().__init__()
         self.socket = None
         self.bytes_written = 0
+        self.decoder = protocol.FrameDecoder(max_frame_size)
+        self.compression = compression if compression is not None else protocol.CompressionPolicy()
+        self.preferred_codecs = preferred_codecs
+        self.codec = protocol.YamlCodec
+        self.negotiated = False
+        # messages sent before the codec is negotiated
+        self.unnegotiated_messages = []
+        # outgoing queue, flushed by a zero timer (when control returns to the event loop)
+        self.send_queue = []
+        self.send_queue_size = 0
+        self.flush_size = flush_size
+        self.flush_timer = QtCore.QTimer()
+        self.flush_timer.setSingleShot(True)
+        self.flush_timer.setInterval(0)
+        self.flush_timer.timeout.connect(self.flush)
+        # streams waiting to be sent (id, frame, label), being sent (id, frame, position) and being received
+        self.stream_threshold = stream_threshold
+        self.chunk_size = chunk_size
+        self.max_stream_size = max_stream_size
+        self.waiting_streams = []
+        self.outgoing_streams = []
+        self.outgoing_streams_size = 0
+        self.stream_counter = 0
+        self.assembler = protocol.StreamAssembler(max_stream_size, max_total_size=max_stream_size)
+        self.stream_labels = {}
+        # backpressure, frames held back (by label) while throttled
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_buffered = max_buffered
+        self.throttled = False
+        self.throttle_count = 0
+        self.coalesced_frames = {}
+        self.dropped = 0
+        self.coalesced = 0
 
     def set_socket(self, socket=None):
         """
@@ -64,14 +125,19 @@ class Client(QtCore.QObject):
         # new data is handled by receive()
         self.socket.readyRead.connect(self.receive)
         self.socket.error.connect(self.error)
+        self.socket.connected.connect(self.offer_codecs)
         self.socket.connected.connect(self.connected)
         self.socket.disconnected.connect(self.disconnected)
         self.socket.bytesWritten.connect(self.count_bytes_written)
+        self.socket.bytesWritten.connect(self.check_backpressure)
+        self.socket.bytesWritten.connect(self.send_chunks)
 
     def disconnect_from_host(self):
         """
-            If you want to disconnect, just call this method which basically just calls the same method on the socket.
+            If you want to disconnect, just call this method which basically just calls the same method on the socket
+            (after writing everything still queued).
         """
+        self.flush()
         self.socket.disconnectFromHost()
 
     def connect_to_host(self, port, host='local'):
@@ -84,49 +150,249 @@ class Client(QtCore.QObject):
 
     def receive(self):
         """
-            While there are messages available read them and process them.
-            Reading is reading of a QByteArray from the TCPSocket, uncompressing and deserializing.
+            Reads all available bytes, decodes all complete frames and processes them. Partial frames are kept until
+            the rest arrives.
+            Decoding is uncompressing and deserializing.
         """
-        while self.socket.bytesAvailable() > 0:
-            # read a QByteArray using a data stream
-            reader = QtCore.QDataStream(self.socket)
-            bytearray = QtCore.QByteArray()
-            reader >> bytearray
-
-            # uncompress bytes from bytearray
-            uncompressed = zlib.decompress(bytearray.data())
+        data = self.socket.readAll().data()
+        try:
+            frames = self.decoder.feed(data)
+        except RuntimeError:
+            # the stream is corrupt or the other side misbehaves, there is no way to recover
+            self.socket.abort()
+            raise
 
-            # security validator (check for everything that we do not like (!!python)
-            # TODO implement this
+        for frame in frames:
+            if protocol.is_chunk_frame(frame):
+                self.receive_chunk(frame)
+            else:
+                self.process_frame(frame, self.decoder.max_frame_size)
 
-            # decode from utf-8 bytes to unicode and deserialize from yaml
-            value = yaml.load(uncompressed.decode())
+    def process_frame(self, frame, max_size):
+        """
+            Processes a complete frame (at most max_size bytes uncompressed).
+        """
+        # uncompress and deserialize (with the codec given in the frame, must be the negotiated one), control frames
+        # are processed here, any error means the other side misbehaves
+        try:
+            value, control = protocol.decode_frame(frame, self.compression,
+                                                   (self.codec.id,) if self.negotiated else (), max_size)
+            if control:
+                self.process_control(value)
+        except RuntimeError:
+            self.socket.abort()
+            raise
 
-            # print('connection id {} received {}'.format(self.id, value))
+        # print('connection id {} received {}'.format(self.id, value))
+        if not control:
             self.received.emit(value)
 
-    def send(self, value):
+    def receive_chunk(self, frame):
+        """
+            A chunk of a stream arrived, report the progress and process the frame when the stream is complete.
+        """
+        try:
+            stream_id, received, size, frame = self.assembler.add(frame)
+        except RuntimeError:
+            self.socket.abort()
+            raise
+        label = self.stream_labels[stream_id] if frame is None else self.stream_labels.pop(stream_id)
+        self.stream_progress.emit(label, received, size)
+        if frame is not None:
+            self.process_frame(frame, self.max_stream_size)
+
+    def send(self, value, immediate=False, label=None, policy=None):
         """
             We send a message back to the client.
-            We do it by serialization, compressing and writing of a QByteArray to the TCPSocket.
+            We do it by serialization (negotiated codec), compressing and queuing for writing to the TCPSocket. If
+            immediate, the queue is written right away (for latency critical messages). Large frames are streamed
+            (the label identifies the stream for the progress on the receiving side). The policy ('drop' or
+            'coalesce' by label) applies while the client is throttled.
         """
-        # serialize value to yaml
-        serialized = yaml.dump(value, allow_unicode=True)
+        if not self.negotiated:
+            self.unnegotiated_messages.append((value, immediate, label, policy))
+            return
+        if self.throttled and policy == 'drop':
+            self.dropped += 1
+            return
+        raw_bytes = self.compression.raw_bytes
+        frame = protocol.encode_frame(value, self.codec, compression=self.compression)
+        # large frames and the ones the other side would not uncompress (larger than a frame uncompressed) are streamed
+        raw_size = self.compression.raw_bytes - raw_bytes
+        large = len(frame) > self.stream_threshold or raw_size > self.decoder.max_frame_size
+        if large and not immediate:
+            self.send_stream(frame, label)
+        else:
+            self.write_frame(frame, immediate, label, policy)
 
-        # encode to utf-8 bytes and compress
-        compressed = zlib.compress(serialized.encode())
+    def send_stream(self, frame, label=None):
+        """
+            Streams an encoded frame (as soon as not too many other streams are incomplete). Returns the stream id.
+        """
+        if len(frame) > self.max_stream_size:
+            raise RuntimeError('Frame of size {} exceeds the maximal stream size {}.'.format(len(frame),
+                                                                                            self.max_stream_size))
+        self.stream_counter += 1
+        stream_id = self.stream_counter
+        self.waiting_streams.append((stream_id, frame, label))
+        self.start_streams()
+        return stream_id
 
-        # wrap in QByteArray
-        bytearray = QtCore.QByteArray(compressed)
+    def start_streams(self):
+        """
+            Announces waiting streams (within the limits of the other side) and starts sending their chunks.
+        """
+        waiting = self.waiting_streams
+        while (waiting and len(self.outgoing_streams) < protocol.MAX_STREAMS and
+               self.outgoing_streams_size + len(waiting[0][1]) <= self.max_stream_size):
+            stream_id, frame, label = waiting.pop(0)
+            self.send_control({'stream': stream_id, 'size': len(frame), 'label': label})
+            self.outgoing_streams.append([stream_id, memoryview(frame), 0])
+            self.outgoing_streams_size += len(frame)
+        self.send_chunks()
 
-        # write using a data stream
-        writer = QtCore.QDataStream(self.socket)
-        writer.setVersion(QtCore.QDataStream.Qt_4_8)
-        writer << bytearray
+    def send_chunks(self, bytes_written=0):
+        """
+            Queues chunks of the outgoing streams (in turns) as long as less than a chunk is waiting to be written.
+            Called again whenever the socket has written something.
+        """
+        streams = self.outgoing_streams
+        while streams and self.socket.bytesToWrite() + self.send_queue_size < self.chunk_size:
+            stream = streams.pop(0)
+            stream_id, frame, position = stream
+            chunk = frame[position:position + self.chunk_size]
+            self.write_frame(protocol.chunk_frame(stream_id, chunk))
+            stream[2] = position + len(chunk)
+            if stream[2] < len(frame):
+                streams.append(stream)
+            else:
+                self.outgoing_streams_size -= len(frame)
+                if self.waiting_streams:
+                    self.start_streams()
+                    return
+
+    def send_control(self, value):
+        """
+            Sends a control message (always with the YAML codec, so that it can be read before negotiation).
+        """
+        self.write_frame(protocol.encode_frame(value, protocol.YamlCodec, control=True, compression=self.compression),
+                         immediate=True)
+
+    def write_frame(self, frame, immediate=False, label=None, policy=None):
+        """
+            Queues an encoded frame (bytes) with its length for writing to the TCPSocket. The queue is flushed if
+            immediate or large enough, otherwise as soon as the event loop is running again. While throttled, frames
+            are dropped or coalesced according to the policy (see send()).
+        """
+        if self.throttled and policy is not None:
+            if policy == 'drop':
+                self.dropped += 1
+            else:
+                if label in self.coalesced_frames:
+                    self.coalesced += 1
+                self.coalesced_frames[label] = frame
+            return
+        # length and frame separately, the frame may be shared by many clients (see base.network.broadcast)
+        self.send_queue.append(protocol.length_prefix(frame))
+        self.send_queue.append(frame)
+        self.send_queue_size += 4 + len(frame)
+        if immediate or self.send_queue_size >= self.flush_size:
+            self.flush()
+        elif not self.flush_timer.isActive():
+            self.flush_timer.start()
+
+    def flush(self):
+        """
+            Writes all queued frames in a single write to the TCPSocket.
+        """
+        self.flush_timer.stop()
+        if not self.send_queue:
+            return
+        data = b''.join(self.send_queue)
+        self.send_queue = []
+        self.send_queue_size = 0
+        self.socket.write(data)
+        self.check_backpressure()
+
+    def check_backpressure(self, bytes_written=0):
+        """
+            Throttles or unthrottles according to the number of bytes waiting in the socket. When unthrottled, the
+            coalesced frames are written.
+        """
+        buffered = self.socket.bytesToWrite()
+        if buffered > self.max_buffered:
+            # the other side does not read
+            self.socket.abort()
+        elif not self.throttled and buffered >= self.high_watermark:
+            self.throttled = True
+            self.throttle_count += 1
+            self.throttle_changed.emit(True)
+        elif self.throttled and buffered <= self.low_watermark:
+            self.throttled = False
+            frames = list(self.coalesced_frames.values())
+            self.coalesced_frames.clear()
+            for frame in frames:
+                self.write_frame(frame)
+            self.throttle_changed.emit(False)
 
     def count_bytes_written(self, bytes):
         self.bytes_written += bytes
 
+    def stats(self):
+        """
+            Statistics of this connection (compression ratio and CPU time, bytes written, backpressure).
+        """
+        stats = self.compression.stats()
+        stats['bytes_written'] = self.bytes_written
+        stats['bytes_to_write'] = self.socket.bytesToWrite() if self.socket is not None else 0
+        stats['throttled'] = self.throttled
+        stats['throttle_count'] = self.throttle_count
+        stats['dropped'] = self.dropped
+        stats['coalesced'] = self.coalesced
+        return stats
+
+    def offer_codecs(self):
+        """
+            We are connected, tell the other side which codecs we can use.
+        """
+        self.send_control({'codecs': list(self.preferred_codecs)})
+
+    def process_control(self, value):
+        """
+            A control message (codec negotiation or stream announcement) was received. Raises a RuntimeError if it is
+            not valid.
+        """
+        if not isinstance(value, dict):
+            raise RuntimeError('Invalid control message {}.'.format(value))
+        if 'codecs' in value and not self.negotiated and isinstance(value['codecs'], list):
+            # the other side offers codecs, choose one and tell it
+            self.codec = protocol.negotiate_codec(value['codecs'], self.preferred_codecs)
+            self.send_control({'codec': self.codec.name})
+            self.codec_negotiated()
+        elif 'codec' in value and not self.negotiated:
+            # the other side has chosen
+            if value['codec'] not in self.preferred_codecs:
+                raise RuntimeError('Codec {} was not offered.'.format(value['codec']))
+            self.codec = protocol.CODECS_BY_NAME[value['codec']]
+            self.codec_negotiated()
+        elif 'stream' in value and 'size' in value:
+            # a stream will follow (the assembler checks id and size)
+            self.assembler.start(value['stream'], value['size'])
+            self.stream_labels[value['stream']] = value.get('label')
+        else:
+            raise RuntimeError('Unknown control message {}.'.format(value))
+
+    def codec_negotiated(self):
+        """
+            Sends the messages held back until now.
+        """
+        self.negotiated = True
+        messages = self.unnegotiated_messages
+        self.unnegotiated_messages = []
+        for message in messages:
+            # not send() of subclasses, these are the arguments of ours
+            Client.send(self, *message)
+
 
 class Server(QtCore.QObject):
     """
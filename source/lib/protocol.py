@@ -0,0 +1,584 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from array import array
+import struct
+import sys
+import time
+import zlib
+
+import yaml
+
+from lib.utils import SafeLoader, SafeDumper
+
+"""
+    Wire protocol of the network messages, only based on Python (not Qt), so that it can be used by any transport.
+
+    Messages are serialized by a codec and, depending on the compression policy of the connection, compressed (zlib)
+    into frames. On the stream every frame is prefixed by its length (4 bytes, big endian, same as a QByteArray written
+    by a QDataStream). Every frame starts with a header byte holding the id of the codec it was encoded with (lower four
+    bits) and flags (upper four bits).
+
+    Which codec is used for sending is negotiated at connect time with control frames (always encoded with the YAML
+    codec): the connecting side sends {'codecs': [names]} in order of its preference and the other side answers with
+    {'codec': name}, the first of them that it also supports.
+
+    Large frames can be streamed instead: a control frame {'stream': id, 'size': size} announces the stream, then the
+    frame follows in chunk frames (header byte with only the chunk flag, stream id (4 bytes, big endian), data) that
+    can be interleaved with other frames.
+"""
+
+# header byte
+CODEC_MASK = 0x0F
+FLAG_CONTROL = 0x10
+FLAG_COMPRESSED = 0x20
+FLAG_ZDICT = 0x40  # compressed with the preset dictionary
+FLAG_CHUNK = 0x80  # part of a streamed frame
+
+# default maximal size of a frame (larger ones are considered an error)
+MAX_FRAME_SIZE = 32 * 2 ** 20
+
+# default maximal size of a streamed frame (also of all incomplete streams together), maximal number of incomplete
+# streams and default size of the chunks
+MAX_STREAM_SIZE = 256 * 2 ** 20
+MAX_STREAMS = 4
+CHUNK_SIZE = 64 * 1024
+
+
+class YamlCodec():
+    """
+        Human readable, slow. For debugging and as fallback. Arrays are encoded as (and decoded to) lists.
+
+        Only standard YAML tags are allowed (safe loading), the data comes from the other side of the connection.
+    """
+    id = 0
+    name = 'yaml'
+
+    @staticmethod
+    def encode(value):
+        try:
+            return yaml.dump(value, allow_unicode=True, Dumper=SafeDumper).encode()
+        except yaml.YAMLError as error:
+            raise RuntimeError('Cannot encode value: {}'.format(error))
+
+    @staticmethod
+    def decode(data):
+        try:
+            return yaml.load(bytes(data).decode(), Loader=SafeLoader)
+        except (yaml.YAMLError, UnicodeDecodeError) as error:
+            raise RuntimeError('Cannot decode value: {}'.format(error))
+
+
+# tags of the binary codec
+_NONE = b'N'
+_FALSE = b'F'
+_TRUE = b'T'
+_INT8 = b'b'
+_INT32 = b'i'
+_INT64 = b'q'
+_BIG_INT = b'n'  # decimal string
+_FLOAT = b'd'
+_STRING = b's'
+_BYTES = b'y'
+_LIST = b'l'
+_DICT = b'm'
+_ARRAY = b'a'  # typecode, shape and raw (little endian) data
+
+_int8 = struct.Struct('>b')
+_int32 = struct.Struct('>i')
+_int64 = struct.Struct('>q')
+_float = struct.Struct('>d')
+_length = struct.Struct('>I')
+
+# typecodes of arrays with a fixed item size on all platforms, other ones are mapped to them by kind and item size
+ARRAY_TYPECODES = 'bBhHiIqQfd'
+_typecodes = {(typecode.islower(), array(typecode).itemsize): typecode for typecode in 'bBhHiIqQ'}
+
+
+def _array_view(value):
+    """
+        Returns a memoryview with one of the ARRAY_TYPECODES of an array like value (array.array, memoryview, NumPy
+        array or anything else with the buffer protocol and a native format).
+    """
+    view = memoryview(value)
+    typecode = view.format.lstrip('@=<')
+    if len(typecode) != 1 or typecode not in 'bBhHiIlLqQfd':
+        raise RuntimeError('Cannot encode array with format {}.'.format(view.format))
+    if typecode not in ARRAY_TYPECODES:
+        typecode = _typecodes[(typecode.islower(), view.itemsize)]
+        if 0 in view.shape:
+            # memoryview cannot cast to a shape with zeros
+            return memoryview(array(typecode))
+        view = view.cast('B').cast(typecode, view.shape)
+    return view
+
+
+def _encode(value, out):
+    """
+        Appends the tagged binary encoding of a value to a list of bytes objects.
+    """
+    t = type(value)
+    if t is str:
+        data = value.encode()
+        out.append(_STRING + _length.pack(len(data)))
+        out.append(data)
+    elif t is int:
+        if -128 <= value < 128:
+            out.append(_INT8 + _int8.pack(value))
+        elif -2 ** 31 <= value < 2 ** 31:
+            out.append(_INT32 + _int32.pack(value))
+        elif -2 ** 63 <= value < 2 ** 63:
+            out.append(_INT64 + _int64.pack(value))
+        else:
+            data = str(value).encode()
+            out.append(_BIG_INT + _length.pack(len(data)))
+            out.append(data)
+    elif t is dict:
+        out.append(_DICT + _length.pack(len(value)))
+        for key, item in value.items():
+            _encode(key, out)
+            _encode(item, out)
+    elif t is list or t is tuple:
+        out.append(_LIST + _length.pack(len(value)))
+        for item in value:
+            _encode(item, out)
+    elif value is None:
+        out.append(_NONE)
+    elif t is bool:
+        out.append(_TRUE if value else _FALSE)
+    elif t is float:
+        out.append(_FLOAT + _float.pack(value))
+    elif t is bytes or t is bytearray or (t is memoryview and value.format == 'B' and value.ndim == 1):
+        data = bytes(value)
+        out.append(_BYTES + _length.pack(len(data)))
+        out.append(data)
+    elif t is array or t is memoryview or hasattr(value, '__array_interface__'):
+        view = _array_view(value)
+        if sys.byteorder == 'big' and view.itemsize > 1:
+            swapped = array(view.format, view.tobytes())
+            swapped.byteswap()
+            data = swapped.tobytes()
+        else:
+            data = view.tobytes()
+        out.append(_ARRAY + view.format.encode() + bytes((view.ndim,)) + b''.join(_length.pack(n) for n in view.shape)
+                   + _length.pack(len(data)))
+        out.append(data)
+    else:
+        raise RuntimeError('Cannot encode value of type {}.'.format(t))
+
+
+def _decode(data, position):
+    """
+        Decodes one value starting at a position in data (bytes), returns the value and the position after it.
+    """
+    tag = data[position:position + 1]
+    position += 1
+    if tag == _STRING:
+        n = _length.unpack_from(data, position)[0]
+        position += 4
+        return data[position:position + n].decode(), position + n
+    elif tag == _INT8:
+        return _int8.unpack_from(data, position)[0], position + 1
+    elif tag == _DICT:
+        n = _length.unpack_from(data, position)[0]
+        position += 4
+        value = {}
+        for _ in range(n):
+            key, position = _decode(data, position)
+            value[key], position = _decode(data, position)
+        return value, position
+    elif tag == _LIST:
+        n = _length.unpack_from(data, position)[0]
+        position += 4
+        value = []
+        for _ in range(n):
+            item, position = _decode(data, position)
+            value.append(item)
+        return value, position
+    elif tag == _INT32:
+        return _int32.unpack_from(data, position)[0], position + 4
+    elif tag == _NONE:
+        return None, position
+    elif tag == _TRUE:
+        return True, position
+    elif tag == _FALSE:
+        return False, position
+    elif tag == _FLOAT:
+        return _float.unpack_from(data, position)[0], position + 8
+    elif tag == _INT64:
+        return _int64.unpack_from(data, position)[0], position + 8
+    elif tag == _BYTES:
+        n = _length.unpack_from(data, position)[0]
+        position += 4
+        return data[position:position + n], position + n
+    elif tag == _BIG_INT:
+        n = _length.unpack_from(data, position)[0]
+        position += 4
+        return int(data[position:position + n].decode()), position + n
+    elif tag == _ARRAY:
+        typecode = chr(data[position])
+        ndim = data[position + 1]
+        shape = struct.unpack_from('>' + 'I' * ndim, data, position + 2)
+        position += 2 + 4 * ndim
+        n = _length.unpack_from(data, position)[0]
+        position += 4
+        if typecode not in ARRAY_TYPECODES:
+            raise RuntimeError('Unknown array typecode at position {}.'.format(position))
+        size = array(typecode).itemsize
+        for dimension in shape:
+            size *= dimension
+        if n != size or position + n > len(data):
+            raise RuntimeError('Array size does not match its shape at position {}.'.format(position))
+        if n == 0:
+            # memoryview cannot cast to a shape with zeros
+            return array(typecode), position
+        if sys.byteorder == 'big' and array(typecode).itemsize > 1:
+            swapped = array(typecode, data[position:position + n])
+            swapped.byteswap()
+            view = memoryview(swapped)
+        else:
+            # no copy, a view on the data
+            view = memoryview(data)[position:position + n]
+        return view.cast(typecode, shape), position + n
+    else:
+        raise RuntimeError('Unknown tag {} at position {}.'.format(tag, position - 1))
+
+
+class BinaryCodec():
+    """
+        Compact tagged binary encoding (similar to msgpack) of None, bool, int, float, str, bytes, list (and tuple) and
+        dict. Every value is a one byte tag followed by its fixed size (big endian) content or by a length and the
+        elements.
+
+        Arrays (array.array, memoryview, NumPy arrays) are attached as their raw data together with the typecode and
+        the shape and decoded as memoryview on the received data, without creating Python objects for the elements.
+    """
+    id = 1
+    name = 'binary'
+
+    @staticmethod
+    def encode(value):
+        out = []
+        _encode(value, out)
+        return b''.join(out)
+
+    @staticmethod
+    def decode(data):
+        data = bytes(data)
+        try:
+            value, position = _decode(data, 0)
+        except (struct.error, IndexError, ValueError, TypeError) as error:
+            # truncated or otherwise malformed data
+            raise RuntimeError('Cannot decode binary data: {}'.format(error))
+        if position != len(data):
+            raise RuntimeError('Trailing data after position {}.'.format(position))
+        return value
+
+
+# all known codecs by id and by name
+CODECS = {codec.id: codec for codec in (YamlCodec, BinaryCodec)}
+CODECS_BY_NAME = {codec.name: codec for codec in CODECS.values()}
+
+# preferred codecs for sending (first is preferred)
+PREFERRED_CODECS = ('binary', 'yaml')
+
+
+def negotiate_codec(offered, preferred=PREFERRED_CODECS):
+    """
+        Given the codec names offered by the other side (in order of its preference), returns the first one of our
+        preferred ones that is also offered (or the YAML codec).
+    """
+    for name in preferred:
+        if name in offered and name in CODECS_BY_NAME:
+            return CODECS_BY_NAME[name]
+    return YamlCodec
+
+
+class CompressionPolicy():
+    """
+        Decides per frame if and how it is compressed and keeps statistics (sizes and CPU time) of one connection.
+
+        Data below the threshold is not compressed at all (costs more than it saves), otherwise the compression level
+        is chosen by size (larger payloads get lower levels, the CPU time would grow too much otherwise). Small and
+        medium payloads are compressed with a preset dictionary (zdict, must be the same on both sides), if given. If
+        compression does not reduce the size, the data is sent uncompressed.
+    """
+
+    # (maximal size, level), the first matching is used
+    LEVELS = ((16 * 1024, 6), (256 * 1024, 3), (None, 1))
+
+    def __init__(self, threshold=256, zdict=None, zdict_max_size=16 * 1024):
+        self.threshold = threshold
+        self.zdict = zdict
+        self.zdict_max_size = zdict_max_size
+        self.frames = 0
+        self.compressed_frames = 0
+        self.raw_bytes = 0
+        self.sent_bytes = 0
+        self.compress_time = 0
+        self.decompress_time = 0
+
+    def level(self, size):
+        """
+            The compression level for data of a given size.
+        """
+        for max_size, level in self.LEVELS:
+            if max_size is None or size <= max_size:
+                return level
+
+    def compress(self, data):
+        """
+            Returns the data (compressed or not) and the flags to put in the header.
+        """
+        size = len(data)
+        self.frames += 1
+        self.raw_bytes += size
+        flags = 0
+        if size >= self.threshold:
+            start = time.process_time()
+            if self.zdict is not None and size <= self.zdict_max_size:
+                compressor = zlib.compressobj(self.level(size), zdict=self.zdict)
+                compressed = compressor.compress(data) + compressor.flush()
+                compressed_flags = FLAG_COMPRESSED | FLAG_ZDICT
+            else:
+                compressed = zlib.compress(data, self.level(size))
+                compressed_flags = FLAG_COMPRESSED
+            self.compress_time += time.process_time() - start
+            if len(compressed) < size:
+                data = compressed
+                flags = compressed_flags
+                self.compressed_frames += 1
+        self.sent_bytes += len(data)
+        return data, flags
+
+    def decompress(self, data, flags, max_size=MAX_FRAME_SIZE):
+        """
+            Uncompresses the data of a frame according to the flags in its header. Raises a RuntimeError if the data is
+            corrupt or would be larger than max_size uncompressed.
+        """
+        if not flags & FLAG_COMPRESSED:
+            return data
+        start = time.process_time()
+        if flags & FLAG_ZDICT:
+            if self.zdict is None:
+                raise RuntimeError('Frame compressed with a preset dictionary but none is available.')
+            decompressor = zlib.decompressobj(zdict=self.zdict)
+        else:
+            decompressor = zlib.decompressobj()
+        try:
+            # at most one byte more than allowed, to detect larger ones
+            data = decompressor.decompress(data, max_size + 1)
+        except zlib.error as error:
+            raise RuntimeError('Cannot decompress frame: {}'.format(error))
+        if len(data) > max_size or decompressor.unconsumed_tail:
+            raise RuntimeError('Decompressed frame exceeds the maximal size {}.'.format(max_size))
+        if not decompressor.eof:
+            raise RuntimeError('Compressed frame is incomplete.')
+        self.decompress_time += time.process_time() - start
+        return data
+
+    def stats(self):
+        """
+            Statistics of the sent frames (ratio is sent bytes by raw bytes) and the CPU time spent (seconds).
+        """
+        return {
+            'frames': self.frames,
+            'compressed_frames': self.compressed_frames,
+            'raw_bytes': self.raw_bytes,
+            'sent_bytes': self.sent_bytes,
+            'ratio': self.sent_bytes / self.raw_bytes if self.raw_bytes > 0 else 1,
+            'compress_time': self.compress_time,
+            'decompress_time': self.decompress_time
+        }
+
+
+def create_preset_dictionary(samples):
+    """
+        A preset dictionary (zdict) for the compression of small frames from typical values (samples), encoded with all
+        codecs. The most common samples should come last (zlib prefers the end of the dictionary).
+    """
+    return b''.join(codec.encode(sample) for codec in CODECS.values() for sample in samples)
+
+
+def encode_frame(value, codec, control=False, compression=None):
+    """
+        Encodes a value with a codec, compresses it (if a compression policy is given and it decides so) and prepends
+        the header byte.
+    """
+    data = codec.encode(value)
+    flags = FLAG_CONTROL if control else 0
+    if compression is not None:
+        data, compression_flags = compression.compress(data)
+        flags |= compression_flags
+    return bytes((codec.id | flags,)) + data
+
+
+def decode_frame(frame, compression=None, codecs=None, max_size=MAX_FRAME_SIZE):
+    """
+        Decodes a frame (header byte and possibly compressed encoded value), returns the value and if it's a control
+        frame. Compressed frames need the compression policy and may not be larger than max_size uncompressed. If
+        codecs (ids) are given, other frames than control frames must be encoded with one of them (the negotiated
+        codec), control frames always with the YAML codec.
+    """
+    if not frame:
+        raise RuntimeError('Empty frame.')
+    header = frame[0]
+    codec = CODECS.get(header & CODEC_MASK)
+    if codec is None:
+        raise RuntimeError('Unknown codec {}.'.format(header & CODEC_MASK))
+    if header & FLAG_CONTROL:
+        if codec is not YamlCodec:
+            raise RuntimeError('Control frame with codec {}.'.format(codec.name))
+    elif codecs is not None and codec.id not in codecs:
+        raise RuntimeError('Frame with codec {} but it was not negotiated.'.format(codec.name))
+    data = frame[1:]
+    if header & FLAG_COMPRESSED:
+        if compression is None:
+            raise RuntimeError('Compressed frame but no compression policy.')
+        data = compression.decompress(data, header, max_size)
+    return codec.decode(data), bool(header & FLAG_CONTROL)
+
+
+def length_prefix(frame):
+    """
+        The length of a frame as it is written before the frame to a stream.
+    """
+    return _length.pack(len(frame))
+
+
+def length_prefixed(frame):
+    """
+        Prepends the length of a frame, ready to be written to a stream.
+    """
+    return _length.pack(len(frame)) + frame
+
+
+class FrameDecoder():
+    """
+        Incremental decoder of length prefixed frames from a stream. Data can be fed in arbitrary pieces (partial
+        frames, several frames at once). Incomplete frames are kept in a reassembly buffer until the rest arrives.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray()
+        self.max_frame_size = max_frame_size
+
+    def feed(self, data):
+        """
+            Adds data (bytes like) to the buffer and returns a list of all frames (bytes, without length prefix) that
+            are complete now. Raises a RuntimeError if a frame is empty (every frame has a header byte) or larger than
+            the maximal frame size.
+        """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        position = 0
+        available = len(buffer)
+        while available - position >= 4:
+            size = _length.unpack_from(buffer, position)[0]
+            if size == 0:
+                raise RuntimeError('Empty frame.')
+            if size > self.max_frame_size:
+                raise RuntimeError('Frame of size {} exceeds the maximal frame size {}.'.format(size,
+                                                                                               self.max_frame_size))
+            if available - position - 4 < size:
+                # incomplete, wait for more data
+                break
+            frames.append(bytes(buffer[position + 4:position + 4 + size]))
+            position += 4 + size
+        del buffer[:position]
+        return frames
+
+    def pending(self):
+        """
+            Number of bytes in the buffer (belonging to incomplete frames).
+        """
+        return len(self.buffer)
+
+
+def chunk_frame(stream_id, data):
+    """
+        A chunk frame (part of a streamed frame).
+    """
+    return bytes((FLAG_CHUNK,)) + _length.pack(stream_id) + data
+
+
+def is_chunk_frame(frame):
+    return bool(frame[0] & FLAG_CHUNK)
+
+
+class StreamAssembler():
+    """
+        Reassembles streamed frames from their chunks. Streams are announced with their size (start) and are complete
+        when all bytes have arrived. Buffers grow with the received chunks (not allocated with the announced size).
+
+        At most max_streams streams can be incomplete at the same time and the announced sizes of all of them together
+        may not exceed max_total_size, so that the other side cannot make us reserve arbitrary amounts of memory.
+    """
+
+    def __init__(self, max_stream_size=MAX_STREAM_SIZE, max_streams=MAX_STREAMS, max_total_size=MAX_STREAM_SIZE):
+        self.streams = {}
+        self.max_stream_size = max_stream_size
+        self.max_streams = max_streams
+        self.max_total_size = max_total_size
+        # sum of the announced sizes of all incomplete streams
+        self.announced = 0
+
+    def start(self, stream_id, size):
+        """
+            A new stream is announced. Raises a RuntimeError if it is invalid, too large, too many streams are
+            incomplete or the id is already in use.
+        """
+        if type(stream_id) is not int or type(size) is not int or size < 1:
+            raise RuntimeError('Invalid stream {} of size {}.'.format(stream_id, size))
+        if size > self.max_stream_size:
+            raise RuntimeError('Stream of size {} exceeds the maximal stream size {}.'.format(size,
+                                                                                             self.max_stream_size))
+        if stream_id in self.streams:
+            raise RuntimeError('Stream {} already started.'.format(stream_id))
+        if len(self.streams) >= self.max_streams:
+            raise RuntimeError('More than {} incomplete streams.'.format(self.max_streams))
+        if self.announced + size > self.max_total_size:
+            raise RuntimeError('Incomplete streams exceed the maximal total size {}.'.format(self.max_total_size))
+        self.streams[stream_id] = [bytearray(), size]
+        self.announced += size
+
+    def add(self, frame):
+        """
+            Adds a chunk frame. Returns the stream id, the number of bytes received so far, the size of the stream and
+            the complete frame (bytearray) if this was the last chunk (otherwise None).
+        """
+        if len(frame) < 5:
+            raise RuntimeError('Chunk frame too short.')
+        stream_id = _length.unpack_from(frame, 1)[0]
+        stream = self.streams.get(stream_id)
+        if stream is None:
+            raise RuntimeError('Chunk of unknown stream {}.'.format(stream_id))
+        buffer, size = stream
+        if len(buffer) + len(frame) - 5 > size:
+            raise RuntimeError('Stream {} is longer than announced.'.format(stream_id))
+        buffer += frame[5:]
+        if len(buffer) < size:
+            return stream_id, len(buffer), size, None
+        del self.streams[stream_id]
+        self.announced -= size
+        return stream_id, size, size, buffer
+
+    def pending(self):
+        """
+            Number of bytes received of all incomplete streams.
+        """
+        return sum(len(stream[0]) for stream in self.streams.values())
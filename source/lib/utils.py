@@ -14,7 +14,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+from array import array
 from enum import Enum
+import mmap
+import struct
 import zipfile
 
 import yaml
@@ -35,6 +38,21 @@ if hasattr(yaml, 'CDumper'):
 else:
     Dumper = yaml.Dumper
 
+# only standard YAML tags (no Python objects), for data from untrusted sources (the network)
+if hasattr(yaml, 'CSafeLoader'):
+    SafeLoader = yaml.CSafeLoader
+else:
+    SafeLoader = yaml.SafeLoader
+if hasattr(yaml, 'CSafeDumper'):
+    SafeDumper = yaml.CSafeDumper
+else:
+    SafeDumper = yaml.SafeDumper
+
+# typed arrays (array.array, memoryview) are written as lists
+for array_type in (array, memoryview):
+    for dumper_type in (Dumper, SafeDumper):
+        dumper_type.add_representer(array_type, lambda dumper, value: dumper.represent_list(value.tolist()))
+
 
 class AutoNumberedEnum(Enum):
     """
@@ -83,6 +101,29 @@ class ZipArchiveReader():
         """
         return self.zip.read(name)
 
+    def namelist(self):
+        """
+            Returns the names of all entries in the zip file.
+        """
+        return self.zip.namelist()
+
+    def memory_map(self, name, typecode='B'):
+        """
+            Maps an uncompressed (stored) entry into memory and returns a memoryview on it cast to an array type code
+            (see module array, native byte order). Nothing is read or copied until accessed. The mapping is copy on
+            write, changes to the view are never written back into the file.
+        """
+        info = self.zip.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise RuntimeError('Entry {} is compressed and cannot be memory mapped.'.format(name))
+        with open(self.zip.filename, 'rb') as file:
+            # the data starts after the local file header (30 bytes + file name + extra field)
+            file.seek(info.header_offset)
+            name_length, extra_length = struct.unpack('<HH', file.read(30)[26:30])
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+        start = info.header_offset + 30 + name_length + extra_length
+        return memoryview(mapped)[start:start + info.file_size].cast(typecode)
+
     def read_as_yaml(self, name):
         """
             First reads the file as byte array, then convert to UTF-8, then convert by YAML to Python object.
@@ -93,9 +134,10 @@ class ZipArchiveReader():
 
     def __del__(self):
         """
-            Close the zip upon deletion.
+            Close the zip upon deletion (if it could be opened).
         """
-        self.zip.close()
+        if hasattr(self, 'zip'):
+            self.zip.close()
 
 
 class ZipArchiveWriter():
@@ -109,11 +151,13 @@ class ZipArchiveWriter():
         """
         self.zip = zipfile.ZipFile(file, mode='w', compression=zipfile.ZIP_DEFLATED)
 
-    def write(self, name, bytes):
+    def write(self, name, bytes, compress=True):
         """
-            Writes a byte array to an entry in the zip file.
+            Writes a byte array to an entry in the zip file. If compress is False, the entry is stored uncompressed
+            (and can be memory mapped by ZipArchiveReader).
         """
-        self.zip.writestr(name, bytes)
+        compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self.zip.writestr(name, bytes, compress_type=compress_type)
 
     def write_as_yaml(self, name, obj):
         """
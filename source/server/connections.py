@@ -0,0 +1,137 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from itertools import count
+import time
+
+from PySide import QtCore
+
+import base.constants as c
+
+"""
+    Registry of the connected server clients with heartbeats.
+"""
+
+
+class ConnectionRegistry(QtCore.QObject):
+    """
+        The server clients (base.network.NetworkClient) by id. Ids are given in increasing order and never reused.
+        Clients are removed when they disconnect.
+
+        Every heartbeat_interval (ms) each client is pinged (a request on the c.CH_PING channel, answered by every
+        NetworkClient) and the round trip time is measured. Only one ping per client is outstanding, if max_missed
+        heartbeats in a row pass without an answer, the client is considered dead and disconnected.
+    """
+
+    added = QtCore.Signal(object)
+    removed = QtCore.Signal(object)
+
+    def __init__(self, heartbeat_interval=5000, max_missed=3):
+        super().__init__()
+        self.ids = count(1)
+        self.clients = {}
+        # per client id: round trip time of the last ping (seconds), send time of the outstanding ping and missed ones
+        self.rtts = {}
+        self.pings = {}
+        self.missed = {}
+        self.max_missed = max_missed
+        self.evicted = 0
+        self.heartbeat_timer = QtCore.QTimer()
+        self.heartbeat_timer.setInterval(heartbeat_interval)
+        self.heartbeat_timer.timeout.connect(self.heartbeat)
+        self.heartbeat_timer.start()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def __iter__(self):
+        return iter(list(self.clients.values()))
+
+    def add(self, client):
+        """
+            Registers a new client, gives it an id (client.client_id) and returns the id.
+        """
+        client_id = next(self.ids)
+        client.client_id = client_id
+        self.clients[client_id] = client
+        self.rtts[client_id] = None
+        self.missed[client_id] = 0
+        client.disconnected.connect(lambda: self.remove(client_id))
+        self.added.emit(client)
+        return client_id
+
+    def get(self, client_id):
+        """
+            The client with this id or None.
+        """
+        return self.clients.get(client_id)
+
+    def remove(self, client_id):
+        """
+            Unregisters a client (does nothing if not registered anymore), drops its letters still queued in the
+            dispatcher and schedules its socket for deletion.
+        """
+        client = self.clients.pop(client_id, None)
+        if client is None:
+            return
+        del self.rtts[client_id]
+        del self.missed[client_id]
+        self.pings.pop(client_id, None)
+        # letters still waiting for delivery are of no use anymore
+        if client.dispatcher is not None:
+            client.dispatcher.discard(client)
+        client.socket.deleteLater()
+        self.removed.emit(client)
+
+    def heartbeat(self):
+        """
+            Pings all clients that answered the last ping, counts a missed heartbeat for the others and disconnects the
+            ones that missed too many.
+        """
+        now = time.perf_counter()
+        for client_id, client in list(self.clients.items()):
+            if client_id in self.pings:
+                self.missed[client_id] += 1
+                if self.missed[client_id] >= self.max_missed:
+                    self.evict(client_id)
+                continue
+            self.pings[client_id] = now
+            client.request(c.CH_PING, {}, lambda client, result, client_id=client_id: self.pong(client_id))
+
+    def pong(self, client_id):
+        """
+            A client answered the ping.
+        """
+        if client_id in self.pings:
+            self.rtts[client_id] = time.perf_counter() - self.pings.pop(client_id)
+            self.missed[client_id] = 0
+
+    def evict(self, client_id):
+        """
+            Disconnects a dead client (and removes it).
+        """
+        self.evicted += 1
+        client = self.clients[client_id]
+        client.socket.abort()
+        self.remove(client_id)
+
+    def stats(self):
+        """
+            Number of clients, number of evicted clients, number of throttled clients (see lib.network.Client) and the
+            last round trip times (seconds) by client id.
+        """
+        throttled = sum(1 for client in self.clients.values() if client.throttled)
+        return {'clients': len(self.clients), 'evicted': self.evicted, 'throttled': throttled, 'rtts': dict(self.rtts)}
@@ -0,0 +1,141 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import sys
+from threading import Thread
+
+import lib.protocol as protocol
+from lib.async_network import AsyncNetworkClient, AsyncServer, new_event_loop
+import base.constants as c
+from server.scenario_files import ScenarioHeaderIndex, ScenarioPreviewCache
+
+"""
+    Headless dedicated server, the same services as server/network.py (ServerManager) but on an asyncio event loop
+    (uvloop if available) instead of a Qt event loop.
+
+    Start with: python -m server.headless [port] (from the source folder).
+"""
+
+# must be the same as the one of base.network.NetworkClient
+PRESET_DICTIONARY = protocol.create_preset_dictionary(c.Network_Typical_Letters)
+
+
+def create_client():
+    """
+        A new server client with the same compression settings as base.network.NetworkClient.
+    """
+    return AsyncNetworkClient(compression=protocol.CompressionPolicy(threshold=64, zdict=PRESET_DICTIONARY))
+
+
+class HeadlessServerManager():
+    """
+        Manages the asyncio server, the clients on the server and the general services on the server.
+    """
+
+    def __init__(self, loop, precompute_previews=False, refresh_interval=10):
+        """
+            We start with a server and an empty list of server clients. The index of the core scenarios is brought up
+            to date (and refreshed every refresh_interval seconds, there is no file system watcher without Qt).
+        """
+        self.loop = loop
+        self.server = AsyncServer(create_client)
+        self.server.new_client.connect(self.new_client)
+        self.server_clients = []
+
+        self.core_scenarios = ScenarioHeaderIndex(c.Core_Scenario_Folder, c.Core_Scenario_Index_File)
+        self.refresh_interval = refresh_interval
+        self.refresh_core_scenarios()
+
+        self.previews = ScenarioPreviewCache()
+        if precompute_previews:
+            thread = Thread(target=self.previews.precompute, args=(self.core_scenarios.files(),), daemon=True)
+            thread.start()
+
+    def new_client(self, client):
+        """
+            A new connection to the server. Add some general receivers and append it to the list of server clients
+            (until it disconnects).
+        """
+        client.connect_to_channel(c.CH_SCENARIO_PREVIEW, self.scenario_preview)
+        client.connect_to_channel(c.CH_CORE_SCENARIO_TITLES, self.core_scenario_titles)
+        # requests are answered right away, there is nothing to cancel
+        client.connect_to_channel(c.CH_RPC_CANCEL, lambda client, message: None)
+        client.disconnected.connect(self.server_clients.remove)
+        self.server_clients.append(client)
+
+    def refresh_core_scenarios(self):
+        """
+            Brings the index of the core scenarios up to date and schedules the next refresh.
+        """
+        self.core_scenarios.refresh()
+        self.loop.call_later(self.refresh_interval, self.refresh_core_scenarios)
+
+    def core_scenario_titles(self, client, message):
+        """
+            Return all available core scenario titles and file names (sorted by title, served from the index).
+        """
+        titles = {
+            'scenarios': self.core_scenarios.titles()
+        }
+        client.reply(message, titles, c.CH_RPC_REPLY)
+
+    def scenario_preview(self, client, message):
+        """
+            In the message should be a scenario file name (key = 'scenario'). Get the preview (from the preview
+            cache, in the default executor of the loop because it may have to be created) and send it back. Only core
+            scenarios are served.
+        """
+        file_name = self.core_scenarios.indexed_file(message.get('scenario'))
+        if file_name is None:
+            client.reply_error(message, 'unknown scenario', c.CH_RPC_REPLY)
+            return
+        future = self.loop.run_in_executor(None, self.previews.get, file_name)
+        future.add_done_callback(lambda future: self.scenario_preview_done(client, message, future))
+
+    @staticmethod
+    def scenario_preview_done(client, message, future):
+        """
+            A preview is ready, send it back (unless the client disconnected in the meantime).
+        """
+        if client.transport is None:
+            return
+        try:
+            preview = future.result()
+        except Exception as error:
+            # a corrupt scenario file or any other failure, the client should not wait forever
+            client.reply_error(message, str(error), c.CH_RPC_REPLY)
+            return
+        client.reply(message, preview, c.CH_RPC_REPLY)
+
+
+def run(port=c.Network_Port, scope='local'):
+    """
+        Runs a headless server until interrupted.
+    """
+    loop = new_event_loop()
+    server_manager = HeadlessServerManager(loop, precompute_previews=True)
+    loop.run_until_complete(server_manager.server.start(port, scope))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server_manager.server.stop()
+        loop.close()
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else c.Network_Port)
@@ -47,5 +47,5 @@ class ServerMonitorWidget(QtGui.QWidget):
         """
             Regular updates of the server stats
         """
-        text = '{} clients'.format(len(server_manager.server_clients))
+        text = '{} clients'.format(len(server_manager.clients))
         self.status_label.setText(text)
\ No newline at end of file
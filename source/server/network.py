@@ -14,20 +14,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
-import random
-import os
-import time
 from multiprocessing import Process
 from threading import Thread
 
 from PySide import QtCore
 
 from lib.network import Server
-import lib.utils as u
 import base.constants as c
-from base.constants import PropertyKeyNames as k, NationPropertyKeyNames as kn
-from base.network import NetworkClient
-from server.scenario import Scenario
+import lib.protocol as protocol
+from base.network import Dispatcher, NetworkClient, broadcast, PRESET_DICTIONARY
+from server.connections import ConnectionRegistry
+from server.scenario_files import ScenarioHeaderIndex, ScenarioPreviewCache, load_scenario_preview
+from server.workers import WorkerPool
 
 
 """
@@ -35,7 +33,6 @@ from server.scenario import Scenario
 """
 
 # TODO start this in its own process
-# TODO ping server clients regularly and throw them out if not reacting
 
 class ServerProcess(Process):
 
@@ -46,7 +43,7 @@ class ServerProcess(Process):
 
     def run(self):
         app = QtCore.QCoreApplication([])
-        server_manager = ServerManager()
+        server_manager = ServerManager(precompute_previews=True)
         server_manager.server.start(self.port)
 
         # start thread which listens on the child_connection
@@ -61,6 +58,7 @@ class ServerProcess(Process):
             message = self.child_conn.recv()
             if message == 'quit':
                 server_manager.server.stop()
+                server_manager.workers.shutdown()
                 app.quit()
                 return
 
@@ -71,112 +69,208 @@ class ServerManager(QtCore.QObject):
         clients on the server (server clients),
     """
 
-    def __init__(self):
+    def __init__(self, precompute_previews=False):
         """
-            We start with a server and an empty list of server clients.
+            We start with a server and an empty registry of server clients (pinged regularly). The index of the core
+            scenarios is brought up to date and then watched for changes. Previews of the core scenarios are computed
+            in the background if precompute_previews is True.
+
+            CPU heavy handlers (creating previews) run their work in a pool of worker processes (see run_in_worker()),
+            so that the messages of other clients are not blocked meanwhile.
         """
         super().__init__()
         self.server = Server()
         self.server.new_client.connect(self.new_client)
-        self.server_clients = []
+        self.clients = ConnectionRegistry()
+        self.clients.removed.connect(self.client_removed)
+        # received letters of all server clients are delivered by priority, bulk work last
+        self.dispatcher = Dispatcher()
+        self.dispatcher.set_priority(c.CH_SCENARIO_PREVIEW, Dispatcher.LOW)
+        # subscribers (server clients) by channel name for broadcasts, one compression policy for all broadcasts
+        self.subscribers = {}
+        self.broadcast_compression = protocol.CompressionPolicy(threshold=64, zdict=PRESET_DICTIONARY)
+
+        self.core_scenarios = ScenarioHeaderIndex(c.Core_Scenario_Folder, c.Core_Scenario_Index_File)
+        self.core_scenarios_watcher = QtCore.QFileSystemWatcher([c.Core_Scenario_Folder])
+        self.core_scenarios_watcher.directoryChanged.connect(self.core_scenarios_changed)
+        self.core_scenarios_watcher.fileChanged.connect(self.core_scenarios_changed)
+        self.core_scenarios_changed()
+
+        self.workers = WorkerPool()
+        # requests being worked on in the worker pool, (server client, request id) -> (job, callback)
+        self.worker_requests = {}
+        self.previews = ScenarioPreviewCache()
+        # core scenario files waiting for their preview to be precomputed, one job at a time (see
+        # precompute_next_preview()) so that the worker pool stays free for the requests of the clients
+        self.precompute_queue = list(self.core_scenarios.files()) if precompute_previews else []
+        self.precompute_next_preview()
+
+    def precompute_next_preview(self):
+        """
+            Submits the job for the next preview to precompute to the worker pool. Called again when this job is
+            done. If the worker pool is full, tries again a bit later.
+        """
+        while self.precompute_queue:
+            file_name = self.precompute_queue[0]
+            try:
+                key = self.previews.key(file_name)
+            except OSError:
+                # the file is gone
+                self.precompute_queue.pop(0)
+                continue
+            if self.previews.lookup(file_name) is not None:
+                self.precompute_queue.pop(0)
+                continue
+
+            def done(preview, file_name=file_name):
+                self.previews.add(file_name, preview)
+                self.precompute_next_preview()
+
+            def failed(exception, file_name=file_name):
+                print('precomputing preview of {} failed: {}'.format(file_name, exception))
+                self.precompute_next_preview()
+
+            # same key as requests for previews, so they wait for this job instead of loading again (and vice versa)
+            job = self.workers.submit('precompute preview', load_scenario_preview, (file_name,), done, failed,
+                                      key=(c.CH_SCENARIO_PREVIEW, key))
+            if job is None:
+                QtCore.QTimer.singleShot(1000, self.precompute_next_preview)
+            else:
+                self.precompute_queue.pop(0)
+            return
 
     def new_client(self, socket):
         """
-            A new connection to the server. Give an id and add some general receivers to the new server client.
-            Finally append new server client to the internal client list.
+            A new connection to the server. Add some general receivers to the new server client and register it (gives
+            it an id).
         """
         client = NetworkClient()
         client.set_socket(socket)
-
-        # give a new id
-        while True:
-            # theoretically this could take forever, practically only if we have 1e6 clients already
-            new_id = random.randint(0, 1e6)
-            if not any([new_id == client.id for client in self.server_clients]):
-                # not any == none
-                break
-        client.client_id = new_id
+        client.dispatcher = self.dispatcher
 
         # add some general receivers.
         client.connect_to_channel(c.CH_SCENARIO_PREVIEW, self.scenario_preview)
         client.connect_to_channel(c.CH_CORE_SCENARIO_TITLES, self.core_scenario_titles)
+        client.request_cancelled.connect(self.request_cancelled)
 
-        # finally add to list of clients
-        self.server_clients.append(client)
+        # finally register
+        self.clients.add(client)
 
-    @staticmethod
-    def core_scenario_titles(client, message):
+    def client_removed(self, client):
         """
-            A server client received a message on the c.CH_CORE_SCENARIO_TITLES channel. Return all available core
-            scenario titles and file names.
+            A server client disconnected (or was evicted). Forget its subscriptions and stop its work in progress.
         """
-        # get all core scenario files
-        scenario_files = [x for x in os.listdir(c.Core_Scenario_Folder) if x.endswith('.scenario')]
+        for subscribers in self.subscribers.values():
+            subscribers.discard(client)
+        for request in [request for request in self.worker_requests if request[0] is client]:
+            self.workers.cancel(*self.worker_requests.pop(request))
 
-        # joing the path
-        scenario_files = [os.path.join(c.Core_Scenario_Folder, x) for x in scenario_files]
+    def subscribe(self, client, channel_name):
+        """
+            A server client wants to receive the broadcasts to a channel.
+        """
+        self.subscribers.setdefault(channel_name, set()).add(client)
 
-        # read scenario titles
-        scenario_titles = []
-        for scenario_file in scenario_files:
-            reader = u.ZipArchiveReader(scenario_file)
-            properties = reader.read_as_yaml('properties')
-            scenario_titles.append(properties[k.TITLE])
+    def unsubscribe(self, client, channel_name):
+        """
+            A server client does not want to receive the broadcasts to a channel anymore.
+        """
+        if channel_name in self.subscribers:
+            self.subscribers[channel_name].discard(client)
 
-        # zip files and titles together
-        scenarios = zip(scenario_titles, scenario_files)
+    def broadcast(self, channel_name, message, clients=None):
+        """
+            Sends the same message to many server clients (default: all subscribers of the channel, otherwise the given
+            ones, for example the players of a game). Serialized and compressed only once (see base.network.broadcast).
+        """
+        if clients is None:
+            clients = self.subscribers.get(channel_name, ())
+        broadcast(clients, channel_name, message, self.broadcast_compression)
 
-        # sort them
-        scenarios = sorted(scenarios)  # default sort order is by first element anyway
+    def core_scenarios_changed(self):
+        """
+            A core scenario file (or the core scenario folder) has changed. Incrementally update the index and watch
+            all the scenario files (also changes of existing files should be noticed).
+        """
+        self.core_scenarios.refresh()
+        watched = set(self.core_scenarios_watcher.files())
+        files = [file for file in self.core_scenarios.files() if file not in watched]
+        if files:
+            self.core_scenarios_watcher.addPaths(files)
 
-        # return message
+    def core_scenario_titles(self, client, message):
+        """
+            A server client received a message on the c.CH_CORE_SCENARIO_TITLES channel. Return all available core
+            scenario titles and file names (sorted by title, served from the index).
+        """
         titles = {
-            'scenarios': scenarios
+            'scenarios': self.core_scenarios.titles()
         }
-        client.send(message['reply-to'], titles)
+        client.reply(message, titles)
 
     def scenario_preview(self, client, message):
         """
             A client got a message on the c.CH_SCENARIO_PREVIEW channel. In the message should be a scenario file name
-            (key = 'scenario'). Assemble a preview and send it back.
-        """
-        t0 = time.clock()
-
-        scenario = Scenario()
-        file_name = message['scenario']  # should be the file name
-        # TODO existing? can be loaded?
-        scenario.load(file_name)
-        print('reading the file took {}s'.format(time.clock() - t0))
-
-        preview = {'scenario': file_name}
-
-        # some scenario properties should be copied
-        scenario_copy_keys = [k.MAP_COLUMNS, k.MAP_ROWS, k.TITLE, k.DESCRIPTION]
-        for key in scenario_copy_keys:
-            preview[key] = scenario[key]
-
-        # some nations properties should be copied
-        nations = {}
-        nation_copy_keys = [kn.COLOR, kn.NAME, kn.DESCRIPTION]
-        for nation in scenario.all_nations():
-            nations[nation] = {}
-            for key in nation_copy_keys:
-                nations[nation][key] = scenario.get_nation_property(nation, key)
-        preview['nations'] = nations
-
-        # assemble a nations map (-1 means no nation)
-        columns = scenario[k.MAP_COLUMNS]
-        rows = scenario[k.MAP_ROWS]
-        nations_map = [-1] * (columns * rows)
-        for nation_id in scenario.all_nations():
-            provinces = scenario.get_provinces_of_nation(nation_id)
-            for province in provinces:
-                tiles = scenario.get_province_property(province, 'tiles')
-                for column, row in tiles:
-                    nations_map[row * columns + column] = nation_id
-        preview['map'] = nations_map
-
-        # send return message
-        client.send(message['reply-to'], preview)
-
-        print('generating preview took {}s'.format(time.clock() - t0))
+            (key = 'scenario'). Get the preview (from the preview cache or loaded in a worker) and send it back.
+            Concurrent requests for the same preview share a single load. Only core scenarios are served.
+        """
+        file_name = self.core_scenarios.indexed_file(message.get('scenario'))
+        if file_name is None:
+            client.reply_error(message, 'unknown scenario')
+            return
+        try:
+            preview = self.previews.lookup(file_name)
+            key = self.previews.key(file_name)
+        except OSError as error:
+            # removed meanwhile
+            client.reply_error(message, str(error))
+            return
+        if preview is not None:
+            client.reply(message, preview)
+            return
+
+        def loaded(preview):
+            self.previews.add(file_name, preview)
+            client.reply(message, preview)
+
+        self.run_in_worker(c.CH_SCENARIO_PREVIEW, client, message, load_scenario_preview, (file_name,), loaded,
+                           key=key)
+
+    def run_in_worker(self, channel_name, client, message, function, args, callback, key=None):
+        """
+            Runs the CPU heavy part of handling a request message (function with arguments, must be picklable) in the
+            worker pool. The result is given to the callback on the event loop. If the queue of the worker pool is full
+            or the function fails, the request is answered with an error instead.
+
+            Requests of the same channel with the same key (the normalized arguments) while one is still being worked
+            on get the result of that one (single flight).
+
+            If the request is cancelled meanwhile, the work is skipped or abandoned (see request_cancelled()).
+
+            Timings are recorded per channel name, see self.workers.stats().
+        """
+        request = (client, message.get('request-id'))
+
+        def done(result):
+            self.worker_requests.pop(request, None)
+            callback(result)
+
+        def failed(exception):
+            self.worker_requests.pop(request, None)
+            client.reply_error(message, str(exception))
+
+        job = self.workers.submit(channel_name, function, args, done, failed,
+                                  None if key is None else (channel_name, key))
+        if job is None:
+            client.reply_error(message, 'busy')
+        elif request[1] is not None:
+            self.worker_requests[request] = (job, done)
+        return job
+
+    def request_cancelled(self, client, request_id):
+        """
+            A server client cancelled a request. If it's worked on in the worker pool, we do not wait for it anymore.
+        """
+        entry = self.worker_requests.pop((client, request_id), None)
+        if entry is not None:
+            self.workers.cancel(*entry)
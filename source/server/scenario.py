@@ -14,12 +14,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>
 
+from array import array
 import math
 
 from PySide import QtCore
 
 import lib.utils as u
 from base import constants as c
+from server.scenario_files import SCENARIO_FORMAT_VERSION, MAP_LAYERS, native_layer, scenario_summary
 
 """
     Defines a scenario, can be loaded and saved. Should only be known to the server, never to the client (which is a
@@ -28,11 +30,23 @@ from base import constants as c
 
 # TODO rivers are implemented inefficiently
 
+
 class Scenario(QtCore.QObject):
     """
-        Has several dictionaries (properties, provinces, nations) and a list (map) defining everything.
+        Has several dictionaries (properties, provinces, nations) and a dictionary of flat arrays (map layers terrain,
+        resource, province) defining everything.
+
+        Fine grained changes are announced by signals (terrain at a position, a province (properties), a tile added
+        to a province, a nation (properties or provinces) or a river changed), so that views can update only what is
+        affected.
     """
 
+    terrain_changed = QtCore.Signal(int, int)
+    province_changed = QtCore.Signal(int)
+    province_tile_changed = QtCore.Signal(int, int, int)
+    nation_changed = QtCore.Signal(int)
+    river_changed = QtCore.Signal(int)
+
     def __init__(self):
         """
             Start with a clean state.
@@ -49,16 +63,21 @@ class Scenario(QtCore.QObject):
         self._provinces = {}
         self._nations = {}
         self._map = {}
+        # tiles of every province, derived from the province map when first needed (see get_tiles_of_province())
+        self._province_tiles = None
 
     def create_map(self, columns, rows):
         """
-            Given a size, constructs a map (list of two sub lists with each the number of tiles entries) which is 0.
+            Given a size, constructs a map (typed arrays with the number of tiles entries for every map layer) which is
+            0 (or -1 meaning no province for the province layer).
         """
         self._properties[c.PropertyKeyNames.MAP_COLUMNS] = columns
         self._properties[c.PropertyKeyNames.MAP_ROWS] = rows
         number_tiles = columns * rows
-        self._map['terrain'] = [0] * number_tiles
-        self._map['resource'] = [0] * number_tiles
+        self._map['terrain'] = array(MAP_LAYERS['terrain'], bytes(number_tiles))
+        self._map['resource'] = array(MAP_LAYERS['resource'], bytes(number_tiles))
+        self._map['province'] = array(MAP_LAYERS['province'], [-1]) * number_tiles
+        self._province_tiles = None
 
     def add_river(self, name, tiles):
         """
@@ -69,12 +88,14 @@ class Scenario(QtCore.QObject):
             'tiles': tiles
         }
         self._properties[c.PropertyKeyNames.RIVERS].extend([river])
+        self.river_changed.emit(len(self._properties[c.PropertyKeyNames.RIVERS]) - 1)
 
     def set_terrain_at(self, column, row, terrain):
         """
             Sets the terrain at a given position.
         """
         self._map['terrain'][self.map_index(column, row)] = terrain
+        self.terrain_changed.emit(column, row)
 
     def terrain_at(self, column, row):
         """
@@ -94,6 +115,12 @@ class Scenario(QtCore.QObject):
         """
         return self._map['resource'][self.map_index(column, row)]
 
+    def terrain_map(self):
+        """
+            Returns the terrain map (flat, row after row). Read only!
+        """
+        return self._map['terrain']
+
     def map_position(self, x, y):
         """
             Converts a scene position to a map position (or return (-1,-1) if
@@ -120,6 +147,14 @@ class Scenario(QtCore.QObject):
         index = row * self._properties[c.PropertyKeyNames.MAP_COLUMNS] + column
         return index
 
+    def is_valid_position(self, position):
+        """
+            Returns True if a position (column, row) lies inside the map.
+        """
+        column, row = position
+        return 0 <= column < self._properties[c.PropertyKeyNames.MAP_COLUMNS] and 0 <= row < self._properties[
+            c.PropertyKeyNames.MAP_ROWS]
+
     def get_neighbor_position(self, column, row, direction):
         """
             Given a positon (column, row) and a direction (c.TileDirections) return the position of the next neighbor
@@ -207,14 +242,25 @@ class Scenario(QtCore.QObject):
         else:
             raise RuntimeError('Unknown property {}.'.format(key))
 
+    def all_provinces(self):
+        """
+            Return a list of ids for all provinces.
+        """
+        return self._provinces.keys()
+
     def new_province(self):
         """
             Creates a new (nation-less) province and returns it.
         """
         province = len(self._provinces)  # this always works because we check after loading
         self._provinces[province] = {}
-        self._provinces[province]['tiles'] = []
         self._provinces[province]['nation'] = None
+        if self._province_tiles is not None:
+            self._province_tiles[province] = []
+        # the new province does not own any tiles yet, but the province map must cover the whole map
+        number_tiles = len(self._map.get('terrain', []))
+        if len(self._map.get('province', [])) != number_tiles:
+            self._map['province'] = array(MAP_LAYERS['province'], [-1]) * number_tiles
         return province
 
     def set_province_property(self, province, key, value):
@@ -223,6 +269,7 @@ class Scenario(QtCore.QObject):
         """
         if province in self._provinces:
             self._provinces[province][key] = value
+            self.province_changed.emit(province)
         else:
             raise RuntimeError('Unknown province {}.'.format(province))
 
@@ -237,11 +284,20 @@ class Scenario(QtCore.QObject):
 
     def add_province_map_tile(self, province, position):
         """
-            Adds a position to a province.
-            TODO we should check that this position is not yet in another province (it should be cleared before). fail fast, fail often
+            Adds a position to a province. The position must not yet be part of another province (it should be cleared
+            before). Fail fast, fail often.
         """
         if province in self._provinces and self.is_valid_position(position):
-            self._provinces[province]['tiles'].append(position)
+            index = self.map_index(*position)
+            owner = self._map['province'][index]
+            if owner == province:
+                return
+            if owner != -1:
+                raise RuntimeError('Position {} already part of province {}.'.format(position, owner))
+            self._map['province'][index] = province
+            if self._province_tiles is not None:
+                self._province_tiles[province].append(list(position))
+            self.province_tile_changed.emit(province, position[0], position[1])
 
     def all_nations(self):
         """
@@ -265,6 +321,7 @@ class Scenario(QtCore.QObject):
         """
         if nation in self._nations:
             self._nations[nation]['properties'][key] = value
+            self.nation_changed.emit(nation)
         else:
             raise RuntimeError('Unknown nation {}.'.format(nation))
 
@@ -286,26 +343,91 @@ class Scenario(QtCore.QObject):
         else:
             raise RuntimeError('Unknown nation {}.'.format(nation))
 
+    def get_tiles_of_province(self, province):
+        """
+            Return the positions ([column, row]) of all tiles of a province. Derived from the province map for all
+            provinces at once when first needed, then kept up to date.
+        """
+        if province not in self._provinces:
+            raise RuntimeError('Unknown province {}.'.format(province))
+        if self._province_tiles is None:
+            self.update_province_tiles()
+        return self._province_tiles[province]
+
     def get_province_at(self, column, row):
         """
-            Given a position (column, row) returns the province.
+            Given a position (column, row) returns the province (or None if the position belongs to no province).
+
+            Constant time lookup in the province map.
+        """
+        province = self._map['province'][self.map_index(column, row)]
+        if province == -1:
+            return None
+        return province
+
+    def update_province_map(self, province_tiles):
+        """
+            Rebuilds the province map (a flat array like the terrain map holding the province id of each tile or -1 if
+            the tile belongs to no province) from the tiles lists of all provinces (dictionary by province).
+        """
+        province_map = array(MAP_LAYERS['province'], [-1]) * len(self._map.get('terrain', []))
+        for province, tiles in province_tiles.items():
+            for position in tiles:
+                province_map[self.map_index(*position)] = province
+        self._map['province'] = province_map
+        self._province_tiles = None
+
+    def update_province_tiles(self):
+        """
+            The inverse of update_province_map(). Rebuilds the tiles lists of all provinces from the province map.
+        """
+        province_tiles = {province: [] for province in self._provinces}
+        columns = self._properties[c.PropertyKeyNames.MAP_COLUMNS]
+        for index, province in enumerate(self._map['province']):
+            if province != -1:
+                province_tiles[province].append([index % columns, index // columns])
+        self._province_tiles = province_tiles
+
+    def province_map(self):
+        """
+            Returns the province map (flat, same layout as the terrain map, -1 means no province). Read only!
+        """
+        return self._map['province']
 
-            TODO speed up by having a reference in the map. (see also programmers.SE question)
+    def nation_map(self):
+        """
+            Returns a nations map (flat list, same layout as the terrain map) with the nation id of every tile (-1 means
+            no nation).
         """
-        position = [column, row]  # internally because of JSON saving we only have []
-        for province in self._provinces:
-            if position in self._provinces[province]['tiles']:
-                return province
-        return None
+        # lookup table province -> nation, the additional last entry is for province -1 (no province) and also gives
+        # -1 (no nation)
+        lookup = [-1] * (len(self._provinces) + 1)
+        for nation in self._nations:
+            for province in self._nations[nation]['provinces']:
+                lookup[province] = nation
+        return [lookup[province] for province in self._map['province']]
 
     def transfer_province_to_nation(self, province, nation):
         """
-            Moves a province to a nation.
+            Moves a province to a nation (removes it from the nation it belonged to before).
         """
-        # TODO this is not right yet
+        old_nation = self._provinces[province]['nation']
+        if old_nation == nation:
+            return
+        if old_nation is not None:
+            self._nations[old_nation]['provinces'].remove(province)
         # wire it in both ways
         self._nations[nation]['provinces'].append(province)
         self._provinces[province]['nation'] = nation
+        if old_nation is not None:
+            self.nation_changed.emit(old_nation)
+        self.nation_changed.emit(nation)
+
+    def summary(self):
+        """
+            Returns the summary (title, description, map size, nations) of this scenario, see scenario_summary().
+        """
+        return scenario_summary(self._properties, self._nations)
 
     def get_terrain_name(self, terrain):
         """
@@ -315,19 +437,37 @@ class Scenario(QtCore.QObject):
         """
         return self._properties['rules']['terrain.names'][terrain]
 
-    def load(self, file_name):
+    def load(self, file_name, with_rules=True):
         """
-            Loads/deserializes all internal variables from a zipped archive via JSON.
+            Loads/deserializes all internal variables from a zipped archive. The rules are only loaded if with_rules is
+            True.
+
+            The map layers of the current format are memory mapped (copy on write) and only read when accessed. Old
+            scenarios (version 1, everything in YAML) are upgraded automatically, they will be saved in the current
+            format.
         """
         self.reset()
         reader = u.ZipArchiveReader(file_name)
         self._properties = reader.read_as_yaml('properties')
-        self._map = reader.read_as_yaml('map')
         self._provinces = reader.read_as_yaml('provinces')
         # TODO check all ids are smaller then len()
         self._nations = reader.read_as_yaml('nations')
         # TODO check all ids are smaller then len()
-        self.load_rules()
+        if 'header' in reader.namelist():
+            header = reader.read_as_yaml('header')
+            if header['version'] > SCENARIO_FORMAT_VERSION:
+                raise RuntimeError('Scenario format version {} not supported.'.format(header['version']))
+            for layer, typecode in header['layers'].items():
+                self._map[layer] = native_layer(reader.memory_map('map.' + layer, typecode), typecode)
+        else:
+            # version 1, the whole map is in YAML and the tiles of the provinces are stored with the provinces
+            map = reader.read_as_yaml('map')
+            for layer in ('terrain', 'resource'):
+                self._map[layer] = array(MAP_LAYERS[layer], map[layer])
+            self.update_province_map({province: self._provinces[province].pop('tiles', []) for province in
+                                      self._provinces})
+        if with_rules:
+            self.load_rules()
 
     def load_rules(self):
         """
@@ -339,10 +479,24 @@ class Scenario(QtCore.QObject):
 
     def save(self, file_name):
         """
-            Saves/serializes all internal variables via JSON into a zipped archive.
+            Saves/serializes all internal variables into a zipped archive. The map layers are stored uncompressed as
+            raw arrays, everything else via YAML. The tiles of the provinces are not stored, they are contained in the
+            province map layer.
         """
+        # detach the layers from memory mapped files (we might just overwrite the file we loaded from)
+        for layer in MAP_LAYERS:
+            self._map[layer] = array(MAP_LAYERS[layer], self._map[layer])
+
+        header = {
+            'version': SCENARIO_FORMAT_VERSION,
+            'layers': MAP_LAYERS,
+            'summary': self.summary()
+        }
         writer = u.ZipArchiveWriter(file_name)
+        writer.write_as_yaml('header', header)
         writer.write_as_yaml('properties', self._properties)
-        writer.write_as_yaml('map', self._map)
+        for layer in MAP_LAYERS:
+            data = native_layer(self._map[layer], MAP_LAYERS[layer]).tobytes()
+            writer.write('map.' + layer, data, compress=False)
         writer.write_as_yaml('provinces', self._provinces)
         writer.write_as_yaml('nations', self._nations)
@@ -0,0 +1,380 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from array import array
+from collections import OrderedDict
+import os
+import sys
+from threading import Event, Lock
+
+import lib.utils as u
+from lib.geometry import grid_outlines
+from base.constants import PropertyKeyNames as k, NationPropertyKeyNames as kn
+
+"""
+    Scenario files without Qt (also for the headless server): the file format, the headers of scenario files (and an
+    index of them) and the previews of scenarios (and a cache of them). The scenario itself is in server/scenario.py.
+"""
+
+# Version of the scenario container. Version 1 stored everything as YAML, version 2 stores the map layers as raw
+# little endian arrays (uncompressed, can be memory mapped) and only the small rest as YAML.
+SCENARIO_FORMAT_VERSION = 2
+
+# The map layers with their array type codes (terrain and resource are uint8, province ids are int16 with -1 = none)
+MAP_LAYERS = {
+    'terrain': 'B',
+    'resource': 'B',
+    'province': 'h'
+}
+
+
+def scenario_summary(properties, nations):
+    """
+        Given the properties and the nations of a scenario, assembles the small summary (title, description, map size,
+        names and colors of the nations) that is stored in the header of a scenario file.
+    """
+    summary = {key: properties[key] for key in (k.TITLE, k.DESCRIPTION, k.MAP_COLUMNS, k.MAP_ROWS) if key in properties}
+    summary['nations'] = {}
+    for nation in nations:
+        summary['nations'][nation] = {key: nations[nation]['properties'].get(key) for key in (kn.NAME, kn.COLOR)}
+    return summary
+
+
+def read_scenario_header(file_name):
+    """
+        Reads only the summary of a scenario file. Fast for the current format (small header entry), older scenarios
+        need their properties and nations entries parsed.
+    """
+    reader = u.ZipArchiveReader(file_name)
+    if 'header' in reader.namelist():
+        header = reader.read_as_yaml('header')
+        if 'summary' in header:
+            return header['summary']
+    return scenario_summary(reader.read_as_yaml('properties'), reader.read_as_yaml('nations'))
+
+
+def native_layer(layer, typecode):
+    """
+        Map layers are stored in little endian byte order. On big endian machines we need a swapped copy.
+    """
+    if sys.byteorder == 'little':
+        return layer
+    layer = array(typecode, layer)
+    layer.byteswap()
+    return layer
+
+
+def read_province_map(reader, properties):
+    """
+        Reads the province map layer of a scenario file (given the zip archive reader and the scenario properties).
+        Memory mapped for the current format, built from the tiles lists of the provinces for version 1.
+    """
+    typecode = MAP_LAYERS['province']
+    if 'header' in reader.namelist():
+        header = reader.read_as_yaml('header')
+        if header['version'] > SCENARIO_FORMAT_VERSION:
+            raise RuntimeError('Scenario format version {} not supported.'.format(header['version']))
+        return native_layer(reader.memory_map('map.province', typecode), typecode)
+    columns = properties[k.MAP_COLUMNS]
+    province_map = array(typecode, [-1]) * (columns * properties[k.MAP_ROWS])
+    provinces = reader.read_as_yaml('provinces')
+    for province in provinces:
+        for column, row in provinces[province]['tiles']:
+            province_map[row * columns + column] = province
+    return province_map
+
+
+def create_scenario_preview(file_name):
+    """
+        Assembles a preview of a scenario file: some scenario and nation properties, a nations map (flat array of
+        nation ids for every tile, -1 means no nation) and the outlines of all nations (see lib.geometry.grid_outlines,
+        not staggered). Only reads what is needed from the file.
+    """
+    reader = u.ZipArchiveReader(file_name)
+    properties = reader.read_as_yaml('properties')
+    nations = reader.read_as_yaml('nations')
+
+    preview = {'scenario': file_name}
+
+    # some scenario properties should be copied
+    scenario_copy_keys = [k.MAP_COLUMNS, k.MAP_ROWS, k.TITLE, k.DESCRIPTION]
+    for key in scenario_copy_keys:
+        preview[key] = properties[key]
+
+    # some nations properties should be copied
+    nation_copy_keys = [kn.COLOR, kn.NAME, kn.DESCRIPTION]
+    preview['nations'] = {nation: {key: nations[nation]['properties'].get(key) for key in nation_copy_keys} for
+                          nation in nations}
+
+    # nations map (a typed array, travels as raw data with the binary codec), lookup province -> nation
+    lookup = {-1: -1}
+    for nation in nations:
+        for province in nations[nation]['provinces']:
+            lookup[province] = nation
+    province_map = read_province_map(reader, properties)
+    preview['map'] = array('h', [lookup.get(province, -1) for province in province_map])
+
+    # the outlines of all nations
+    columns = properties[k.MAP_COLUMNS]
+    rows = properties[k.MAP_ROWS]
+    outlines = grid_outlines(preview['map'], columns, rows, ignore=-1)
+    # points as lists (tuples would not survive every serialization)
+    preview['outlines'] = {nation: [[list(point) for point in polygon] for polygon in polygons] for
+                           nation, polygons in outlines.items()}
+
+    return preview
+
+
+def load_scenario_preview(file_name, persist=True):
+    """
+        Returns the preview of a scenario file from the persisted preview (file name + '.preview') if it belongs to the
+        current version of the file, otherwise creates it (and persists it if persist is True). Can run in a worker
+        process.
+    """
+    stat = os.stat(file_name)
+    preview = _read_persisted_preview(file_name, stat) if persist else None
+    if preview is None:
+        preview = create_scenario_preview(file_name)
+        if persist:
+            _write_persisted_preview(file_name, stat, preview)
+    return preview
+
+
+def _read_persisted_preview(file_name, stat):
+    """
+        Reads a persisted preview if it exists and belongs to the current version of the scenario file.
+    """
+    if not os.path.isfile(file_name + '.preview'):
+        return None
+    try:
+        persisted = u.read_as_yaml(file_name + '.preview')
+    except Exception:
+        return None
+    if persisted.get('mtime') != stat.st_mtime or persisted.get('size') != stat.st_size:
+        return None
+    preview = persisted['preview']
+    preview['map'] = array('h', preview['map'])
+    return preview
+
+
+def _write_persisted_preview(file_name, stat, preview):
+    """
+        Persists a preview next to the scenario file (if possible).
+    """
+    persisted = {
+        'mtime': stat.st_mtime,
+        'size': stat.st_size,
+        'preview': preview
+    }
+    try:
+        u.write_as_yaml(file_name + '.preview', persisted)
+    except OSError:
+        pass
+
+
+class ScenarioPreviewCache():
+    """
+        Least recently used cache of scenario previews (see create_scenario_preview()) keyed by file name and
+        modification time of the scenario file. Previews are also persisted next to the scenario file (see
+        load_scenario_preview()) so that they survive restarts. Can be used from several threads, concurrent get()s of
+        the same preview wait for a single load.
+
+        Either get() them (loaded or created right away if not in memory) or lookup() only the ones in memory and add()
+        previews loaded somewhere else (for example in a worker process).
+    """
+
+    def __init__(self, capacity=20, persist=True):
+        """
+            Given the maximal number of previews held in memory and if previews should be persisted.
+        """
+        self.capacity = capacity
+        self.persist = persist
+        self._previews = OrderedDict()
+        self._lock = Lock()
+        # previews being loaded by get(), key -> event set when done
+        self._loading = {}
+
+    def get(self, file_name):
+        """
+            Returns the preview of a scenario file. Either from memory, from the persisted preview or newly created.
+        """
+        key = self.key(file_name)
+        with self._lock:
+            if key in self._previews:
+                self._previews.move_to_end(key)
+                return self._previews[key]
+            loading = self._loading.get(key)
+            if loading is None:
+                self._loading[key] = Event()
+        if loading is not None:
+            # another thread loads it already
+            loading.wait()
+            return self.get(file_name)
+        try:
+            preview = load_scenario_preview(file_name, self.persist)
+            self.add(file_name, preview)
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+        return preview
+
+    def lookup(self, file_name):
+        """
+            Returns the preview of a scenario file if it is in memory (otherwise None).
+        """
+        key = self.key(file_name)
+        with self._lock:
+            if key in self._previews:
+                self._previews.move_to_end(key)
+                return self._previews[key]
+        return None
+
+    def add(self, file_name, preview):
+        """
+            Adds a preview of a scenario file to the memory (the least recently used previews are dropped).
+        """
+        key = self.key(file_name)
+        with self._lock:
+            self._previews[key] = preview
+            self._previews.move_to_end(key)
+            while len(self._previews) > self.capacity:
+                self._previews.popitem(last=False)
+
+    def precompute(self, file_names):
+        """
+            Makes sure previews of all given scenario files are available (for example in a background thread when the
+            server starts).
+        """
+        for file_name in file_names:
+            self.get(file_name)
+
+    @staticmethod
+    def key(file_name):
+        """
+            The key of the preview of a scenario file (absolute file name and modification time).
+        """
+        return os.path.abspath(file_name), os.stat(file_name).st_mtime
+
+
+class ScenarioHeaderIndex():
+    """
+        Index of the headers (see read_scenario_header()) of all scenario files in a folder. Entries are keyed by file
+        name and only re-read if modification time or size of the file change. Optionally persisted in an index file,
+        so that a restart does not have to open all the scenario files again. Files that cannot be read are left out
+        (until they change).
+    """
+
+    def __init__(self, folder, index_file=None):
+        """
+            Given a folder and optionally an index file, loads the persisted index (if existing). Call refresh() to
+            bring it up to date.
+        """
+        self.folder = folder
+        self.index_file = index_file
+        self._entries = {}
+        self._titles = None
+        # (modification time, size) of files that could not be read by file name
+        self._failed = {}
+        if index_file is not None and os.path.isfile(index_file):
+            try:
+                self._entries = u.read_as_yaml(index_file) or {}
+            except Exception:
+                # a corrupt index is simply rebuilt
+                self._entries = {}
+
+    def refresh(self):
+        """
+            Compares the index with the scenario files in the folder. Reads the headers of new or changed files, removes
+            deleted files and persists the index if anything changed. Returns True if something changed.
+        """
+        changed = False
+        existing = set()
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith('.scenario'):
+                continue
+            stat = entry.stat()
+            cached = self._entries.get(entry.name)
+            if cached is not None and cached['mtime'] == stat.st_mtime and cached['size'] == stat.st_size:
+                existing.add(entry.name)
+                continue
+            if self._failed.get(entry.name) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                header = read_scenario_header(entry.path)
+                if k.TITLE not in header:
+                    raise RuntimeError('No title.')
+            except Exception as exception:
+                # a corrupt (or incomplete) file is left out until it changes
+                print('cannot read scenario header of {}: {}'.format(entry.path, exception))
+                self._failed[entry.name] = (stat.st_mtime, stat.st_size)
+                continue
+            self._failed.pop(entry.name, None)
+            existing.add(entry.name)
+            self._entries[entry.name] = {
+                'mtime': stat.st_mtime,
+                'size': stat.st_size,
+                'header': header
+            }
+            changed = True
+        for name in set(self._entries.keys()) - existing:
+            del self._entries[name]
+            changed = True
+
+        if changed:
+            self._titles = None
+            if self.index_file is not None:
+                try:
+                    u.write_as_yaml(self.index_file, self._entries)
+                except OSError:
+                    # not writable, we just keep it in memory
+                    pass
+        return changed
+
+    def files(self):
+        """
+            Returns the full paths of all indexed scenario files.
+        """
+        return [os.path.join(self.folder, name) for name in self._entries]
+
+    def header(self, file_name):
+        """
+            Returns the header of an indexed scenario file (or None if not in the index).
+        """
+        entry = self._entries.get(os.path.basename(file_name))
+        return entry['header'] if entry is not None else None
+
+    def indexed_file(self, file_name):
+        """
+            Returns the full path of the scenario file if the given file name (for example from a client) refers to an
+            indexed scenario file, otherwise None.
+        """
+        if not isinstance(file_name, str):
+            return None
+        name = os.path.basename(file_name)
+        path = os.path.join(self.folder, name)
+        if name not in self._entries or os.path.abspath(file_name) != os.path.abspath(path):
+            return None
+        return path
+
+    def titles(self):
+        """
+            Returns a list of (title, file path) of all indexed scenarios sorted by title. Cached until the next change.
+        """
+        if self._titles is None:
+            titles = [(entry['header'][k.TITLE], os.path.join(self.folder, name)) for name, entry in
+                      self._entries.items()]
+            self._titles = sorted(titles)  # default sort order is by first element anyway
+        return self._titles
@@ -0,0 +1,161 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from concurrent.futures import ProcessPoolExecutor
+import time
+
+from PySide import QtCore
+
+"""
+    Execution of CPU heavy work (for example creating scenario previews) outside of the Qt event loop of the server, so
+    that the other clients are not blocked meanwhile.
+"""
+
+
+def _timed_call(function, args):
+    """
+        Runs in the worker. Calls the function and returns the result together with the run time.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+class Job():
+    """
+        A function submitted to the worker pool, together with the callbacks (of everyone waiting for the result) and
+        the time of submission.
+    """
+
+    def __init__(self, name, callback, error_callback, key=None):
+        self.name = name
+        self.callbacks = [(callback, error_callback)]
+        self.key = key
+        self.submitted = time.perf_counter()
+        self.future = None
+
+
+class WorkerPool(QtCore.QObject):
+    """
+        Runs functions in a pool of worker processes (or any other concurrent.futures executor, for example a
+        ThreadPoolExecutor) and delivers the results to callbacks on the Qt thread the pool lives in.
+
+        At most max_pending jobs are queued or running at the same time, further submissions are rejected. Run times and
+        total times (including the time waiting in the queue) are recorded per name of the job (for example a channel).
+
+        Jobs submitted with a key are single flight: while a job with the same key is queued or running, further
+        submissions wait for its result instead of computing it again.
+
+        Jobs nobody waits for anymore (see cancel()) are skipped if still queued, a running one cannot be interrupted
+        but its result is dropped.
+
+        Functions and arguments must be picklable for worker processes (module level functions).
+    """
+
+    # emitted from the executor thread, received (queued) on our thread
+    job_done = QtCore.Signal(object)
+
+    def __init__(self, executor=None, max_pending=32):
+        """
+            Given an executor (default is a ProcessPoolExecutor with one process per CPU) and the maximal number of
+            pending jobs.
+        """
+        super().__init__()
+        self.executor = executor if executor is not None else ProcessPoolExecutor()
+        self.max_pending = max_pending
+        self.pending = 0
+        self.timings = {}
+        # jobs with a key by key
+        self.flights = {}
+        self.job_done.connect(self.finish, QtCore.Qt.QueuedConnection)
+
+    def submit(self, name, function, args, callback, error_callback=None, key=None):
+        """
+            Submits a function with arguments (tuple). When done, callback is called with the result (or error_callback
+            with the exception). Returns the job or None if the queue is full (the caller should answer with an error).
+
+            If a key (hashable, for example the channel name and the normalized arguments) is given and a job with the
+            same key is still pending, the callbacks are added to this job instead.
+        """
+        if key is not None and key in self.flights:
+            job = self.flights[key]
+            job.callbacks.append((callback, error_callback))
+            self._timing(name)['joined'] += 1
+            return job
+        if self.pending >= self.max_pending:
+            return None
+        self.pending += 1
+        job = Job(name, callback, error_callback, key)
+        if key is not None:
+            self.flights[key] = job
+        job.future = self.executor.submit(_timed_call, function, args)
+        job.future.add_done_callback(lambda future: self.job_done.emit(job))
+        return job
+
+    def finish(self, job):
+        """
+            A job is done, record the timing and call the callbacks.
+        """
+        self.pending -= 1
+        if job.key is not None and self.flights.get(job.key) is job:
+            del self.flights[job.key]
+        timing = self._timing(job.name)
+        timing['total_time'] += time.perf_counter() - job.submitted
+        if job.future.cancelled():
+            timing['cancelled'] += 1
+            return
+        try:
+            result, run_time = job.future.result()
+        except Exception as exception:
+            timing['errors'] += 1
+            for callback, error_callback in job.callbacks:
+                if error_callback is not None:
+                    error_callback(exception)
+                else:
+                    print('job {} failed: {}'.format(job.name, exception))
+            return
+        timing['count'] += 1
+        timing['run_time'] += run_time
+        timing['max_run_time'] = max(timing['max_run_time'], run_time)
+        for callback, error_callback in job.callbacks:
+            callback(result)
+
+    def cancel(self, job, callback):
+        """
+            The given callback is not interested in the result of a job anymore. If nobody else waits for it, the job
+            is skipped (if not yet running) or abandoned (the result is dropped).
+        """
+        job.callbacks = [entry for entry in job.callbacks if entry[0] is not callback]
+        # a running job stays joinable for later submissions with the same key, a skipped one not
+        if not job.callbacks and job.future.cancel() and job.key is not None and self.flights.get(job.key) is job:
+            del self.flights[job.key]
+
+    def _timing(self, name):
+        return self.timings.setdefault(name, {'count': 0, 'errors': 0, 'joined': 0, 'cancelled': 0, 'run_time': 0,
+                                              'max_run_time': 0, 'total_time': 0})
+
+    def stats(self):
+        """
+            Number of pending jobs and the timings per name (counts, submissions that joined a pending job, skipped
+            jobs, run times and total times in seconds).
+        """
+        return {'pending': self.pending, 'timings': self.timings}
+
+    def shutdown(self):
+        """
+            No more jobs, the workers end after the running ones.
+        """
+        self.executor.shutdown(wait=False)
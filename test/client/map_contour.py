@@ -4,8 +4,11 @@
 
 from PySide import QtGui
 
+import lib.graphics as g
+from lib.geometry import grid_outlines
 from base import constants as c
-from server.scenario import *
+from base.constants import PropertyKeyNames as k
+from server.scenario import Scenario
 
 # load scenario
 
@@ -13,37 +16,28 @@ scenario = Scenario()
 scenario.load(c.extend(c.Core_Scenario_Folder, 'Europe1814.scenario'))
 
 # nation map
-columns = scenario[MAP_COLUMNS]
-rows = scenario[MAP_ROWS]
-map = [0] * (columns * rows)
-for nation in scenario.all_nations():
-    provinces = scenario.get_provinces_of_nation(nation)
-    for province in provinces:
-        tiles = scenario.get_province_property(province, 'tiles')
-        for column, row in tiles:
-            map[row * columns + column] = nation
+columns = scenario[k.MAP_COLUMNS]
+rows = scenario[k.MAP_ROWS]
+map = scenario.nation_map()
 
-# get outlines
+# get outlines (all nations in one pass)
+outlines = grid_outlines(map, columns, rows, stagger=True, ignore=-1)
 for nation in scenario.all_nations():
-    visited = [False] * (columns * rows)
-    for i in range(0, columns * rows):
-        column = i % columns
-        row = i // columns
-        visited[i] = True
-        if map[i] == nation:
-            for direction in c.TileDirections:
-                position = scenario.get_neighbor_position(column, row, direction)
-                if position is None or map[position[0] + columns * position[1]] != nation: # outside is automatically seen as border
-                    # now that is interesting we are at a border, follow
-                    print(position)
+    print('{}: {} polygons'.format(scenario.get_nation_property(nation, 'name'), len(outlines.get(nation, []))))
 
 
 app = QtGui.QApplication([])
 
 scene = QtGui.QGraphicsScene()
+for nation in scenario.all_nations():
+    color = QtGui.QColor()
+    color.setNamedColor(scenario.get_nation_property(nation, 'color'))
+    path = g.create_path_from_polygons(outlines.get(nation, []))
+    scene.addPath(path, brush=QtGui.QBrush(color))
 
 view = QtGui.QGraphicsView(scene)
 view.resize(300, 240)
+view.fitInView(scene.sceneRect())
 
 view.show()
 
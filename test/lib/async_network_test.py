@@ -0,0 +1,89 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from lib.async_network import AsyncNetworkClient
+import lib.protocol as protocol
+
+"""
+    Tests of the asyncio network client (lib/async_network.py) on a fake transport, no Qt and no event loop needed.
+    Run with pytest or directly (from the source folder).
+"""
+
+
+class Transport():
+    """
+        Collects the written data and remembers if the connection was aborted.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.aborted = False
+
+    def write(self, data):
+        self.data += data
+
+    def abort(self):
+        self.aborted = True
+
+    def close(self):
+        pass
+
+
+def receive(data):
+    """
+        A new client receives some data. Returns the transport and if the client refused the data (RuntimeError).
+    """
+    client = AsyncNetworkClient()
+    transport = Transport()
+    client.connection_made(transport)
+    try:
+        client.data_received(data)
+    except RuntimeError:
+        return transport, True
+    return transport, False
+
+
+def control_frame(value):
+    return protocol.length_prefixed(protocol.encode_frame(value, protocol.YamlCodec, control=True))
+
+
+def test_partial_and_coalesced():
+    data = control_frame({'codecs': ['binary']}) + control_frame({'stream': 1, 'size': 3})
+    client = AsyncNetworkClient()
+    client.connection_made(Transport())
+    for position in range(len(data)):
+        client.data_received(data[position:position + 1])
+    assert client.negotiated and client.codec is protocol.BinaryCodec
+    assert 1 in client.assembler.streams
+
+
+def test_empty_frame():
+    transport, refused = receive(protocol.length_prefixed(b''))
+    assert refused and transport.aborted
+
+
+def test_malformed_control():
+    for value in ({'stream': 1}, {'stream': 1, 'size': 'large'}, {'stream': None, 'size': 10}, ['codecs'],
+                  {'codec': 'unknown'}):
+        transport, refused = receive(control_frame(value))
+        assert refused and transport.aborted
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
@@ -0,0 +1,82 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import random
+
+from lib.geometry import grid_outlines, grid_runs
+
+"""
+    Tests of the grid geometry (lib/geometry.py), no Qt needed. Run with pytest or directly (from the source folder).
+"""
+
+
+def area(polygon):
+    """
+        Signed area of a polygon (positive if clockwise on screen, y pointing down).
+    """
+    return sum(x * ny - nx * y for (x, y), (nx, ny) in zip(polygon, polygon[1:] + polygon[:1])) / 2
+
+
+def test_outlines_rectangle():
+    # a block of 2 x 2 tiles of value 1 in a sea of 0
+    values = [0, 0, 0, 0,
+              0, 1, 1, 0,
+              0, 1, 1, 0]
+    outlines = grid_outlines(values, 4, 3, ignore=0)
+    assert list(outlines.keys()) == [1]
+    polygon, = outlines[1]
+    assert sorted(polygon) == [(1, 1), (1, 3), (3, 1), (3, 3)]
+    assert area(polygon) == 4
+
+
+def test_outlines_hole():
+    # a ring of value 1 around a single tile of 0
+    values = [1, 1, 1,
+              1, 0, 1,
+              1, 1, 1]
+    polygons = grid_outlines(values, 3, 3, ignore=0)[1]
+    assert sorted(area(polygon) for polygon in polygons) == [-1, 9]
+
+
+def test_outlines_areas():
+    # the outer borders minus the holes of every value cover as many tiles as the value has, also staggered
+    random.seed(0)
+    columns, rows = 17, 11
+    values = [random.choice((-1, 0, 1, 2)) for _ in range(columns * rows)]
+    for stagger in (False, True):
+        outlines = grid_outlines(values, columns, rows, stagger=stagger, ignore=-1)
+        assert set(outlines.keys()) == {0, 1, 2}
+        for value, polygons in outlines.items():
+            assert sum(area(polygon) for polygon in polygons) == values.count(value)
+
+
+def test_runs():
+    random.seed(0)
+    columns, rows = 13, 7
+    values = [random.choice((0, 1, 2)) for _ in range(columns * rows)]
+    for stagger in (False, True):
+        restored = [0] * (columns * rows)
+        for value, x, y, width in grid_runs(values, columns, rows, stagger=stagger, ignore=0):
+            column = int(x - (0.5 if stagger and y % 2 == 1 else 0))
+            restored[y * columns + column:y * columns + column + width] = [value] * width
+        assert restored == values
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
@@ -0,0 +1,129 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from PySide import QtCore
+
+import base.constants as c
+from base.network import Dispatcher
+from server.connections import ConnectionRegistry
+
+"""
+    Tests of the registry of connected server clients with heartbeats (server/connections.py). The clients only record
+    what is done with them. Run with pytest or directly (from the source folder).
+"""
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+class Socket(QtCore.QObject):
+    """
+        Records whether it was aborted and scheduled for deletion.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.aborted = False
+        self.deleted = False
+
+    def abort(self):
+        self.aborted = True
+
+    def deleteLater(self):
+        self.deleted = True
+
+
+class Client(QtCore.QObject):
+    """
+        Stands in for a base.network.NetworkClient, records requests and delivered letters.
+    """
+
+    disconnected = QtCore.Signal()
+
+    def __init__(self, dispatcher=None):
+        super().__init__()
+        self.socket = Socket()
+        self.dispatcher = dispatcher
+        self.throttled = False
+        self.requests = []
+        self.delivered = []
+
+    def request(self, channel_name, message, callback):
+        self.requests.append((channel_name, callback))
+
+    def deliver(self, channel_name, content):
+        self.delivered.append((channel_name, content))
+
+
+def registry(max_missed=3):
+    connections = ConnectionRegistry(max_missed=max_missed)
+    # heartbeats are triggered by the tests
+    connections.heartbeat_timer.stop()
+    return connections
+
+
+def test_add_remove():
+    connections = registry()
+    removed = []
+    connections.removed.connect(removed.append)
+    first, second = Client(), Client()
+    assert connections.add(first) == 1 and connections.add(second) == 2
+    assert first.client_id == 1 and connections.get(2) is second and len(connections) == 2
+    second.disconnected.emit()
+    assert removed == [second] and connections.get(2) is None and list(connections) == [first]
+    assert second.socket.deleted and not first.socket.deleted
+    # ids are not reused, removing twice does nothing
+    assert connections.add(Client()) == 3
+    connections.remove(2)
+    assert removed == [second]
+
+
+def test_heartbeat():
+    connections = registry(max_missed=2)
+    alive, dead = Client(), Client()
+    connections.add(alive)
+    connections.add(dead)
+    connections.heartbeat()
+    assert [channel_name for channel_name, callback in alive.requests] == [c.CH_PING]
+    alive.requests[0][1](alive, None)
+    assert connections.stats()['rtts'][alive.client_id] is not None
+    # only one outstanding ping, the dead client misses heartbeats until it is evicted
+    connections.heartbeat()
+    assert len(alive.requests) == 2 and len(dead.requests) == 1
+    alive.requests[1][1](alive, None)
+    connections.heartbeat()
+    assert dead.socket.aborted and dead.socket.deleted and connections.get(dead.client_id) is None
+    assert connections.stats()['evicted'] == 1 and connections.stats()['clients'] == 1
+
+
+def test_remove_drops_queued_letters():
+    dispatcher = Dispatcher()
+    connections = registry()
+    first, second = Client(dispatcher), Client(dispatcher)
+    connections.add(first)
+    connections.add(second)
+    for client in (first, second):
+        dispatcher.schedule(client, 'chat', 'hello')
+        dispatcher.schedule(client, c.CH_PING, {})
+    connections.remove(first.client_id)
+    dispatcher.dispatch()
+    assert not first.delivered and len(second.delivered) == 2
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
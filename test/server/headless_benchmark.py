@@ -0,0 +1,110 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import asyncio
+import time
+from multiprocessing import Process
+
+import base.constants as c
+from lib.async_network import new_event_loop
+from server.headless import run, create_client
+
+"""
+    Holds thousands of idle connections to a headless server (in its own process, so on one core) while some active
+    connections send requests as fast as possible. Reports connection time, request throughput and latency and the
+    memory of the server.
+"""
+
+PORT = 42999
+IDLE_CONNECTIONS = 2000
+ACTIVE_CONNECTIONS = 50
+REQUESTS_PER_CONNECTION = 200
+
+
+def server_memory(pid):
+    """
+        Resident memory of a process in MB (Linux only).
+    """
+    try:
+        with open('/proc/{}/status'.format(pid)) as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+
+
+async def connect(loop, number):
+    clients = []
+    for _ in range(number):
+        transport, client = await loop.create_connection(create_initiating_client, '127.0.0.1', PORT)
+        clients.append(client)
+    return clients
+
+
+def create_initiating_client():
+    client = create_client()
+    client.initiate = True
+    return client
+
+
+async def requests(client, latencies):
+    """
+        Sends requests for the core scenario titles one after another.
+    """
+    for _ in range(REQUESTS_PER_CONNECTION):
+        future = asyncio.get_event_loop().create_future()
+        client.channels[c.CH_RPC_REPLY] = [lambda client, message: future.done() or future.set_result(message)]
+        start = time.perf_counter()
+        client.send(c.CH_CORE_SCENARIO_TITLES, {'request-id': 1})
+        await future
+        latencies.append(time.perf_counter() - start)
+
+
+async def benchmark(loop, pid):
+    print('server memory at start {:.1f} MB'.format(server_memory(pid) or 0))
+
+    start = time.perf_counter()
+    idle = await connect(loop, IDLE_CONNECTIONS)
+    print('{} idle connections in {:.2f}s, server memory {:.1f} MB'.format(len(idle), time.perf_counter() - start,
+                                                                           server_memory(pid) or 0))
+
+    active = await connect(loop, ACTIVE_CONNECTIONS)
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*[requests(client, latencies) for client in active])
+    duration = time.perf_counter() - start
+    latencies.sort()
+    print('{} requests on {} active connections in {:.2f}s ({:.0f}/s), median latency {:.2f} ms, 99% {:.2f} ms'.format(
+        len(latencies), len(active), duration, len(latencies) / duration, latencies[len(latencies) // 2] * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000))
+    print('server memory at end {:.1f} MB'.format(server_memory(pid) or 0))
+
+    for client in idle + active:
+        client.disconnect_from_host()
+
+
+if __name__ == '__main__':
+    server = Process(target=run, args=(PORT, 'local'), daemon=True)
+    server.start()
+    time.sleep(2)  # wait for the server to listen
+
+    loop = new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(benchmark(loop, server.pid))
+    loop.close()
+
+    server.terminate()
@@ -0,0 +1,300 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import time
+
+from PySide import QtCore, QtNetwork
+
+from base.network import Dispatcher, NetworkClient, PRESET_DICTIONARY, broadcast
+import lib.protocol as protocol
+
+"""
+    Tests of the network client with channels and requests (base/network.py). Two clients are connected by in-memory
+    sockets, bytes only move on transfer(), so that slow receivers can be simulated. Run with pytest or directly (from
+    the source folder).
+"""
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+class Socket(QtCore.QObject):
+    """
+        Stands in for a QtNetwork.QTcpSocket connected to a peer socket. Written bytes wait until transfer().
+    """
+
+    readyRead = QtCore.Signal()
+    error = QtCore.Signal(QtNetwork.QAbstractSocket.SocketError)
+    connected = QtCore.Signal()
+    disconnected = QtCore.Signal()
+    bytesWritten = QtCore.Signal(int)
+
+    def __init__(self):
+        super().__init__()
+        self.peer = None
+        self.incoming = bytearray()
+        self.outgoing = bytearray()
+        self.aborted = False
+
+    def write(self, data):
+        self.outgoing += bytes(data)
+        return len(data)
+
+    def bytesToWrite(self):
+        return len(self.outgoing)
+
+    def readAll(self):
+        data = bytes(self.incoming)
+        self.incoming.clear()
+        return QtCore.QByteArray(data)
+
+    def abort(self):
+        self.aborted = True
+
+    def disconnectFromHost(self):
+        pass
+
+    def transfer(self, size=None):
+        """
+            Moves (at most size) written bytes to the peer.
+        """
+        size = len(self.outgoing) if size is None else size
+        data = bytes(self.outgoing[:size])
+        del self.outgoing[:size]
+        if data:
+            self.bytesWritten.emit(len(data))
+            self.peer.incoming += data
+            self.peer.readyRead.emit()
+
+
+def connected_clients():
+    """
+        Two NetworkClients connected to each other (with the codec negotiated).
+    """
+    clients = []
+    for _ in range(2):
+        client = NetworkClient()
+        client.set_socket(Socket())
+        clients.append(client)
+    a, b = clients
+    a.socket.peer = b.socket
+    b.socket.peer = a.socket
+    a.socket.connected.emit()
+    exchange(a, b)
+    assert a.negotiated and b.negotiated
+    return a, b
+
+
+def busy(client):
+    timers = [client.flush_timer] + ([client.dispatcher.timer] if client.dispatcher is not None else [])
+    return client.socket.outgoing or client.send_queue or any(timer.isActive() for timer in timers)
+
+
+def exchange(*clients, timeout=5):
+    """
+        Processes Qt events and moves all written bytes until nothing is waiting anymore.
+    """
+    end = time.perf_counter() + timeout
+    while any(busy(client) for client in clients):
+        assert time.perf_counter() < end, 'timeout'
+        app.processEvents()
+        for client in clients:
+            client.socket.transfer()
+
+
+def wait_for(condition, timeout=5):
+    """
+        Processes Qt events until the condition is true.
+    """
+    end = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < end, 'timeout'
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def test_request_reply():
+    a, b = connected_clients()
+    b.connect_to_channel('double', lambda client, message: client.reply(message, message['value'] * 2))
+    results = []
+    a.request('double', {'value': 21}, lambda client, result: results.append(result))
+    a.request('double', {'value': 1}, lambda client, result: results.append(result))
+    exchange(a, b)
+    assert results == [42, 2]
+    assert not a.pending_requests and not b.incoming_requests
+
+
+def test_request_error():
+    a, b = connected_clients()
+    b.connect_to_channel('fail', lambda client, message: client.reply_error(message, 'failed'))
+    results = []
+    errors = []
+    request_id = a.request('fail', {}, lambda client, result: results.append(result),
+                           failed=lambda request_id, error: errors.append((request_id, error)))
+    exchange(a, b)
+    assert not results and errors == [(request_id, 'failed')]
+
+
+def test_request_timeout():
+    a, b = connected_clients()
+    b.connect_to_channel('silent', lambda client, message: None)
+    errors = []
+    request_id = a.request('silent', {}, None, timeout=1, failed=lambda request_id, error: errors.append(error))
+    exchange(a, b)
+    wait_for(lambda: errors)
+    assert errors == ['timeout'] and request_id not in a.pending_requests
+
+
+def test_cancel_request():
+    a, b = connected_clients()
+    received = []
+    b.connect_to_channel('work', lambda client, message: received.append(message))
+    cancelled = []
+    b.request_cancelled.connect(lambda client, request_id: cancelled.append(request_id))
+    results = []
+    request_id = a.request('work', {}, lambda client, result: results.append(result))
+    exchange(a, b)
+    assert request_id in b.incoming_requests
+    a.cancel_request(request_id)
+    exchange(a, b)
+    assert cancelled == [request_id] and not b.incoming_requests
+    # the reply of a cancelled request is not sent anymore
+    b.reply(received[0], 'result')
+    assert not busy(b)
+    exchange(a, b)
+    assert not results
+
+def test_late_cancel():
+    a, b = connected_clients()
+    b.connect_to_channel('work', lambda client, message: client.reply(message, 'result'))
+    cancelled = []
+    b.request_cancelled.connect(lambda client, request_id: cancelled.append(request_id))
+    request_id = a.request('work', {}, lambda client, result: None)
+    # the cancel crosses the reply (already answered on the other side)
+    a.socket.transfer()
+    app.processEvents()
+    a.cancel_request(request_id)
+    exchange(a, b)
+    assert not cancelled and not b.incoming_requests
+
+def test_broadcast():
+    compression = protocol.CompressionPolicy(threshold=64, zdict=PRESET_DICTIONARY)
+    pairs = [connected_clients() for _ in range(2)]
+    received = []
+    progress = []
+    for a, b in pairs:
+        b.connect_to_channel('news', lambda client, message: received.append(message))
+        b.stream_progress.connect(lambda label, size, total: progress.append(label))
+    # the second one streams large letters
+    pairs[1][0].stream_threshold = 1000
+    for message in ('small', os.urandom(10000)):
+        broadcast([a for a, b in pairs], 'news', message, compression)
+        for a, b in pairs:
+            exchange(a, b)
+        assert received == [message, message]
+        received.clear()
+    assert pairs[0][0].stream_counter == 0 and pairs[1][0].stream_counter == 1 and progress == ['news']
+
+def test_backpressure():
+    a, b = connected_clients()
+    a.high_watermark = 1000
+    a.low_watermark = 100
+    a.set_channel_policy('drop', 'drop')
+    a.set_channel_policy('state', 'coalesce')
+    received = []
+    for channel_name in ('data', 'drop', 'state'):
+        b.connect_to_channel(channel_name, lambda client, message: received.append(message))
+    throttled = []
+    a.throttle_changed.connect(throttled.append)
+    data = os.urandom(2000)
+    a.send('data', data)
+    a.flush()
+    assert a.throttled and throttled == [True]
+    # while throttled only the last state is kept, the rest is dropped, letters without policy are sent
+    a.send('drop', 'dropped')
+    for state in range(3):
+        a.send('state', state)
+    a.send('data', 'sent')
+    exchange(a, b)
+    assert not a.throttled and throttled == [True, False]
+    assert received == [data, 'sent', 2]
+    stats = a.stats()
+    assert stats['dropped'] == 1 and stats['coalesced'] == 2 and stats['throttle_count'] == 1
+
+
+def test_backpressure_abort():
+    a, b = connected_clients()
+    a.max_buffered = 1000
+    a.send('data', os.urandom(2000))
+    a.flush()
+    # the other side does not read
+    assert a.socket.aborted
+
+def test_dispatcher_priorities():
+    a, b = connected_clients()
+    b.dispatcher = Dispatcher()
+    b.dispatcher.set_priority('bulk', Dispatcher.LOW)
+    b.dispatcher.set_priority('urgent', Dispatcher.HIGH)
+    received = []
+    for channel_name in ('bulk', 'chat', 'urgent'):
+        b.connect_to_channel(channel_name, lambda client, message: received.append(message))
+    # arrive together, delivered by priority class
+    for channel_name in ('bulk', 'chat', 'urgent', 'chat'):
+        a.send(channel_name, channel_name)
+    exchange(a, b)
+    assert received == ['urgent', 'chat', 'chat', 'bulk']
+    assert [stats['count'] for stats in b.dispatcher.stats()] == [1, 2, 1]
+    assert all(stats['depth'] == 0 for stats in b.dispatcher.stats())
+
+
+def test_dispatcher_time_budget():
+    a, b = connected_clients()
+    b.dispatcher = Dispatcher(time_budget=0.01)
+    received = []
+
+    def slow(client, message):
+        received.append(message)
+        time.sleep(0.02)
+
+    b.connect_to_channel('slow', slow)
+    a.send('slow', 1)
+    a.send('slow', 2)
+    a.flush()
+    a.socket.transfer()
+    # the rest waits for the next event loop iteration
+    b.dispatcher.dispatch()
+    assert received == [1] and b.dispatcher.stats()[Dispatcher.NORMAL]['depth'] == 1
+    exchange(a, b)
+    assert received == [1, 2]
+
+
+def test_dispatcher_cancel_while_queued():
+    a, b = connected_clients()
+    b.dispatcher = Dispatcher()
+    received = []
+    b.connect_to_channel('work', lambda client, message: received.append(message))
+    request_id = a.request('work', {}, None)
+    a.cancel_request(request_id)
+    # the cancel (high priority) is delivered first, the request not anymore
+    exchange(a, b)
+    assert not received and not b.incoming_requests
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
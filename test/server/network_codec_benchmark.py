@@ -0,0 +1,43 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import timeit
+import zlib
+
+from base import constants as c
+import lib.protocol as protocol
+from server.scenario_files import create_scenario_preview, ScenarioHeaderIndex
+
+"""
+    Compares the wire codecs (encode/decode time and bytes on the wire) for typical payloads.
+"""
+
+# payloads of the scenario_preview and core_scenario_titles channels
+
+preview = create_scenario_preview(c.extend(c.Core_Scenario_Folder, 'Europe1814.scenario'))
+index = ScenarioHeaderIndex(c.Core_Scenario_Folder)
+index.refresh()
+titles = {'scenarios': index.titles()}
+
+for payload_name, payload in (('scenario_preview', preview), ('core_scenario_titles', titles)):
+    for codec in protocol.CODECS.values():
+        encoded = codec.encode(payload)
+        number = 10
+        encode_time = timeit.timeit(lambda: codec.encode(payload), number=number) / number
+        decode_time = timeit.timeit(lambda: codec.decode(encoded), number=number) / number
+        print('{} {}: encode {:.2f} ms, decode {:.2f} ms, {} bytes, {} bytes compressed'.format(
+            payload_name, codec.name, encode_time * 1000, decode_time * 1000, len(encoded),
+            len(zlib.compress(encoded))))
@@ -0,0 +1,194 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import zlib
+from array import array
+
+import lib.protocol as protocol
+
+"""
+    Tests of the wire protocol (lib/protocol.py), no Qt needed. Run with pytest or directly (from the source folder).
+"""
+
+
+def raises(function, *args):
+    """
+        True if calling the function with the arguments raises a RuntimeError.
+    """
+    try:
+        function(*args)
+    except RuntimeError:
+        return True
+    return False
+
+
+def test_codecs():
+    value = {'channel': 'test', 'content': {'number': 12, 'big': 2 ** 70, 'float': 0.5, 'list': [None, True, 'text'],
+                                            'bytes': b'\x00\x01'}}
+    for codec in protocol.CODECS.values():
+        assert codec.decode(codec.encode(value)) == value
+
+
+def test_binary_arrays():
+    for typecode in protocol.ARRAY_TYPECODES:
+        values = array(typecode, range(5))
+        decoded = protocol.BinaryCodec.decode(protocol.BinaryCodec.encode(values))
+        assert decoded.format == typecode and list(decoded) == list(values)
+
+
+def test_binary_empty_arrays():
+    for typecode in protocol.ARRAY_TYPECODES + 'lL':
+        decoded = protocol.BinaryCodec.decode(protocol.BinaryCodec.encode({'map': array(typecode)}))
+        assert len(decoded['map']) == 0
+
+
+def test_binary_malformed():
+    data = protocol.BinaryCodec.encode({'map': array('h', [1, 2, 3]), 'name': 'text'})
+    for end in range(len(data)):
+        assert raises(protocol.BinaryCodec.decode, data[:end])
+
+
+def test_frame_decoder_partial():
+    frames = [b'first', b'second', b'third' * 1000]
+    data = b''.join(protocol.length_prefixed(frame) for frame in frames)
+    decoder = protocol.FrameDecoder()
+    received = []
+    for position in range(0, len(data), 3):
+        received.extend(decoder.feed(data[position:position + 3]))
+    assert received == frames and decoder.pending() == 0
+
+
+def test_frame_decoder_coalesced():
+    frames = [b'first', b'second', b'third']
+    data = b''.join(protocol.length_prefixed(frame) for frame in frames)
+    decoder = protocol.FrameDecoder()
+    # all frames and the beginning of the next one at once
+    assert decoder.feed(data + data[:7]) == frames
+    assert decoder.pending() == 7
+    assert decoder.feed(data[7:]) == frames
+    assert decoder.pending() == 0
+
+
+def test_frame_decoder_size_limit():
+    decoder = protocol.FrameDecoder(max_frame_size=10)
+    assert decoder.feed(protocol.length_prefixed(b'x' * 10)) == [b'x' * 10]
+    # the length prefix alone is enough to refuse the frame
+    assert raises(decoder.feed, protocol.length_prefix(b'x' * 11))
+
+
+def test_empty_frame():
+    # every frame has at least the header byte
+    assert raises(protocol.FrameDecoder().feed, protocol.length_prefixed(b''))
+    assert raises(protocol.decode_frame, b'')
+
+
+def test_negotiate_codec():
+    assert protocol.negotiate_codec(['yaml', 'binary']) is protocol.BinaryCodec
+    assert protocol.negotiate_codec(['yaml']) is protocol.YamlCodec
+    assert protocol.negotiate_codec(['unknown']) is protocol.YamlCodec
+
+
+def test_frames():
+    compression = protocol.CompressionPolicy(threshold=64, zdict=protocol.create_preset_dictionary(['channel']))
+    for codec in protocol.CODECS.values():
+        for value in ({'channel': 'test'}, {'channel': 'test', 'content': 'text ' * 1000}):
+            frame = protocol.encode_frame(value, codec, compression=compression)
+            assert protocol.decode_frame(frame, compression, (codec.id,)) == (value, False)
+    frame = protocol.encode_frame({'codecs': ['binary']}, protocol.YamlCodec, control=True)
+    assert protocol.decode_frame(frame, codecs=(protocol.BinaryCodec.id,)) == ({'codecs': ['binary']}, True)
+
+
+def test_frames_not_negotiated():
+    # data frames only with the negotiated codec, control frames only with the YAML codec
+    frame = protocol.encode_frame({'channel': 'test'}, protocol.YamlCodec)
+    assert raises(protocol.decode_frame, frame, None, (protocol.BinaryCodec.id,))
+    frame = protocol.encode_frame({'codecs': ['binary']}, protocol.BinaryCodec, control=True)
+    assert raises(protocol.decode_frame, frame)
+    assert raises(protocol.decode_frame, bytes((protocol.CODEC_MASK,)) + b'data')
+
+
+def test_compression_policy():
+    zdict = protocol.create_preset_dictionary([{'channel': 'test'}])
+    compression = protocol.CompressionPolicy(threshold=64, zdict=zdict, zdict_max_size=1024)
+    # below the threshold
+    assert compression.compress(b'a' * 63) == (b'a' * 63, 0)
+    # small with the preset dictionary, large without
+    for size, flags in ((100, protocol.FLAG_COMPRESSED | protocol.FLAG_ZDICT), (100000, protocol.FLAG_COMPRESSED)):
+        data, compressed_flags = compression.compress(b'a' * size)
+        assert compressed_flags == flags and len(data) < size
+        assert compression.decompress(data, compressed_flags) == b'a' * size
+    # incompressible data is sent as it is
+    data = os.urandom(1000)
+    assert compression.compress(data) == (data, 0)
+    stats = compression.stats()
+    assert stats['frames'] == 4 and stats['compressed_frames'] == 2 and stats['ratio'] < 1
+    # larger levels for smaller data
+    assert compression.level(100) >= compression.level(10 ** 6)
+
+
+def test_decompression_limits():
+    compression = protocol.CompressionPolicy()
+    bomb = zlib.compress(bytes(10 ** 6))
+    assert compression.decompress(bomb, protocol.FLAG_COMPRESSED, max_size=10 ** 6) == bytes(10 ** 6)
+    assert raises(compression.decompress, bomb, protocol.FLAG_COMPRESSED, 10 ** 6 - 1)
+    assert raises(compression.decompress, bomb[:-10], protocol.FLAG_COMPRESSED)
+    assert raises(compression.decompress, b'no zlib', protocol.FLAG_COMPRESSED)
+    # preset dictionary but none given
+    assert raises(compression.decompress, bomb, protocol.FLAG_COMPRESSED | protocol.FLAG_ZDICT)
+
+
+def test_stream_assembler():
+    assembler = protocol.StreamAssembler()
+    data = os.urandom(10000)
+    assembler.start(1, len(data))
+    assembler.start(2, 3)
+    chunks = [protocol.chunk_frame(1, data[position:position + 4096]) for position in range(0, len(data), 4096)]
+    assert protocol.is_chunk_frame(chunks[0])
+    assert assembler.add(chunks[0]) == (1, 4096, len(data), None)
+    assert assembler.add(protocol.chunk_frame(2, b'abc')) == (2, 3, 3, b'abc')
+    assert assembler.add(chunks[1])[3] is None
+    assert assembler.pending() == 8192
+    assert assembler.add(chunks[2]) == (1, len(data), len(data), data)
+    assert assembler.pending() == 0 and not assembler.streams
+
+
+def test_stream_assembler_limits():
+    assembler = protocol.StreamAssembler(max_stream_size=100, max_streams=2, max_total_size=150)
+    assert raises(assembler.start, 1, 101)
+    assert raises(assembler.start, 1, 0)
+    assert raises(assembler.start, 'id', 10)
+    assembler.start(1, 100)
+    assert raises(assembler.start, 1, 10)
+    # total size
+    assert raises(assembler.start, 2, 51)
+    assembler.start(2, 50)
+    # number of streams
+    assert raises(assembler.start, 3, 1)
+    # unknown stream, too short chunk frame, longer than announced
+    assert raises(assembler.add, protocol.chunk_frame(3, b'data'))
+    assert raises(assembler.add, protocol.chunk_frame(1, b'')[:4])
+    assert raises(assembler.add, protocol.chunk_frame(2, bytes(51)))
+    # completed streams make room again
+    assembler.add(protocol.chunk_frame(2, bytes(50)))
+    assembler.start(3, 50)
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
@@ -0,0 +1,158 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import tempfile
+from threading import Thread
+
+import lib.utils as u
+from base.constants import PropertyKeyNames as k, NationPropertyKeyNames as kn
+from server.scenario_files import ScenarioHeaderIndex, ScenarioPreviewCache, create_scenario_preview
+
+"""
+    Tests of the scenario files without Qt (server/scenario_files.py). Run with pytest or directly (from the source
+    folder).
+"""
+
+
+def write_scenario(file_name, title, mtime=None):
+    """
+        Writes a small scenario file (version 1, everything in YAML): a map of 3 x 2 tiles with one province of two
+        tiles belonging to one nation. Optionally sets the modification time of the file.
+    """
+    writer = u.ZipArchiveWriter(file_name)
+    writer.write_as_yaml('properties', {k.TITLE: title, k.DESCRIPTION: 'Description', k.MAP_COLUMNS: 3,
+                                        k.MAP_ROWS: 2, k.RIVERS: []})
+    writer.write_as_yaml('map', {'terrain': [0, 1, 1, 0, 0, 1], 'resource': [0] * 6})
+    writer.write_as_yaml('provinces', {0: {'tiles': [[1, 0], [2, 0]], 'nation': 0}})
+    writer.write_as_yaml('nations', {0: {'properties': {kn.NAME: 'Nation', kn.COLOR: '#ff0000'}, 'provinces': [0]}})
+    del writer
+    if mtime is not None:
+        os.utime(file_name, (mtime, mtime))
+
+
+def test_header_index():
+    with tempfile.TemporaryDirectory() as folder:
+        write_scenario(os.path.join(folder, 'b.scenario'), 'Second')
+        write_scenario(os.path.join(folder, 'a.scenario'), 'First')
+        index_file = os.path.join(folder, 'scenarios.index')
+        index = ScenarioHeaderIndex(folder, index_file)
+        assert index.refresh()
+        assert index.titles() == [('First', os.path.join(folder, 'a.scenario')),
+                                  ('Second', os.path.join(folder, 'b.scenario'))]
+        header = index.header('a.scenario')
+        assert header[k.MAP_COLUMNS] == 3 and header['nations'][0][kn.NAME] == 'Nation'
+        # nothing changed
+        assert not index.refresh()
+
+        # persisted, known right away after a restart
+        assert ScenarioHeaderIndex(folder, index_file).titles() == index.titles()
+
+        # changed and deleted files
+        write_scenario(os.path.join(folder, 'a.scenario'), 'Changed', mtime=1000)
+        os.remove(os.path.join(folder, 'b.scenario'))
+        assert index.refresh()
+        assert index.titles() == [('Changed', os.path.join(folder, 'a.scenario'))]
+
+
+def test_header_index_corrupt_file():
+    with tempfile.TemporaryDirectory() as folder:
+        write_scenario(os.path.join(folder, 'good.scenario'), 'Good')
+        with open(os.path.join(folder, 'corrupt.scenario'), 'wb') as file:
+            file.write(b'not a zip file')
+        index = ScenarioHeaderIndex(folder)
+        index.refresh()
+        assert [title for title, file_name in index.titles()] == ['Good']
+        # not tried again until it changes
+        assert not index.refresh()
+        write_scenario(os.path.join(folder, 'corrupt.scenario'), 'Repaired', mtime=1000)
+        assert index.refresh()
+        assert [title for title, file_name in index.titles()] == ['Good', 'Repaired']
+
+
+def test_indexed_file():
+    with tempfile.TemporaryDirectory() as folder:
+        write_scenario(os.path.join(folder, 'a.scenario'), 'First')
+        index = ScenarioHeaderIndex(folder)
+        index.refresh()
+        file_name = os.path.join(folder, 'a.scenario')
+        assert index.indexed_file(file_name) == file_name
+        # only indexed files in the folder
+        for other in (os.path.join(folder, 'b.scenario'), 'a.scenario', os.path.join(folder, '..', 'a.scenario'),
+                      os.path.join(folder, 'sub', '..', '..', 'a.scenario'), None, ['a.scenario']):
+            assert index.indexed_file(other) is None
+
+
+def test_preview():
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'a.scenario')
+        write_scenario(file_name, 'First')
+        preview = create_scenario_preview(file_name)
+        assert preview[k.TITLE] == 'First' and preview[k.MAP_COLUMNS] == 3
+        assert preview['nations'] == {0: {kn.NAME: 'Nation', kn.COLOR: '#ff0000', kn.DESCRIPTION: None}}
+        assert list(preview['map']) == [-1, 0, 0, -1, -1, -1]
+        polygon, = preview['outlines'][0]
+        assert sorted(polygon) == [[1, 0], [1, 1], [3, 0], [3, 1]]
+
+
+def test_preview_cache():
+    with tempfile.TemporaryDirectory() as folder:
+        file_names = [os.path.join(folder, '{}.scenario'.format(name)) for name in 'abc']
+        for file_name in file_names:
+            write_scenario(file_name, 'Title')
+        cache = ScenarioPreviewCache(capacity=2)
+        assert cache.lookup(file_names[0]) is None
+        preview = cache.get(file_names[0])
+        assert cache.lookup(file_names[0]) is preview and cache.get(file_names[0]) is preview
+        # persisted next to the file, a new cache loads it from there
+        assert os.path.isfile(file_names[0] + '.preview')
+        persisted = ScenarioPreviewCache().get(file_names[0])
+        assert persisted is not preview and list(persisted['map']) == list(preview['map'])
+        assert persisted['outlines'] == preview['outlines']
+
+        # least recently used previews are dropped
+        cache.get(file_names[1])
+        cache.get(file_names[0])
+        cache.get(file_names[2])
+        assert cache.lookup(file_names[1]) is None and cache.lookup(file_names[0]) is preview
+
+        # a changed file gets a new preview
+        write_scenario(file_names[0], 'Changed', mtime=1000)
+        assert cache.lookup(file_names[0]) is None
+        assert cache.get(file_names[0])[k.TITLE] == 'Changed'
+
+
+def test_preview_cache_threads():
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'a.scenario')
+        write_scenario(file_name, 'First')
+        cache = ScenarioPreviewCache(persist=False)
+        previews = []
+        threads = [Thread(target=lambda: previews.append(cache.get(file_name))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # all got the same (single) preview
+        assert len(previews) == 8 and all(preview is previews[0] for preview in previews)
+        assert not os.path.isfile(file_name + '.preview')
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
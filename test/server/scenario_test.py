@@ -0,0 +1,141 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+import os
+import tempfile
+
+import lib.utils as u
+from base.constants import PropertyKeyNames as k
+from server.scenario import Scenario
+
+"""
+    Tests of the scenario (server/scenario.py). Run with pytest or directly (from the source folder).
+"""
+
+
+def small_scenario():
+    """
+        A scenario with a map of 5 x 4 tiles and two provinces.
+    """
+    scenario = Scenario()
+    scenario.create_map(5, 4)
+    for province, tiles in ((scenario.new_province(), ([0, 0], [1, 0], [0, 1])),
+                            (scenario.new_province(), ([4, 3], [3, 3]))):
+        for position in tiles:
+            scenario.add_province_map_tile(province, position)
+    return scenario
+
+
+def test_province_map():
+    scenario = small_scenario()
+    assert scenario.get_province_at(1, 0) == 0
+    assert scenario.get_province_at(3, 3) == 1
+    assert scenario.get_province_at(2, 2) is None
+    province_map = scenario.province_map()
+    assert len(province_map) == 20
+    assert province_map[scenario.map_index(0, 1)] == 0
+    assert list(province_map).count(-1) == 15
+
+
+def test_province_map_tile_taken():
+    scenario = small_scenario()
+    # adding a tile twice to the same province does nothing, to another province fails
+    scenario.add_province_map_tile(0, [0, 0])
+    try:
+        scenario.add_province_map_tile(1, [0, 0])
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'tile of another province added'
+    assert scenario.get_province_at(0, 0) == 0
+
+
+def test_lazy_province_tiles():
+    scenario = small_scenario()
+    # derived from the province map when first needed
+    assert scenario._province_tiles is None
+    assert scenario.get_tiles_of_province(0) == [[0, 0], [1, 0], [0, 1]]
+    assert scenario.get_tiles_of_province(1) == [[3, 3], [4, 3]]
+    # then kept up to date
+    province = scenario.new_province()
+    scenario.add_province_map_tile(province, [2, 2])
+    scenario.add_province_map_tile(0, [2, 0])
+    assert scenario.get_tiles_of_province(province) == [[2, 2]]
+    assert [2, 0] in scenario.get_tiles_of_province(0)
+
+
+def save_and_load(scenario):
+    """
+        Saves a scenario to a temporary file and loads it again. Returns the loaded scenario and the names in the file.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'test.scenario')
+        scenario.save(file_name)
+        names = u.ZipArchiveReader(file_name).namelist()
+        loaded = Scenario()
+        loaded.load(file_name, with_rules=False)
+        # detach from the memory mapped file before it is deleted
+        loaded.save(os.path.join(folder, 'copy.scenario'))
+    return loaded, names
+
+
+def test_format_round_trip():
+    scenario = small_scenario()
+    scenario[k.TITLE] = 'Test'
+    scenario.set_terrain_at(2, 1, 3)
+    scenario.set_resource_at(4, 0, 2)
+    nation = scenario.new_nation()
+    scenario.set_nation_property(nation, 'name', 'Nation')
+    scenario.transfer_province_to_nation(1, nation)
+
+    loaded, names = save_and_load(scenario)
+    assert {'header', 'map.terrain', 'map.resource', 'map.province'} <= set(names)
+    assert loaded[k.TITLE] == 'Test'
+    assert loaded.terrain_at(2, 1) == 3 and loaded.resource_at(4, 0) == 2
+    assert list(loaded.province_map()) == list(scenario.province_map())
+    assert loaded.get_tiles_of_province(0) == scenario.get_tiles_of_province(0)
+    assert loaded.get_provinces_of_nation(nation) == [1]
+    assert loaded.nation_map() == scenario.nation_map()
+
+
+def test_format_upgrade():
+    # version 1: everything in YAML, the tiles of the provinces stored with the provinces
+    with tempfile.TemporaryDirectory() as folder:
+        file_name = os.path.join(folder, 'old.scenario')
+        writer = u.ZipArchiveWriter(file_name)
+        writer.write_as_yaml('properties', {k.TITLE: 'Old', k.MAP_COLUMNS: 3, k.MAP_ROWS: 2, k.RIVERS: []})
+        writer.write_as_yaml('map', {'terrain': [0, 1, 1, 0, 0, 2], 'resource': [0] * 6})
+        writer.write_as_yaml('provinces', {0: {'tiles': [[1, 0], [2, 0]], 'nation': None}})
+        writer.write_as_yaml('nations', {})
+        del writer
+        scenario = Scenario()
+        scenario.load(file_name, with_rules=False)
+
+    assert list(scenario.province_map()) == [-1, 0, 0, -1, -1, -1]
+    assert scenario.get_tiles_of_province(0) == [[1, 0], [2, 0]]
+    assert scenario.terrain_at(2, 1) == 2
+    # saved in the current format, without the tiles lists
+    loaded, names = save_and_load(scenario)
+    assert 'map.province' in names
+    assert list(loaded.province_map()) == [-1, 0, 0, -1, -1, -1]
+    assert 'tiles' not in loaded._provinces[0]
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))
@@ -0,0 +1,122 @@
+# Imperialism remake
+# Copyright (C) 2015 Trilarion
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+import time
+
+from PySide import QtCore
+
+from server.workers import WorkerPool
+
+"""
+    Tests of the worker pool (server/workers.py) with a thread pool. Run with pytest or directly (from the source
+    folder).
+"""
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def wait_for(condition, timeout=5):
+    """
+        Processes Qt events (results of the jobs are delivered by queued signals) until the condition is true.
+    """
+    end = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < end, 'timeout'
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def test_results():
+    pool = WorkerPool(ThreadPoolExecutor(2))
+    results = []
+    errors = []
+    pool.submit('sum', sum, ([1, 2, 3],), results.append)
+    pool.submit('fail', fail, ('failed',), results.append, errors.append)
+    wait_for(lambda: results and errors)
+    assert results == [6] and str(errors[0]) == 'failed'
+    assert pool.stats()['pending'] == 0
+    timings = pool.stats()['timings']
+    assert timings['sum']['count'] == 1 and timings['fail']['errors'] == 1
+    pool.shutdown()
+
+
+def test_max_pending():
+    pool = WorkerPool(ThreadPoolExecutor(1), max_pending=2)
+    release = Event()
+    results = []
+    assert pool.submit('wait', release.wait, (), results.append) is not None
+    assert pool.submit('wait', release.wait, (), results.append) is not None
+    assert pool.submit('wait', release.wait, (), results.append) is None
+    release.set()
+    wait_for(lambda: len(results) == 2)
+    # room again
+    assert pool.submit('wait', release.wait, (), results.append) is not None
+    wait_for(lambda: len(results) == 3)
+    pool.shutdown()
+
+
+def test_single_flight():
+    pool = WorkerPool(ThreadPoolExecutor(2))
+    release = Event()
+    calls = []
+    results = []
+
+    def work():
+        calls.append(1)
+        release.wait()
+        return 'result'
+
+    first = pool.submit('work', work, (), results.append, key='key')
+    second = pool.submit('work', work, (), results.append, key='key')
+    assert first is second
+    release.set()
+    wait_for(lambda: len(results) == 2)
+    assert calls == [1] and results == ['result', 'result']
+    assert pool.stats()['timings']['work']['joined'] == 1
+    # done, the next submission runs again
+    pool.submit('work', work, (), results.append, key='key')
+    wait_for(lambda: len(results) == 3)
+    assert calls == [1, 1]
+    pool.shutdown()
+
+
+def test_cancel():
+    pool = WorkerPool(ThreadPoolExecutor(1))
+    release = Event()
+    results = []
+    callback = results.append
+    pool.submit('wait', release.wait, (), callback)
+    # queued behind the running one, skipped when cancelled (by the same callback)
+    job = pool.submit('skipped', sum, ([1],), callback, key='key')
+    pool.cancel(job, callback)
+    release.set()
+    wait_for(lambda: pool.stats()['pending'] == 0)
+    assert results == [True]
+    assert pool.stats()['timings']['skipped']['cancelled'] == 1
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print('{} passed'.format(name))